@@ -0,0 +1,304 @@
+# ------------------------------------------------------------
+# bench_vp.py
+# ------------------------------------------------------------
+#!/usr/bin/env python3
+"""Benchmarks für die Kette Download → Parsen → Filtern → Vergleichen.
+
+Erzeugt einen synthetischen Plan (``<VpMobil>/<Klassen>/<Kl>/<Pl>/<Std>``
+wie vom Schulserver), liefert ihn über einen lokalen HTTP-Server aus und
+misst pro Stufe Zeit (Median) und Spitzen-Speicher (``tracemalloc``).
+Ergebnisse werden mit ``bench_baseline.json`` verglichen; bei einer
+Verschlechterung endet das Skript mit Exit-Code 1.  Die Referenz gilt nur
+für die Maschine, auf der sie gemessen wurde – sie ist deshalb nicht im
+Repository und wird einmal pro Rechner mit ``--update-baseline`` angelegt.
+
+    python bench_vp.py                      # messen und vergleichen
+    python bench_vp.py --update-baseline    # neue Referenz schreiben
+    python bench_vp.py --classes 60 --lessons 10 --courses 25 --repeat 30
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import http.server
+import json
+import pathlib
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable
+from xml.sax.saxutils import escape
+
+import vp_10e_plan as vp
+
+BASELINE = pathlib.Path(__file__).with_name("bench_baseline.json")
+DAY = dt.date(2025, 5, 28)
+
+_TIMES = [(" 7:15", "08:00"), ("08:05", "08:50"), (" 9:05", "09:50"), ("09:55", "10:40"),
+          ("11:00", "11:45"), ("11:50", "12:35"), ("12:55", "13:40"), ("13:45", "14:30"),
+          ("14:30", "15:15"), ("15:20", "16:05")]
+
+
+# ---------------------------------------------------------------------------
+# Synthetischer Plan
+# ---------------------------------------------------------------------------
+def _klassen(n: int) -> list[str]:
+    names = [f"{j}{c}" for j in range(5, 13) for c in "ABCDEFGH"]
+    names.remove("10E")
+    return ["10E", *names[: max(0, n - 1)]]
+
+
+def _courses(n: int, rnd: random.Random) -> list[tuple[str, str]]:
+    """Eigene Kurse zuerst, dann ausgedachte Kurse bis ``n``."""
+
+    own = sorted(vp.MY_COURSES)
+    extra = [(f"{fa}{i}", f"L{rnd.randrange(100):02d}")
+             for i in range(1, 10) for fa in ("MUS", "SOZ", "TEC", "EVR", "FRZ")]
+    return (own + extra)[:n]
+
+
+def synthetic_plan(
+    classes: int = 40,
+    lessons: int = 10,
+    courses: int = 20,
+    *,
+    seed: int = 0,
+    change: float = 0.0,
+) -> bytes:
+    """Ein Tagesplan mit ``classes`` Klassen à ``lessons`` Stunden.
+
+    Jede Stunde hat 1–3 parallele Kurse aus ``courses`` Kursen; rund jede
+    zehnte fällt aus.  Mit gleichem ``seed`` und ``change > 0`` entsteht
+    eine zweite Fassung, in der ungefähr dieser Anteil der Stunden einen
+    anderen Raum hat oder ausfällt – Futter für ``diff_plans``.
+    """
+
+    rnd = random.Random(seed)
+    mut = random.Random(seed + 1)
+    parts = ["<?xml version='1.0' encoding='utf-8'?>",
+             "<VpMobil><Kopf><planart>K</planart><zeitstempel>28.05.2025, 06:30</zeitstempel>"
+             "<DatumPlan>Mittwoch, 28. Mai 2025</DatumPlan><datei>PlanKl20250528.xml</datei>"
+             "</Kopf><FreieTage /><Klassen>"]
+    pool = _courses(courses, rnd)
+    for kurz in _klassen(classes):
+        parts.append(f"<Kl><Kurz>{kurz}</Kurz><Hash /><KlStunden>")
+        for st in range(1, lessons + 1):
+            von, bis = _TIMES[(st - 1) % len(_TIMES)]
+            parts.append(f'<KlSt ZeitVon="{von}" ZeitBis="{bis}">{st}</KlSt>')
+        parts.append("</KlStunden><Kurse>")
+        for fa, le in pool:
+            parts.append(f'<Ku><KKz KLe="{escape(le)}">{escape(fa.lower())}</KKz></Ku>')
+        parts.append("</Kurse><Unterricht /><Pl>")
+        for st in range(1, lessons + 1):
+            beginn, ende = _TIMES[(st - 1) % len(_TIMES)] if st % 2 else ("", "")
+            for fa, le in rnd.sample(pool, rnd.randint(1, min(3, len(pool)))):
+                ku = fa if fa[-1].isdigit() else ""
+                ra = str(rnd.randrange(100, 330))
+                info = ""
+                cancelled = rnd.random() < 0.1
+                if change and mut.random() < change:
+                    if mut.random() < 0.5:
+                        ra = str(mut.randrange(100, 330))
+                    else:
+                        cancelled = not cancelled
+                if cancelled:
+                    le_x, ra_x, info = "", "", "selbst."
+                else:
+                    le_x, ra_x = le, ra
+                parts.append(
+                    f"<Std><St>{st}</St><Beginn>{beginn}</Beginn><Ende>{ende}</Ende>"
+                    f"<Fa>{escape(fa.title())}</Fa>"
+                    + (f"<Ku2>{escape(ku.lower())}</Ku2>" if ku else "")
+                    + f"<Le>{escape(le_x.title())}</Le><Ra>{ra_x}</Ra>"
+                    f"<Nr>{rnd.randrange(100, 999)}</Nr><If>{escape(info)}</If></Std>"
+                )
+        parts.append("</Pl><Klausuren /><Aufsichten /></Kl>")
+    parts.append("</Klassen><ZusatzInfo /></VpMobil>")
+    return "".join(parts).encode("utf-8")
+
+
+# ---------------------------------------------------------------------------
+# Lokaler Stub-Server
+# ---------------------------------------------------------------------------
+class StubServer:
+    """Liefert ``/PlanKl<YYYYMMDD>.xml`` aus einem Dict aus; sonst 404."""
+
+    def __init__(self, plans: dict[dt.date, bytes]) -> None:
+        files = {f"/PlanKl{d:%Y%m%d}.xml": body for d, body in plans.items()}
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = files.get(self.path)
+                self.send_response(200 if body is not None else 404)
+                body = body if body is not None else b""
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# ---------------------------------------------------------------------------
+# Messen
+# ---------------------------------------------------------------------------
+def measure(fn: Callable[[], object], repeat: int) -> dict[str, float]:
+    """Median-Laufzeit in Sekunden und Spitzen-Speicher eines Laufs in KiB."""
+
+    fn()                                    # aufwärmen (Imports, Pools, Memos)
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": statistics.median(times), "peak_kib": peak / 1024}
+
+
+def run_stages(classes: int = 40, lessons: int = 10, courses: int = 20,
+               repeat: int = 20, subscribers: int = 200) -> dict[str, dict[str, float]]:
+    """Alle Stufen einmal durchmessen; liefert ``{stufe: {seconds, peak_kib}}``."""
+
+    xml = synthetic_plan(classes, lessons, courses)
+    xml2 = synthetic_plan(classes, lessons, courses, change=0.2)
+    plan = vp.parse_plan(xml)
+    plan2 = vp.parse_plan(xml2)
+    all_rows = [r for p in vp.parse_all(xml).values() for r in p.rows]
+    all_rows2 = [r for p in vp.parse_all(xml2).values() for r in p.rows]
+    mine, mine2 = vp.filter_rows(plan.rows), vp.filter_rows(plan2.rows)
+
+    rnd = random.Random(2)
+    pool = _courses(courses, rnd)
+    router = vp.CourseRouter(
+        {str(i): rnd.sample(pool, min(len(pool), 8)) for i in range(subscribers)}
+    )
+
+    results: dict[str, dict[str, float]] = {}
+    with StubServer({DAY: xml}) as server:
+        old = vp.BASE_URL, vp.USERNAME, vp.PASSWORD
+        vp.BASE_URL, vp.USERNAME, vp.PASSWORD = server.url, "bench", "bench"
+        try:
+            def download():
+                vp.forget_plan(DAY)
+                return vp.lade_plan(DAY)
+            results["download"] = measure(download, repeat)
+        finally:
+            vp.BASE_URL, vp.USERNAME, vp.PASSWORD = old
+            vp.forget_plan(DAY)
+
+    stages: dict[str, Callable[[], object]] = {
+        "parse_stream": lambda: vp.parse_plan(xml),
+        "parse_full":   lambda: vp.parse_plan(xml, stream=False),
+        "parse_all":    lambda: vp.parse_all(xml),
+        "filtered_xml": lambda: vp.filtered_xml(plan),
+        "filter_cold":  lambda: vp.CourseFilter(vp.MY_COURSES).filter(all_rows),
+        "filter_warm":  lambda: vp.DEFAULT_FILTER.filter(all_rows),
+        "diff_mine":    lambda: vp.diff_plans(mine, mine2),
+        "diff_all":     lambda: vp.diff_plans(all_rows, all_rows2),
+        "route":        lambda: router.route(all_rows),
+    }
+    for name, fn in stages.items():
+        results[name] = measure(fn, repeat)
+    return results
+
+
+# Mindest-Reserve pro Stufe: Stufen im µs-Bereich schwanken sonst schon
+# durch Timer und Scheduler um mehr als die relative Toleranz.
+MIN_SLACK = 0.25e-3
+
+
+def compare(results: dict, baseline: dict, tolerance: float, slack: float = MIN_SLACK) -> list[str]:
+    """Liste der Stufen, die schlechter als die Referenz sind.
+
+    Erlaubt ist ``ref * (1 + tolerance)``, mindestens aber ``ref + slack``
+    Sekunden.
+    """
+
+    bad = []
+    for name, cur in results.items():
+        ref = baseline.get(name)
+        if ref is None:
+            continue
+        if cur["seconds"] > max(ref["seconds"] * (1 + tolerance), ref["seconds"] + slack):
+            bad.append(f"{name}: {cur['seconds'] * 1e3:.2f} ms > {ref['seconds'] * 1e3:.2f} ms")
+        # Speicher schwankt kaum – feste Reserve statt Zeit-Toleranz
+        if cur["peak_kib"] > ref["peak_kib"] * 1.2 + 64:
+            bad.append(f"{name}: {cur['peak_kib']:.0f} KiB > {ref['peak_kib']:.0f} KiB")
+    return bad
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--classes", type=int, default=40)
+    ap.add_argument("--lessons", type=int, default=10)
+    ap.add_argument("--courses", type=int, default=20)
+    ap.add_argument("--subscribers", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--tolerance", type=float, default=0.5,
+                    help="erlaubte Verlangsamung gegenüber der Referenz (0.5 = +50 %%)")
+    ap.add_argument("--slack-ms", type=float, default=MIN_SLACK * 1e3,
+                    help="absolute Mindest-Reserve pro Stufe in ms")
+    ap.add_argument("--baseline", type=pathlib.Path, default=BASELINE)
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--out", type=pathlib.Path, help="Bericht zusätzlich in diese Datei")
+    args = ap.parse_args(argv)
+
+    params = {"classes": args.classes, "lessons": args.lessons,
+              "courses": args.courses, "subscribers": args.subscribers}
+    results = run_stages(repeat=args.repeat, **params)
+
+    lines = [f"{'Stufe':<14}{'ms':>10}{'KiB':>10}"]
+    for name, r in results.items():
+        lines.append(f"{name:<14}{r['seconds'] * 1e3:>10.3f}{r['peak_kib']:>10.0f}")
+    report = "\n".join(lines)
+    print(report)
+    if args.out:
+        args.out.write_text(report + "\n", encoding="utf-8")
+
+    if args.update_baseline:
+        args.baseline.write_text(
+            json.dumps({"params": params, "stages": results}, indent=2) + "\n", encoding="utf-8"
+        )
+        print(f"Referenz geschrieben → {args.baseline}")
+        return 0
+
+    try:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        print("Keine Referenz – mit --update-baseline anlegen.")
+        return 0
+    if baseline.get("params") != params:
+        print("Referenz wurde mit anderen Parametern gemessen – kein Vergleich.")
+        return 0
+    bad = compare(results, baseline["stages"], args.tolerance, args.slack_ms / 1e3)
+    for b in bad:
+        print("REGRESSION", b)
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
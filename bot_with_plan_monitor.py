@@ -9,7 +9,7 @@ Discord-Bot, der den Vertretungsplan überwacht und Meldungen über
 
 from __future__ import annotations
 
-import unicodedata as _ud
+import re as _re
 import asyncio
 import datetime as dt
 import hashlib
@@ -17,17 +17,28 @@ import json
 import logging
 import os
 import pathlib
-from typing import Dict, List, Set, Optional   # ← bleibt gleich, aber …
+import time
+from contextlib import aclosing
+from typing import TYPE_CHECKING, Callable, Dict, List, Set, Optional   # ← bleibt gleich, aber …
 import xml.etree.ElementTree as ET  # nur für den ParseError-Catch
 
+# discord bleibt ein direkter Import: Tasks und Befehle werden per Dekorator
+# auf Modulebene angelegt.  requests kommt erst mit dem ersten Abruf.
 import discord
-import requests
 from discord.ext import commands, tasks
-from dotenv import load_dotenv
 
 import vp_10e_plan as vp
-vp.mine = vp.keep
-load_dotenv()
+import vp_store
+import vp_metrics
+from vp_metrics import METRICS
+
+if TYPE_CHECKING:
+    import requests
+
+# .env lesen und übernehmen (VP_KLASSE, VP_KURSE …), bevor unten etwas davon
+# abgeleitet wird; auch die os.getenv()-Aufrufe dieses Moduls sehen sie so.
+vp.config()
+vp.mine = vp.DEFAULT_FILTER
 
 # Intervall für den Plan-Check aus der Umgebung laden
 try:
@@ -35,9 +46,31 @@ try:
 except ValueError:
     CHECK_SECONDS = 60.0
 
-def _canon(s: str) -> str:
-    """Unicode-normalisieren, überflüssige Leerzeichen killen."""
-    return _ud.normalize("NFC", " ".join(s.split()))
+# Adaptive Abfrage: CHECK_SECONDS gilt für heute/morgen zur Schulzeit,
+# alles andere wird seltener gefragt – höchstens alle MAX_POLL_SECONDS.
+try:
+    MAX_POLL_SECONDS: float = float(os.getenv("MAX_POLL_SECONDS", "1800"))
+    SCHOOL_HOURS: tuple[int, int] = tuple(int(h) for h in os.getenv("SCHOOL_HOURS", "6-16").split("-", 1))  # type: ignore[assignment]
+except ValueError:
+    MAX_POLL_SECONDS, SCHOOL_HOURS = 1800.0, (6, 16)
+
+# Tageserkennung: Wochenenden auslassen, 404 so lange merken
+SKIP_WEEKENDS = os.getenv("SKIP_WEEKENDS", "true").lower() == "true"
+try:
+    MISS_SECONDS: float = float(os.getenv("MISS_SECONDS", "900"))
+except ValueError:
+    MISS_SECONDS = 900.0
+
+# Prometheus-Endpunkt (nur lokal), 0 = aus
+try:
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", "0"))
+except ValueError:
+    METRICS_PORT = 0
+
+# Meldungstexte und Fingerprints liegen in vp_10e_plan (auch für vp_batch)
+_canon = vp.canon
+alert_key = vp.alert_key
+room_change = vp.room_change
 
 ######
 
@@ -68,22 +101,13 @@ if _fake:
 TOKEN      = os.getenv("DISCORD_TOKEN")
 CHANNEL_ID = int(os.getenv("PLAN_CHANNEL_ID", "0"))
 
-if not TOKEN or CHANNEL_ID == 0:
-    raise RuntimeError("DISCORD_TOKEN oder PLAN_CHANNEL_ID fehlt")
-
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[logging.FileHandler("discord.log", mode="a", encoding="utf-8")],  # ← mode="a"
-    format="%(asctime)s %(levelname)s: %(message)s",
-)
-
-intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot("!", intents=intents)
+# Der Bot entsteht erst in create_bot() (siehe main()); geprüft wird erst
+# beim Start, damit der Import ohne Token klappt.
+bot: commands.Bot | None = None
 
 # Steuerung via .env:
 # SHOW_TICK=true/false  → Kopfzeile senden, auch bei keinen Änderungen
-# SHOW_RES=true/false   → Parsed-Response für Klasse 10E jeden Tag ins Log
+# SHOW_RES=true/false   → XML-Block der Klasse (VP_KLASSE) jeden Tag ins Log
 SHOW_TICK = os.getenv("SHOW_TICK", "false").lower() == "true"
 SHOW_RES  = os.getenv("SHOW_RES",  "false").lower() == "true"
 
@@ -95,14 +119,49 @@ DIR.mkdir(exist_ok=True)
 
 PF = lambda d: DIR / f"{d:%Y%m%d}.json"
 
-def load_json(day: dt.date) -> list | None:
-    """Load a JSON log for ``day``.
+# Ablage: "files" (Standard, logs/*.json|xml) oder "sqlite" (logs/vp.sqlite3).
+# Alle load_*/save_*-Funktionen unten leiten bei "sqlite" an die DB weiter.
+STORAGE = os.getenv("VP_STORAGE", "files").strip().lower()
+_DB = None
+
+def db():
+    """Die SQLite-Ablage oder ``None`` (Dateien).
+
+    Beim ersten Öffnen einer neuen DB wird ``logs/`` einmalig übernommen.
+    """
+
+    global _DB
+    if STORAGE != "sqlite":
+        return None
+    if _DB is None:
+        path = DIR / "vp.sqlite3"
+        fresh = not path.exists()
+        _DB = vp_store.SqliteStore(path)
+        if fresh:
+            n = vp_store.migrate_dir(DIR, _DB)
+            logging.info("SQLite-Ablage angelegt, %d Dateien aus %s übernommen", n, DIR)
+    return _DB
+
+def _write_atomic(path: pathlib.Path, text: str) -> None:
+    """Schreibt ``text`` erst in eine Temp-Datei und benennt sie dann um."""
+
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+def load_json(day: dt.date) -> list[vp.Row] | None:
+    """Load a JSON log for ``day`` as :class:`vp.Row` objects.
 
     Files should be UTF-8 encoded.  To be robust against older logs that might
     have been written with a different codepage, a latin-1 fallback is used
     when UTF-8 decoding fails.
     """
 
+    store = db()
+    if store is not None:
+        payload = store.load_plan(f"{day:%Y%m%d}")
+        return None if payload is None else [vp.Row.from_dict(e) for e in payload]
+
     path = PF(day)
     if not path.exists():
         return None
@@ -110,52 +169,92 @@ def load_json(day: dt.date) -> list | None:
         raw = path.read_text(encoding="utf-8")
     except UnicodeDecodeError:
         raw = path.read_text(encoding="latin-1")
-    return json.loads(raw)
+    return [vp.Row.from_dict(e) for e in json.loads(raw)]
 
 def save_json(day: dt.date, payload: list) -> None:
-    """Write ``payload`` as UTF-8 encoded JSON log."""
-
-    PF(day).write_text(
-        json.dumps(payload, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    """Write ``payload`` (rows or dicts) as UTF-8 encoded JSON log."""
 
-# Pfad und Speicherung für gefilterte XML-Dateien
-XML_PF = lambda d, n=1: DIR / f"{d:%Y%m%d}{'' if n == 1 else '_' + str(n)}.xml"
-
-def _next_xml_path(day: dt.date) -> pathlib.Path:
-    n = 1
-    p = XML_PF(day, n)
-    while p.exists():
-        n += 1
-        p = XML_PF(day, n)
-    return p
+    store = db()
+    if store is not None:
+        store.save_plan(f"{day:%Y%m%d}", [dict(e) for e in payload])
+        return
+    _write_atomic(PF(day), json.dumps([dict(e) for e in payload], ensure_ascii=False, indent=2))
+
+# Gefilterte XML-Snapshots: inhaltsadressiert unter logs/snapshots/
+# (jede Fassung genau einmal, pro Tag nur ein Manifest-Eintrag je Version).
+_SNAPSHOTS: vp_store.SnapshotStore | None = None
+
+def snapshots() -> vp_store.SnapshotStore:
+    """Die Snapshot-Ablage; alte ``<day>[_n].xml`` werden einmalig übernommen."""
+
+    global _SNAPSHOTS
+    root = DIR / "snapshots"
+    if _SNAPSHOTS is None or _SNAPSHOTS.root != root:
+        _SNAPSHOTS = vp_store.SnapshotStore(root)
+        if not _SNAPSHOTS.exists():
+            n = _SNAPSHOTS.import_legacy(DIR)
+            if n:
+                logging.info("%d XML-Snapshots aus %s übernommen", n, DIR)
+    return _SNAPSHOTS
+
+# Vollständiger Verlauf aller Fassungen (ganze Klasse + Changeset der eigenen
+# Kurse); prune_logs fasst ihn nicht an.  Auswertung: vp_store.py history.
+# Weitere Klassen (nur für Abos) bekommen je einen eigenen Verlauf darunter.
+_HISTORY: vp_store.HistoryLog | None = None
+_CLASS_HISTORY: dict[str, vp_store.HistoryLog] = {}
+
+def history(klasse: str | None = None) -> vp_store.HistoryLog:
+    global _HISTORY
+    root = DIR / "history"
+    if klasse is not None and klasse.upper() != vp.KLASSE.upper():
+        root = root / klasse.upper()
+        log = _CLASS_HISTORY.get(klasse.upper())
+        if log is None or log.root != root:
+            log = _CLASS_HISTORY[klasse.upper()] = vp_store.HistoryLog(root)
+        return log
+    if _HISTORY is None or _HISTORY.root != root:
+        _HISTORY = vp_store.HistoryLog(root)
+    return _HISTORY
+
+def has_xml(day: dt.date) -> bool:
+    """Gibt es für ``day`` schon einen XML-Snapshot?"""
+
+    store = db()
+    if store is not None:
+        return store.last_snapshot(f"{day:%Y%m%d}") is not None
+    return snapshots().has(f"{day:%Y%m%d}")
 
 def save_xml(day: dt.date, xml_str: str | None) -> None:
+    """Neue Fassung von ``day`` ablegen (Dateien: beim nächsten ``flush``)."""
+
     if not xml_str:
         return
 
-    existing = sorted(DIR.glob(f"{day:%Y%m%d}*.xml"))
-    if existing:
-        try:
-            if existing[-1].read_text(encoding="utf-8") == xml_str:
-                return
-        except OSError:
-            pass
+    store = db()
+    if store is not None:
+        if store.last_snapshot(f"{day:%Y%m%d}") != xml_str:
+            store.add_snapshot(f"{day:%Y%m%d}", xml_str)
+        return
+    snapshots().add(f"{day:%Y%m%d}", xml_str)
 
-    path = _next_xml_path(day)
-    path.write_text(xml_str, encoding="utf-8")
+def is_schoolday(day: dt.date) -> bool:
+    return day.weekday() < 5
 
 def last_schooldays(n: int = 10) -> Set[str]:
     days, cur = [], dt.date.today()
     while len(days) < n:
-        if cur.weekday() < 5:
+        if is_schoolday(cur):
             days.append(cur)
         cur -= dt.timedelta(1)
     return {d.strftime("%Y%m%d") for d in days}
 
 def prune_logs(n: int = 10) -> None:
     keep = last_schooldays(n)
+    store = db()
+    if store is not None:
+        store.prune(keep, f"{dt.date.today():%Y%m%d}")
+        return
+    snaps = snapshots()          # übernimmt alte XML-Dateien vor dem Löschen
     for f in list(DIR.glob("*.json")) + list(DIR.glob("*.xml")):
         name = f.stem
         try:
@@ -165,6 +264,7 @@ def prune_logs(n: int = 10) -> None:
         if name not in keep and d < dt.date.today():
             try: f.unlink()
             except OSError: pass
+    snaps.prune(keep, f"{dt.date.today():%Y%m%d}")
 
 # --------- Alerts verwalten -------------------------------------------------
 KEEP_DAYS = 21 
@@ -172,6 +272,9 @@ DUP_DAYS  = 16   # innerhalb dieser Frist KEINE erneute Benachrichtigung
 
 ALERTS = DIR / "alerts.json"
 def load_alerts() -> dict[str, set[str]]:
+    store = db()
+    if store is not None:
+        return store.load_alerts(f"{dt.date.today() - dt.timedelta(KEEP_DAYS):%Y%m%d}")
     try:
         raw  = ALERTS.read_text(encoding="utf-8")
         if not raw.strip():                # leere Datei → neu beginnen
@@ -189,23 +292,338 @@ def load_alerts() -> dict[str, set[str]]:
     except (FileNotFoundError, json.JSONDecodeError):
         return {}
 def save_alerts(alerts: Dict[str, Set[str]]) -> None:
+    store = db()
+    if store is not None:
+        store.save_alerts(alerts)
+        return
     serial = {day: sorted(list(msgs)) for day, msgs in alerts.items()}
     # immer UTF-8 schreiben – unabhängig von der Windows-Codepage
-    ALERTS.write_text(
-        json.dumps(serial, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    _write_atomic(ALERTS, json.dumps(serial, ensure_ascii=False, indent=2))
 
 DIGEST = DIR / "last_digest.txt"
 
 def read_digest() -> Optional[str]:
+    store = db()
+    if store is not None:
+        return store.read_digest()
     try:
         return DIGEST.read_text(encoding="utf-8").strip()
     except FileNotFoundError:
         return None
 
 def write_digest(d: str) -> None:
-    DIGEST.write_text(d, encoding="utf-8")
+    store = db()
+    if store is not None:
+        store.write_digest(d)
+        return
+    _write_atomic(DIGEST, d)
+
+# Fingerprint (SHA-256 der rohen XML-Bytes) pro Tag: ist er unverändert,
+# wird der Tag ohne Parsen/Diffen übersprungen.
+FINGERPRINTS = DIR / "fingerprints.json"
+
+def load_fingerprints() -> dict[str, str]:
+    store = db()
+    if store is not None:
+        return store.load_fingerprints()
+    try:
+        return json.loads(FINGERPRINTS.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_fingerprints(fps: dict[str, str]) -> None:
+    store = db()
+    if store is not None:
+        store.save_fingerprints(fps)
+        return
+    _write_atomic(FINGERPRINTS, json.dumps(fps, indent=2, sort_keys=True))
+
+# Dedup-Index der gesendeten Meldungen (Fingerprint → Ablaufzeit)
+DEDUP = DIR / "dedup.json"
+
+def load_dedup() -> dict[str, float]:
+    store = db()
+    if store is not None:
+        return store.load_dedup()
+    try:
+        return json.loads(DEDUP.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_dedup(entries: dict[str, float]) -> None:
+    store = db()
+    if store is not None:
+        store.save_dedup(entries)
+        return
+    _write_atomic(DEDUP, json.dumps(entries))
+
+# Kurs-Abos einzelner Nutzer:
+# {user_id: {"channel": id, "klasse": "10A", "courses": [[FACH, LEHRER], …]}}
+# (ohne "klasse": VP_KLASSE)
+SUBSCRIPTIONS = DIR / "subscriptions.json"
+def load_subscriptions() -> dict[str, dict]:
+    store = db()
+    if store is not None:
+        return store.load_subscriptions()
+    try:
+        return json.loads(SUBSCRIPTIONS.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_subscriptions(subs: dict[str, dict]) -> None:
+    store = db()
+    if store is not None:
+        store.save_subscriptions(subs)
+        return
+    _write_atomic(SUBSCRIPTIONS, json.dumps(subs, ensure_ascii=False, indent=2))
+
+# Noch nicht zugestellte Nachrichten: {channel_id: [text, …]}
+OUTBOX = DIR / "outbox.json"
+def load_outbox() -> dict[int, list[str]]:
+    store = db()
+    if store is not None:
+        return store.load_outbox()
+    try:
+        data = json.loads(OUTBOX.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {int(ch): texts for ch, texts in data.items()}
+
+def save_outbox(outbox: dict[int, list[str]]) -> None:
+    store = db()
+    if store is not None:
+        store.save_outbox(outbox)
+        return
+    _write_atomic(OUTBOX, json.dumps(outbox, ensure_ascii=False, indent=2))
+
+# Meldungstexte aus alerts.json → Fingerprint (für die Übernahme alter Daten)
+_AUSFALL_RE = _re.compile(r"^(\d{4})-(\d\d)-(\d\d) ▸ Ausfall in Stunde (\d+) –(.*) -(?: (.*))?$")
+_RAUM_RE    = _re.compile(r"^(\d{4})-(\d\d)-(\d\d) ▸ Raumänderung: Stunde (\d+) (\S*) .*→ (.*)$")
+_LEHRER_RE  = _re.compile(r"^(\d{4})-(\d\d)-(\d\d) ▸ Lehrerwechsel: Stunde (\d+) (\S*) .*→ (.*)$")
+_ZEIT_RE    = _re.compile(r"^(\d{4})-(\d\d)-(\d\d) ▸ Zeitänderung: Stunde (\d+) (\S*) .*→ (--|[^-\s]+)-(--|[^-\s]+)$")
+
+def _seed_dedup(index: "vp_store.DedupIndex", alerts: dict[str, set[str]]) -> None:
+    """Füllt einen leeren Index aus den bisher gesendeten Meldungstexten."""
+
+    for sent_on, msgs in sorted(alerts.items()):
+        sent = dt.datetime.strptime(sent_on, "%Y%m%d").timestamp()
+        for msg in msgs:
+            if m := _AUSFALL_RE.match(msg):
+                day = dt.date(*map(int, m.group(1, 2, 3)))
+                index.add(alert_key(day, "ausfall", m[4], m[6]), now=sent)
+            elif m := _RAUM_RE.match(msg):
+                day = dt.date(*map(int, m.group(1, 2, 3)))
+                index.add(alert_key(day, "raum", m[4], m[5], m[6]), now=sent)
+            elif m := _LEHRER_RE.match(msg):
+                day = dt.date(*map(int, m.group(1, 2, 3)))
+                index.add(alert_key(day, "lehrer", m[4], m[5], m[6]), now=sent)
+            elif m := _ZEIT_RE.match(msg):
+                day = dt.date(*map(int, m.group(1, 2, 3)))
+                beginn, ende = (None if t == "--" else t for t in m.group(6, 7))
+                index.add(alert_key(day, "zeit", m[4], m[5], beginn, ende), now=sent)
+
+# --------- Zustand im Speicher ----------------------------------------------
+class State:
+    """Langlebiger Zustand des Bots: Alerts, Dedup-Index, Tagespläne, Digest,
+    Fingerprints.
+
+    Wird einmal geladen (Tagespläne erst beim ersten Zugriff) und danach nur
+    noch im Speicher geändert.  :meth:`flush` schreibt gesammelt alles
+    Geänderte über die bekannten ``save_*``-Funktionen (atomar per Umbenennen).
+    """
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self.alerts: dict[str, set[str]] = {}
+        self._alert_days: dict[str, dt.date] = {}
+        self.dedup = vp_store.DedupIndex(DUP_DAYS * 86400)
+        self.digest: Optional[str] = None
+        self.fingerprints: dict[str, str] = {}
+        self.subs: dict[str, dict] = {}
+        self.routers: dict[str, vp.CourseRouter] = {}   # Klasse → Abos
+        self.unseeded: set[str] = set()   # Klassen, deren Verlauf noch einen Grundstand braucht
+        self.outbox: dict[int, list[str]] = {}
+        self._plans: dict[dt.date, list[vp.Row] | None] = {}
+        self._dirty_plans: set[dt.date] = set()
+        self._dirty: set[str] = set()
+        self.pruned_on: dt.date | None = None
+
+    def load(self) -> None:
+        self.alerts = load_alerts()
+        self._alert_days = {d: dt.datetime.strptime(d, "%Y%m%d").date() for d in self.alerts}
+        self.dedup = vp_store.DedupIndex.from_dict(load_dedup(), DUP_DAYS * 86400)
+        if not len(self.dedup) and self.alerts:
+            _seed_dedup(self.dedup, self.alerts)
+        self.dedup.expire()
+        self.digest = read_digest()
+        self.fingerprints = load_fingerprints()
+        self.subs = load_subscriptions()
+        self.routers = {}
+        for sub, info in self.subs.items():
+            self._route(sub, info)
+        self.unseeded = self.klassen() - {vp.KLASSE.upper()}
+        # was vor dem Laden schon eingereiht wurde, bleibt hinten dran
+        queued, self.outbox = self.outbox, load_outbox()
+        for ch, texts in queued.items():
+            self.outbox.setdefault(ch, []).extend(texts)
+        self._plans.clear()
+        self._dirty_plans.clear()
+        self._dirty = {"outbox"} if queued else set()
+        self.loaded = True
+
+    # -- Tagespläne -----------------------------------------------------------
+    def plan(self, day: dt.date) -> list[vp.Row] | None:
+        if day not in self._plans:
+            self._plans[day] = load_json(day)
+        return self._plans[day]
+
+    def set_plan(self, day: dt.date, rows: list) -> None:
+        self._plans[day] = list(rows)
+        self._dirty_plans.add(day)
+
+    # -- Alerts ---------------------------------------------------------------
+    def mark_sent(self, key: str) -> None:
+        self.dedup.add(key)
+        self._dirty.add("dedup")
+
+    def add_alerts(self, day: str, msgs: set[str]) -> None:
+        if day not in self.alerts:
+            self.alerts[day] = set()
+            self._alert_days[day] = dt.datetime.strptime(day, "%Y%m%d").date()
+        self.alerts[day].update(msgs)
+        self._dirty.add("alerts")
+
+    # -- Digest / Fingerprints ------------------------------------------------
+    def set_digest(self, d: str) -> None:
+        self.digest = d
+        self._dirty.add("digest")
+
+    def set_fingerprint(self, day: str, fp: str) -> None:
+        if self.fingerprints.get(day) != fp:
+            self.fingerprints[day] = fp
+            self._dirty.add("fingerprints")
+
+    # -- Abos -----------------------------------------------------------------
+    def subscribe(self, sub: str, channel: int, courses: list[tuple[str, str]],
+                  klasse: str | None = None) -> None:
+        self._unroute(sub)
+        klasse = (klasse or vp.KLASSE).upper()
+        if klasse not in self.routers and klasse != vp.KLASSE.upper():
+            self.unseeded.add(klasse)   # erst Grundstand, dann Meldungen (siehe check())
+        self.subs[sub] = {"channel": channel, "klasse": klasse,
+                          "courses": [list(c) for c in courses]}
+        self._route(sub, self.subs[sub])
+        self._dirty.add("subscriptions")
+
+    def unsubscribe(self, sub: str) -> bool:
+        if sub not in self.subs:
+            return False
+        self._unroute(sub)
+        del self.subs[sub]
+        self._dirty.add("subscriptions")
+        return True
+
+    def klassen(self) -> set[str]:
+        """Alle Klassen mit mindestens einem Abo."""
+        return set(self.routers)
+
+    def _route(self, sub: str, info: dict) -> None:
+        klasse = (info.get("klasse") or vp.KLASSE).upper()
+        self.routers.setdefault(klasse, vp.CourseRouter()).add(sub, [tuple(c) for c in info["courses"]])
+
+    def _unroute(self, sub: str) -> None:
+        info = self.subs.get(sub)
+        if info is None:
+            return
+        klasse = (info.get("klasse") or vp.KLASSE).upper()
+        router = self.routers.get(klasse)
+        if router is not None:
+            router.remove(sub)
+            if not len(router):
+                del self.routers[klasse]
+
+    # -- Warteschlange --------------------------------------------------------
+    def enqueue(self, channel: int, text: str) -> None:
+        """``text`` (ggf. in Teilen ≤ MAX_MESSAGE) für ``channel`` einreihen."""
+
+        parts = split_message(text)
+        if parts:
+            self.outbox.setdefault(channel, []).extend(parts)
+            self._dirty.add("outbox")
+
+    def delivered(self, channel: int, n: int) -> None:
+        """Die ersten ``n`` Einträge von ``channel`` sind raus."""
+
+        del self.outbox[channel][:n]
+        if not self.outbox[channel]:
+            del self.outbox[channel]
+        self._dirty.add("outbox")
+
+    def prune(self, today: dt.date) -> None:
+        """Vergangene Tage und zu alte Alerts aus dem Speicher werfen."""
+
+        for d in [d for d in self._plans if d < today and d not in self._dirty_plans]:
+            del self._plans[d]
+        today_str = f"{today:%Y%m%d}"
+        for d in [d for d in self.fingerprints if d < today_str]:
+            del self.fingerprints[d]
+            self._dirty.add("fingerprints")
+        for d in [d for d, day in self._alert_days.items() if (today - day).days > KEEP_DAYS]:
+            del self.alerts[d], self._alert_days[d]
+            self._dirty.add("alerts")
+        if self.dedup.expire():
+            self._dirty.add("dedup")
+
+    def flush(self) -> None:
+        """Alle Änderungen seit dem letzten Aufruf auf die Platte schreiben."""
+
+        self.flush_job()()
+
+    def flush_job(self) -> Callable[[], None]:
+        """Kopiert alles Geänderte und liefert die Funktion, die es schreibt.
+
+        Auf der Event-Loop aufrufen, das Ergebnis darf dann in einem
+        Worker-Thread laufen (``asyncio.to_thread``): Befehle wie ``!kurse``
+        ändern den Zustand nur auf der Loop, der Thread sieht nur Kopien.
+        """
+
+        plans = {d: list(self._plans[d]) for d in sorted(self._dirty_plans)
+                 if self._plans.get(d) is not None}
+        self._dirty_plans.clear()
+        dirty, self._dirty = self._dirty, set()
+        jobs: list[Callable[[], None]] = []
+        if "alerts" in dirty:
+            alerts = {d: set(m) for d, m in self.alerts.items()}
+            jobs.append(lambda: save_alerts(alerts))
+        if "dedup" in dirty:
+            dedup = self.dedup.to_dict()
+            jobs.append(lambda: save_dedup(dedup))
+        if "digest" in dirty and self.digest is not None:
+            digest = self.digest
+            jobs.append(lambda: write_digest(digest))
+        if "fingerprints" in dirty:
+            fps = dict(self.fingerprints)
+            jobs.append(lambda: save_fingerprints(fps))
+        if "subscriptions" in dirty:
+            subs = {sub: {**info, "courses": [list(c) for c in info["courses"]]}
+                    for sub, info in self.subs.items()}
+            jobs.append(lambda: save_subscriptions(subs))
+        if "outbox" in dirty:
+            outbox = {ch: list(t) for ch, t in self.outbox.items()}
+            jobs.append(lambda: save_outbox(outbox))
+        stores = [s for s in (_SNAPSHOTS, _HISTORY, *_CLASS_HISTORY.values()) if s is not None]
+
+        def write() -> None:
+            with METRICS.timer("flush"):
+                for day, rows in plans.items():
+                    save_json(day, rows)
+                for job in jobs:
+                    job()
+                for store in stores:
+                    store.flush()
+        return write
+
+state = State()
 
 # ---------------------------------------------------------------------------
 # Anzeige-Hilfen
@@ -214,151 +632,474 @@ def fmt(e: dict) -> str:
     fach = f"AUSFALL ({e['kurs']})" if e["fach"] == "---" else e["fach"]
     return f"{e['stunde']} {e['beginn'] or '--'}-{e['ende'] or '--'} {fach} {e['raum'] or ''} {e['lehrer'] or ''}"
 
-def room_change(old: dict, new: dict) -> Optional[str]:
-    ko, kn = (old.get("kurs") or old.get("fach") or "").upper(), (new.get("kurs") or new.get("fach") or "").upper()
-    ro, rn = (old.get("raum") or "").strip().upper(), (new.get("raum") or "").strip().upper()
+# ---------------------------------------------------------------------------
+# Zustellung
+# ---------------------------------------------------------------------------
+MAX_MESSAGE = 2000      # Discord-Limit pro Nachricht
+MAX_BACKOFF = 300       # höchstens so viele Sekunden warten
+
+def split_message(text: str, limit: int = MAX_MESSAGE) -> list[str]:
+    """Teilt ``text`` an Zeilengrenzen in Stücke ≤ ``limit`` Zeichen."""
+
+    parts: list[str] = []
+    cur = ""
+    for line in text.split("\n"):
+        while len(line) > limit:             # überlange Zeile hart schneiden
+            if cur:
+                parts.append(cur)
+                cur = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if cur and len(cur) + 1 + len(line) > limit:
+            parts.append(cur)
+            cur = line
+        else:
+            cur = f"{cur}\n{line}" if cur else line
+    if cur:
+        parts.append(cur)
+    return parts
+
+def _pack(texts: list[str], limit: int = MAX_MESSAGE) -> tuple[str, int]:
+    """So viele Einträge vom Anfang wie in eine Nachricht passen."""
+
+    chunk, n = texts[0], 1
+    while n < len(texts) and len(chunk) + 1 + len(texts[n]) <= limit:
+        chunk += "\n" + texts[n]
+        n += 1
+    return chunk, n
 
-    # ignore if the new entry doesn't specify a room
-    if not rn:
-        return None
+_retry_at: dict[int, float] = {}   # Channel → frühester nächster Versuch (monotonic)
+_failures: dict[int, int] = {}
 
-    if old["stunde"] == new["stunde"] and ko == kn and ro != rn:
-        return f"Raumänderung: Stunde {new['stunde']} {kn} {old.get('raum') or '---'} → {new.get('raum') or '---'}"
-    return None
+@tasks.loop(seconds=0.5)
+async def deliver_outbox() -> None:
+    """Leert die Warteschlange: pro Channel zusammengefasst, mit Backoff.
+
+    Läuft getrennt von ``check()`` – der Tick reiht nur ein und wartet nie
+    auf Discord.
+    """
+
+    now = asyncio.get_running_loop().time()
+    for cid in list(state.outbox):
+        if _retry_at.get(cid, 0) > now:
+            continue
+        try:
+            # nicht im Cache (DMs nach einem Neustart, gelöschte Channels):
+            # beim Server nachfragen – NotFound/Forbidden verwerfen unten
+            ch = bot.get_channel(cid) or await bot.fetch_channel(cid)
+            while state.outbox.get(cid):
+                text, n = _pack(state.outbox[cid])
+                with METRICS.timer("discord_send"):
+                    await ch.send(text)
+                state.delivered(cid, n)
+                METRICS.inc("messages_sent")
+                _failures.pop(cid, None)
+                _retry_at.pop(cid, None)
+        except (discord.Forbidden, discord.NotFound) as exc:
+            METRICS.inc("send_errors")
+            logging.warning("Channel %s nicht erreichbar (%s) – %d Nachrichten verworfen",
+                            cid, exc, len(state.outbox[cid]))
+            state.delivered(cid, len(state.outbox[cid]))
+            _failures.pop(cid, None)
+            _retry_at.pop(cid, None)
+        except (discord.HTTPException, discord.RateLimited) as exc:
+            METRICS.inc("send_errors")
+            fails = _failures[cid] = _failures.get(cid, 0) + 1
+            wait = getattr(exc, "retry_after", None) or min(MAX_BACKOFF, 2 ** fails)
+            _retry_at[cid] = asyncio.get_running_loop().time() + wait
+            logging.warning("Senden an %s fehlgeschlagen (%s) – neuer Versuch in %.0f s",
+                            cid, exc, wait)
+    METRICS.set("queue_depth", sum(map(len, state.outbox.values())))
+
+# ---------------------------------------------------------------------------
+# Meldungen
+# ---------------------------------------------------------------------------
+def change_lines(day: dt.date, changes: vp.Changeset, scope: tuple = ()) -> list[str]:
+    """Noch nicht gemeldete Ausfälle, Raum-, Lehrer- und Zeitänderungen als ``• …``-Zeilen.
+
+    Entdoppelt wird über den Fingerprint der Meldung (Tag, Art, Stunde,
+    Kurs …) – kleine Textänderungen in "info" lösen also keine erneute
+    Meldung aus.  ``scope`` trennt die Fingerprints verschiedener Abos.
+    """
+
+    lines: list[str] = []
+    for key, line in vp.alert_lines(day, changes, scope):
+        if key not in state.dedup:
+            lines.append(line)
+            state.mark_sent(key)
+    return lines
+
+def route_changes(day: dt.date, prev: list, cur: list, klasse: str | None = None) -> dict[str, list[str]]:
+    """Abo → neue Meldungszeilen für ``day`` (ein Routing-Durchlauf je Stand).
+
+    ``prev``/``cur`` sind alle Zeilen von ``klasse`` (Standard: VP_KLASSE).
+    """
+
+    router = state.routers.get((klasse or vp.KLASSE).upper())
+    if router is None:
+        return {}
+    before, after = router.route(prev), router.route(cur)
+    out: dict[str, list[str]] = {}
+    for sub in after.keys() | before.keys():
+        old = before.get(sub, ())
+        changes = vp.diff_plans(old, vp.track_lessons(cur, after.get(sub, ()), old))
+        if changes:
+            lines = change_lines(day, changes, ("abo", sub))
+            if lines:
+                out[sub] = lines
+    return out
+
+def _collect_subs(sub_out: dict[str, list[str]], day: dt.date, prev_full: dict,
+                  rows: list, klasse: str) -> None:
+    """Abo-Meldungen einer Klasse für ``day`` in ``sub_out`` sammeln."""
+
+    if (klasse or vp.KLASSE).upper() not in state.routers:
+        return
+    prev = [vp.Row.from_dict(e) for e in prev_full["rows"]]
+    for sub, lines in route_changes(day, prev, rows, klasse).items():
+        sub_out.setdefault(sub, []).append(f"📅 {day:%d.%m.%Y}\n" + "\n".join(lines))
+        METRICS.inc("subscriber_alerts", len(lines))
+
+def _seed_history(day_str: str, xml_bytes: bytes, klassen: set[str]) -> None:
+    """Aktuellen Stand von ``klassen`` als Grundstand in ihren Verlauf schreiben
+    (ohne Meldungen; gleiche Zeilen legen keine neue Fassung an)."""
+
+    try:
+        plans = vp.parse_all(xml_bytes, klassen)
+    except ET.ParseError:
+        return   # kommt beim nächsten geänderten Stand über den normalen Weg
+    for klasse, plan in plans.items():
+        history(klasse).append(day_str, plan.rows, klasse=klasse)
+
+def _deliver_subs(sub_out: dict[str, list[str]]) -> None:
+    """Abo-Meldungen für den Kanal des jeweiligen Abos einreihen."""
+
+    for sub, blocks in sub_out.items():
+        info = state.subs.get(sub)
+        if info is not None:
+            state.enqueue(info["channel"], f"<@{sub}>\n" + "\n".join(blocks))
+
+# ---------------------------------------------------------------------------
+# Abfrageplan
+# ---------------------------------------------------------------------------
+class PollScheduler:
+    """Wann welcher Tag wieder beim Server abgefragt wird.
+
+    Heute/morgen werden zur Schulzeit (Mo–Fr, SCHOOL_HOURS) im Grundtakt
+    CHECK_SECONDS geholt, sonst und für weiter entfernte Tage seltener.
+    Jede Abfrage ohne Änderung verdoppelt die Wartezeit bis
+    MAX_POLL_SECONDS, eine erkannte Änderung holt den Tag im nächsten Tick
+    sofort wieder.  Zeiten sind ``time.monotonic()``-Sekunden.
+    """
+
+    def __init__(self, base: float = CHECK_SECONDS, cap: float = MAX_POLL_SECONDS,
+                 hours: tuple[int, int] = SCHOOL_HOURS) -> None:
+        self.base, self.cap, self.hours = base, max(cap, base), hours
+        self._next: dict[dt.date, float] = {}
+        self._quiet: dict[dt.date, int] = {}     # Abfragen ohne Änderung in Folge
+
+    def interval(self, day: dt.date, now: dt.datetime) -> float:
+        ahead = (day - now.date()).days
+        busy = now.weekday() < 5 and self.hours[0] <= now.hour < self.hours[1]
+        if ahead <= 1:
+            iv, steps = (self.base, 2) if busy else (self.base * 4, 6)
+        else:
+            iv, steps = self.base * 2 * ahead, 6
+        iv *= 2 ** min(self._quiet.get(day, 0), steps)
+        return min(self.cap, iv)
+
+    def due(self, day: dt.date, t: float) -> bool:
+        return self._next.get(day, 0.0) <= t
+
+    def record(self, day: dt.date, t: float, now: dt.datetime, *, changed: bool = False) -> None:
+        """Ergebnis einer Abfrage von ``day`` verbuchen."""
+
+        if changed:
+            self._quiet[day] = 0
+            self._next[day] = t
+        else:
+            self._next[day] = t + self.interval(day, now)
+            self._quiet[day] = self._quiet.get(day, 0) + 1
+
+    def next_due(self) -> float | None:
+        return min(self._next.values(), default=None)
+
+    def forget(self, before: dt.date) -> None:
+        for d in [d for d in self._next if d < before]:
+            self._next.pop(d, None)
+            self._quiet.pop(d, None)
+
+scheduler = PollScheduler()
+
+class DayDiscovery:
+    """Welche Tage überhaupt beim Server angefragt werden.
+
+    Wochenenden fallen ganz weg (wie bei :func:`last_schooldays`).  Ein 404
+    kommt in einen Negativ-Cache: kurz (MISS_SECONDS) für Tage bis knapp
+    hinter dem am weitesten entfernten veröffentlichten Tag (der "Front"),
+    lang (MAX_POLL_SECONDS) für alles dahinter – dort erscheint ein Plan
+    frühestens, wenn die Front nachgerückt ist.
+    """
+
+    def __init__(self, ttl: float = MISS_SECONDS, far_ttl: float = MAX_POLL_SECONDS,
+                 ahead: int = 2, weekends: bool = SKIP_WEEKENDS) -> None:
+        self.ttl, self.far_ttl, self.ahead, self.weekends = ttl, max(far_ttl, ttl), ahead, weekends
+        self.frontier: dt.date | None = None
+        self._missing: dict[dt.date, float] = {}   # Tag → 404 gilt bis (monotonic)
+
+    def skip(self, day: dt.date) -> bool:
+        return self.weekends and not is_schoolday(day)
+
+    def known_missing(self, day: dt.date, t: float) -> bool:
+        return self._missing.get(day, 0.0) > t
+
+    def _edge(self) -> dt.date | None:
+        """Front plus ``ahead`` Schultage."""
+
+        if self.frontier is None:
+            return None
+        day, n = self.frontier, 0
+        while n < self.ahead:
+            day += dt.timedelta(1)
+            n += not self.skip(day)
+        return day
+
+    def miss(self, day: dt.date, t: float) -> None:
+        edge = self._edge()
+        self._missing[day] = t + (self.ttl if edge is None or day <= edge else self.far_ttl)
+
+    def hit(self, day: dt.date) -> None:
+        self._missing.pop(day, None)
+        if self.frontier is None or day > self.frontier:
+            self.frontier = day
+
+    def next_expiry(self) -> float | None:
+        return min(self._missing.values(), default=None)
+
+    def forget(self, before: dt.date) -> None:
+        for d in [d for d in self._missing if d < before]:
+            del self._missing[d]
+
+discovery = DayDiscovery()
+
+def _now() -> dt.datetime:
+    # dt.date.today() statt datetime.now().date(), damit FAKE_DATE greift
+    return dt.datetime.combine(dt.date.today(), dt.datetime.now().time())
+
+def _not_found(day: dt.date) -> requests.HTTPError:
+    """Ein 404 wie vom Server, für Tage aus dem Negativ-Cache."""
+
+    import requests
+
+    r = requests.Response()
+    r.status_code = 404
+    return requests.HTTPError(f"404 (zwischengespeichert) für {day}", response=r)
 
 # ---------------------------------------------------------------------------
 # Haupt-Task
 # ---------------------------------------------------------------------------
 @tasks.loop(seconds=CHECK_SECONDS)
 async def check() -> None:
+    import requests
+
     ch = bot.get_channel(CHANNEL_ID)
     if ch is None:
         return
 
-    alerts    = load_alerts()
+    t_tick = time.perf_counter()
+    if not state.loaded:
+        state.load()
     today     = dt.date.today()
     today_str = today.strftime("%Y%m%d")
 
-    # ► alle Meldungen der letzten DUP_DAYS sammeln
-    recent_msgs: set[str] = set()
-    for day, msgs in alerts.items():
-        if (today - dt.datetime.strptime(day, "%Y%m%d").date()).days <= DUP_DAYS:
-            recent_msgs |= msgs
-
-    sent_msgs: set[str] = set(recent_msgs)  # wird unten erweitert
-    day_offset = 0
-    misses = 0
     head = f"🕒 Tick {dt.datetime.now():%H:%M:%S}" if SHOW_TICK else ""
     out: List[str] = []
-
-    while misses < 16:
-        day = dt.date.today() + dt.timedelta(day_offset)
-        day_offset += 1
+    sub_out: dict[str, list[str]] = {}
+
+    # Nur fällige Tage gehen an den Server: bekannte 404 (Negativ-Cache)
+    # gelten weiter als 404, nicht fällige Tage als unverändert.
+    t0, now = time.monotonic(), _now()
+    skipped: set[dt.date] = set()
+    # Neu abonnierte Klassen: einmal alle Tage vollständig holen (304 liefert
+    # dann den gecachten Body), damit ihr Verlauf einen Grundstand bekommt –
+    # sonst bliebe die erste Änderung danach unbemerkt.
+    seed = set(state.unseeded)
+
+    async def fetch(day: dt.date) -> bytes | None:
+        if discovery.known_missing(day, t0):
+            METRICS.inc("days_known_missing")
+            raise _not_found(day)
+        if not seed and not scheduler.due(day, t0):
+            skipped.add(day)
+            METRICS.inc("days_skipped")
+            return None
         try:
-            # lade rohe XML
-            xml_bytes = await asyncio.to_thread(vp.lade_plan, day)
-            misses = 0
-            if SHOW_RES:
-                # nur den <Kl Kurz="10E">-Block extrahieren und loggen
-                root = ET.fromstring(xml_bytes)
-                kl10e = next(
-                    (k for k in root.findall(".//Kl")
-                    if (k.findtext("Kurz") or "").strip().upper() == "10E"),
-                    None
-                )
-                if kl10e is not None:
-                    snippet = ET.tostring(kl10e, encoding="unicode")
-                    logging.info(f"[Raw 10E XML {day:%Y%m%d}] {snippet}")
+            data = await vp.lade_plan_async(day, conditional=not seed)
         except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                misses += 1
-                continue
-            logging.exception("HTTP-Fehler")
-            break
-
-        # ------------------------------------------------------------
-        # XML parsen  (kann fehlschlagen, wenn die Datei unvollständig
-        # übertragen wurde → ParseError).  Dann Tag überspringen.
-        # ------------------------------------------------------------
+            if e.response is not None and e.response.status_code == 404:
+                discovery.miss(day, t0)
+            raise
+        discovery.hit(day)
+        if data is None:
+            scheduler.record(day, t0, now)
+        return data
+
+    # change_lines() markiert Meldungen schon beim Erzeugen als gesendet –
+    # was gesammelt ist, wird deshalb auch eingereiht, wenn der Tick mit
+    # einem unerwarteten Fehler abbricht (sonst wäre es für immer verloren).
+    try:
+        # Tage parallel laden; die Ergebnisse kommen in Datumsreihenfolge an,
+        # Schluss ist nach 16 aufeinanderfolgenden 404ern (Wochenenden zählen nicht).
         try:
-            rows_all = vp.parse_xml(xml_bytes)
-            mine = [e for e in rows_all if vp.mine(e)]
-        except ET.ParseError:
-            # XML kann bei Verbindungsproblemen unvollständig sein -> nochmal versuchen
-            logging.warning("Ungültiges XML für %s – neuer Versuch", day)
-            try:
-                xml_bytes = await asyncio.to_thread(vp.lade_plan, day)
-                mine = [e for e in vp.parse_xml(xml_bytes) if vp.mine(e)]
-            except (ET.ParseError, requests.HTTPError) as err:
-                logging.warning(
-                    "Ungültiges XML für %s – Plan wird übersprungen (%s)",
-                    day,
-                    err,
-                )
-                continue
-
-        prev = load_json(day)
-        xml_first = not any(DIR.glob(f"{day:%Y%m%d}*.xml"))
-        xml_str = vp.filtered_xml(xml_bytes)
-        if xml_first:
-            save_xml(day, xml_str)
-
-        if prev is None:
-            save_json(day, mine)
-            save_xml(day, xml_str)
-            out.append(f"📅 {day:%d.%m.%Y} – neuer Plan ({len(mine)})")
-            logging.info(f"[Neuer Plan] {day:%Y-%m-%d} – {len(mine)} Einträge geladen")
-            continue
-
-        # -------- Meldungen generieren ------------------------------------
-        rc_msgs: list[str] = []
-
-        # 1) Ausfälle
-        for e in (en for en in mine if en["fach"] == "---"):
-            raw  = (f"{day:%Y-%m-%d} ▸ Ausfall in Stunde {e['stunde']} – "
-                f"{e['info'] or ''} - {e.get('kurs') or ''}")
-            msg  = _canon(raw)
-            if msg not in sent_msgs:
-                rc_msgs.append(f"• {msg}")
-                sent_msgs.add(msg)
-
-        # 2) Raumänderungen
-        for e in mine:
-            o = next(
-                (
-                    o for o in prev
-                    if o["stunde"] == e["stunde"]
-                    and (o["kurs"] or o["fach"]) == (e["kurs"] or e["fach"])
-                ),
-                None
-            )
-            if o:
-                txt = room_change(o, e)
-                if txt:
-                    raw = f"{day:%Y-%m-%d} ▸ {txt}"
-                    msg = _canon(raw)
-                    if msg not in sent_msgs:
-                        rc_msgs.append(f"• {msg}")
-                        sent_msgs.add(msg)
-
-        # erfolgreiche neue Meldungen persistieren
-        # ► wirklich neue Meldungen des *heutigen* Laufs sichern
-        if rc_msgs:
-            new_today = sent_msgs - recent_msgs
-            if new_today:
-                alerts.setdefault(today_str, set()).update(new_today)
-                save_alerts(alerts)
-            save_json(day, mine)
-
-        if rc_msgs:
-            block = f"📅 {day:%d.%m.%Y}\n" + "\n".join(rc_msgs)
-            out.append(block)
-            logging.info(f"[Planänderung] {day:%Y-%m-%d}\n" + "\n".join(rc_msgs))
-            save_json(day, mine)
-            save_xml(day, xml_str)
-
-
-    prune_logs(10)
+            async with aclosing(
+                vp.lade_tage(today, max_misses=16, fetch=fetch, skip=discovery.skip)
+            ) as tage:
+                async for day, xml_bytes in tage:
+                    if xml_bytes is None:
+                        if day not in skipped:
+                            vp.PARSED_CACHE.touch(day)
+                        continue   # 304 – seit dem letzten Tick unverändert
+                    day_str = f"{day:%Y%m%d}"
+                    fp = hashlib.sha256(xml_bytes).hexdigest()
+                    if state.fingerprints.get(day_str) == fp:
+                        scheduler.record(day, t0, now)
+                        vp.PARSED_CACHE.touch(day)
+                        if seed:
+                            _seed_history(day_str, xml_bytes, seed)
+                        continue   # Byte-gleich mit dem zuletzt verarbeiteten Stand
+                    scheduler.record(day, t0, now, changed=True)
+
+                    # ------------------------------------------------------------
+                    # XML parsen  (kann fehlschlagen, wenn die Datei unvollständig
+                    # übertragen wurde → ParseError).  Dann Tag überspringen.
+                    # Der Plan wird genau einmal geparst und danach überall
+                    # (Filter, Snapshot, SHOW_RES) wiederverwendet.
+                    # ------------------------------------------------------------
+                    klassen = {vp.KLASSE.upper(), *state.klassen()}
+                    try:
+                        with METRICS.timer("parse"):
+                            plans = vp.parse_all(xml_bytes, klassen)
+                    except ET.ParseError:
+                        METRICS.inc("parse_errors")
+                        # XML kann bei Verbindungsproblemen unvollständig sein -> nochmal versuchen
+                        logging.warning("Ungültiges XML für %s – neuer Versuch", day)
+                        vp.forget_plan(day)   # kaputten Body nicht per 304 zurückbekommen
+                        try:
+                            xml_bytes = await vp.lade_plan_async(day)
+                            plans = vp.parse_all(xml_bytes, klassen)
+                            fp = hashlib.sha256(xml_bytes).hexdigest()
+                        except (ET.ParseError, requests.RequestException) as err:
+                            vp.forget_plan(day)
+                            logging.warning(
+                                "Ungültiges XML für %s – Plan wird übersprungen (%s)",
+                                day,
+                                err,
+                            )
+                            continue
+                    plan = plans.get(vp.KLASSE.upper()) or vp.ParsedPlan(vp.KLASSE, None, [])
+                    vp.PARSED_CACHE.put(day, plan)   # für !heute & Co.
+
+                    # Abos anderer Klassen: eigener Verlauf, gleiche Auswertung
+                    for klasse, other in plans.items():
+                        if klasse == vp.KLASSE.upper():
+                            continue
+                        prev_full = history(klasse).read(day_str)
+                        history(klasse).append(day_str, other.rows, klasse=klasse)
+                        if prev_full is not None:
+                            _collect_subs(sub_out, day, prev_full, other.rows, klasse)
+
+                    prev = state.plan(day)
+                    with METRICS.timer("filter"):
+                        # vertretene eigene Stunden (anderer Lehrer) weiter verfolgen
+                        mine = vp.track_lessons(plan.rows, vp.filter_rows(plan.rows), prev or ())
+                    METRICS.inc("rows_parsed", len(plan.rows))
+                    METRICS.inc("rows_filtered", len(mine))
+
+                    if SHOW_RES and plan.kl is not None:
+                        # nur den <Kl>-Block der Klasse loggen
+                        logging.info(f"[Raw {plan.klasse} XML {day:%Y%m%d}] {plan.snippet()}")
+
+                    xml_first = not has_xml(day)
+                    xml_str = vp.filtered_xml(plan)
+                    if xml_first:
+                        save_xml(day, xml_str)
+
+                    if prev is None:
+                        state.set_plan(day, mine)
+                        save_xml(day, xml_str)
+                        history().append(day_str, plan.rows, klasse=plan.klasse)
+                        # Ausfälle werden erst ab dem zweiten Abruf gemeldet – also den
+                        # Cache verwerfen, sonst käme beim nächsten Tick nur ein 304.
+                        # Aus demselben Grund noch keinen Fingerprint merken.
+                        vp.forget_plan(day)
+                        out.append(f"📅 {day:%d.%m.%Y} – neuer Plan ({len(mine)})")
+                        logging.info(f"[Neuer Plan] {day:%Y-%m-%d} – {len(mine)} Einträge geladen")
+                        continue
+
+                    state.set_fingerprint(day_str, fp)
+
+                    # -------- Meldungen generieren ------------------------------------
+                    prev_full = history().read(day_str)
+                    with METRICS.timer("diff"):
+                        changes = vp.diff_plans(prev, mine)
+                    history().append(day_str, plan.rows, changes.to_dict(), klasse=plan.klasse)
+                    rc_msgs = change_lines(day, changes)
+                    METRICS.inc("alerts", len(rc_msgs))
+
+                    # Abonnenten: alle Zeilen einmal verteilen, dann pro Abo vergleichen
+                    if prev_full is not None:
+                        _collect_subs(sub_out, day, prev_full, plan.rows, vp.KLASSE)
+
+                    # erfolgreiche neue Meldungen persistieren
+                    if rc_msgs:
+                        state.add_alerts(today_str, {m[2:] for m in rc_msgs})
+                        state.set_plan(day, mine)
+
+                    if rc_msgs:
+                        block = f"📅 {day:%d.%m.%Y}\n" + "\n".join(rc_msgs)
+                        out.append(block)
+                        logging.info(f"[Planänderung] {day:%Y-%m-%d}\n" + "\n".join(rc_msgs))
+                        save_xml(day, xml_str)
+            state.unseeded -= seed   # alle Tage gesehen
+
+        except requests.RequestException:
+            # HTTP- und Verbindungsfehler (nach allen Wiederholungen): Rest des
+            # Ticks überspringen, schon erzeugte Meldungen aber zustellen
+            METRICS.inc("tick_errors")
+            logging.exception("HTTP-/Verbindungsfehler")
+
+        vp.forget_plan(before=today)
+        vp.PARSED_CACHE.forget(before=today)
+        scheduler.forget(before=today)
+        discovery.forget(before=today)
+        METRICS.set("frontier_days", (discovery.frontier - today).days if discovery.frontier else -1)
+        # nächster Tick, sobald der früheste Tag fällig ist oder ein 404 abläuft
+        # (mind. CHECK_SECONDS)
+        due = [t for t in (scheduler.next_due(), discovery.next_expiry()) if t is not None]
+        wait = CHECK_SECONDS if not due else min(due) - time.monotonic()
+        wait = min(max(wait, CHECK_SECONDS), scheduler.cap)
+        if check.seconds != wait:
+            check.change_interval(seconds=wait)
+        state.prune(today)
+        if state.pruned_on != today:
+            # Verzeichnis nur einmal am Tag aufräumen
+            t = time.perf_counter()
+            await asyncio.to_thread(prune_logs, 10)
+            METRICS.observe("prune_logs", time.perf_counter() - t)
+            state.pruned_on = today
+    finally:
+        try:
+            _deliver(ch, out, head)
+            _deliver_subs(sub_out)
+            METRICS.set("queue_depth", sum(map(len, state.outbox.values())))
+        finally:
+            # gesammelt und außerhalb der Event-Loop auf die Platte schreiben
+            await asyncio.to_thread(state.flush_job())
+            METRICS.observe("tick", time.perf_counter() - t_tick)
+            METRICS.set("tick_interval_seconds", check.seconds or CHECK_SECONDS)
+
+def _deliver(ch, out: List[str], head: str) -> None:
+    """Reiht die gesammelten Blöcke eines Ticks ein (mit Digest-Dedup)."""
 
     # Nur reine Ausfall-Blöcke (ohne Raumänderungen) → nur ersten Ausfall senden
     #if out and all(("Ausfall" in block) and ("Raumänderung" not in block) for block in out):
@@ -382,39 +1123,42 @@ async def check() -> None:
 # duplicate suppression
     payload = "\n".join(out)
     digest = hashlib.sha256(payload.encode()).hexdigest()
-    if digest == read_digest():
+    if digest == state.digest:
         # kein neuer Digest
         if SHOW_TICK:
-            await ch.send(head)
+            state.enqueue(ch.id, head)
         return
-    write_digest(digest)
+    state.set_digest(digest)
 
     # wenn Änderungen vorliegen, sende sie (mit Kopf, falls SHOW_TICK)
     if out:
         text = f"{head}\n{payload}" if SHOW_TICK else payload
-        await ch.send(text)
+        state.enqueue(ch.id, text)
     # falls keine Änderungen, aber SHOW_TICK, sende nur das Tick-Header
     elif SHOW_TICK:
-        await ch.send(head)
+        state.enqueue(ch.id, head)
 
 # ---------------------------------------------------------------------------
 # Slash-/Text-Befehle
 # ---------------------------------------------------------------------------
 async def _send(ctx: commands.Context, day: dt.date, title: str) -> None:
+    import requests
+
+    # aus dem vom Monitor gefüllten Cache; gleichzeitige Anfragen für
+    # denselben Tag lösen höchstens einen Download aus
     try:
-        xml_bytes = await asyncio.to_thread(vp.lade_plan, day)
-    except requests.HTTPError as e:
-        if e.response.status_code == 404:
+        plan = await vp.PARSED_CACHE.fetch(day)
+    except requests.RequestException as e:
+        if e.response is not None and e.response.status_code == 404:
             await ctx.send(f"{title} ist Frei :)")
             return
         await ctx.send("Plan nicht verfügbar.")
         return
-
-    try:
-        mine = [e for e in vp.parse_xml(xml_bytes) if vp.mine(e)]
     except ET.ParseError:
         await ctx.send("Plan konnte nicht gelesen werden.")
         return
+
+    mine = vp.filter_rows(plan.rows)
     if not mine:
         await ctx.send("Keine Stunden für deine Kurse.")
         return
@@ -422,46 +1166,126 @@ async def _send(ctx: commands.Context, day: dt.date, title: str) -> None:
     mine.sort(key=lambda x: x["stunde"])
     header = f"📅 **{title} – {day:%d.%m.%Y}**"
     lines = [f"• {fmt(e)}" for e in mine]
-    await ctx.send("\n".join([header, *lines]))
+    # direkte Antwort (kein Umweg über die Warteschlange), aber im Limit
+    for part in split_message("\n".join([header, *lines])):
+        await ctx.send(part)
 
-@bot.command(name="heute")
+@commands.command(name="heute")
 async def c_today(ctx):     await _send(ctx, dt.date.today(), "Plan heute")
-@bot.command(name="morgen")
+@commands.command(name="morgen")
 async def c_morgen(ctx):    await _send(ctx, dt.date.today() + dt.timedelta(1), "Plan morgen")
-@bot.command(name="übermorgen", aliases=["uebermorgen"])
+@commands.command(name="übermorgen", aliases=["uebermorgen"])
 async def c_over(ctx):      await _send(ctx, dt.date.today() + dt.timedelta(2), "Plan übermorgen")
-@bot.command(name="überübermorgen", aliases=["ueberuebermorgen"])
+@commands.command(name="überübermorgen", aliases=["ueberuebermorgen"])
 async def c_over2(ctx):     await _send(ctx, dt.date.today() + dt.timedelta(3), "Plan überübermorgen")
 
+@commands.command(name="stats")
+async def c_stats(ctx):
+    """Zähler und Laufzeiten seit dem Start (wie ``/metrics``)."""
+
+    for part in split_message("\n".join(["📊 **Statistik**", *METRICS.summary()])):
+        await ctx.send(part)
+
+# Klassenkürzel vorne im Abo: "10A", "9b", "JG11" – Kurse beginnen mit Buchstaben
+_ABO_KLASSE_RE = _re.compile(r"^(\d{1,2}[A-Za-z]{0,3}|JG\d{1,2})\s+(.+)$", _re.IGNORECASE | _re.DOTALL)
+
+def parse_abo(spec: str) -> tuple[str | None, str]:
+    """``"10A GEO1:MÖW, INF1"`` → ``("10A", "GEO1:MÖW, INF1")``; ohne Klasse ``None``."""
+
+    m = _ABO_KLASSE_RE.match(spec.strip())
+    return (m[1].upper(), m[2]) if m else (None, spec)
+
+@commands.command(name="kurse", aliases=["abo"])
+async def c_kurse(ctx, *, spec: str = ""):
+    """``!kurse [KLASSE] GEO1:MÖW, INF1:BOSSE`` abonnieren (ohne Klasse:
+    VP_KLASSE), ``!kurse aus`` beenden, ``!kurse`` zeigt das eigene Abo.
+    Gespeichert wird mit dem nächsten Tick."""
+
+    if not state.loaded:
+        state.load()
+    sub = str(ctx.author.id)
+    spec = spec.strip()
+    if spec.lower() in ("aus", "stop"):
+        ok = state.unsubscribe(sub)
+        await ctx.send("Abo beendet." if ok else "Kein Abo vorhanden.")
+    elif spec:
+        klasse, courses = parse_abo(spec)
+        flt = vp.CourseFilter.parse(courses)
+        state.subscribe(sub, ctx.channel.id, sorted(flt.courses), klasse)
+        await ctx.send(f"Abo gespeichert: {state.subs[sub]['klasse']}, "
+                       f"{len(flt.courses)} Kurse, Meldungen kommen hier.")
+    else:
+        info = state.subs.get(sub)
+        if info is None:
+            await ctx.send("Kein Abo. Beispiel: `!kurse 10A GEO1:MÖW, INF1:BOSSE`")
+            return
+        await ctx.send(f"Deine Kurse ({info.get('klasse') or vp.KLASSE}): "
+                       + ", ".join(f"{f}:{l}" if l else f for f, l in info["courses"]))
+
 # ---------------------------------------------------------------------------
 # Startup
 # ---------------------------------------------------------------------------
-@bot.event
+_METRICS_SERVER = None
+
 async def on_ready():
+    global _METRICS_SERVER
     print("Bot online:", bot.user)
+    if METRICS_PORT and _METRICS_SERVER is None:
+        _METRICS_SERVER = vp_metrics.serve(METRICS_PORT)
+        logging.info("Metriken unter http://127.0.0.1:%d/metrics", METRICS_PORT)
+    if not deliver_outbox.is_running():
+        deliver_outbox.start()
     if not check.is_running():
         check.start()
 
-if __name__ == "__main__":
-    import time, traceback, datetime as dt
+COMMANDS = (c_today, c_morgen, c_over, c_over2, c_kurse, c_stats)
+
+
+def create_bot() -> commands.Bot:
+    """Baut den Bot samt Befehlen und ``on_ready`` – einmal pro Prozess."""
+
+    global bot
+    if bot is None:
+        intents = discord.Intents.default()
+        intents.message_content = True
+        bot = commands.Bot("!", intents=intents)
+        for c in COMMANDS:
+            bot.add_command(c)
+        bot.add_listener(on_ready)
+    return bot
+
+
+def main() -> None:
+    """Startet den Bot und startet ihn nach Abstürzen neu.
+
+    Bot, Befehle, Zustand und Caches bleiben über Neustarts erhalten; nur die
+    Verbindung wird neu aufgebaut (``bot.clear()``).  Die Tasks laufen mit der
+    alten Event-Loop aus und werden von ``on_ready`` neu gestartet; die
+    aiohttp-Session der Downloads wird mit ihr geschlossen.
+    """
 
+    import traceback
+
+    if not TOKEN or CHANNEL_ID == 0:
+        raise RuntimeError("DISCORD_TOKEN oder PLAN_CHANNEL_ID fehlt")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[logging.FileHandler("discord.log", mode="a", encoding="utf-8")],  # ← mode="a"
+        format="%(asctime)s %(levelname)s: %(message)s",
+    )
+
+    async def run(client: commands.Bot) -> None:
+        try:
+            async with client:
+                await client.start(TOKEN)
+        finally:
+            await vp.close_async_session()   # gehört zur Loop, die gleich endet
+
+    client = create_bot()
     while True:
         try:
-            # *** PRO ITERATION EIN NEUER BOT ***
-            intents = discord.Intents.default()
-            intents.message_content = True
-            bot = commands.Bot("!", intents=intents)
-
-            # Commands/Events müssen nach der Instanziierung
-            # erneut registriert werden:
-            bot.add_command(c_today)
-            bot.add_command(c_morgen)
-            bot.add_command(c_over)
-            bot.add_command(c_over2)
-            bot.add_listener(on_ready)
-
-            check.restart()     # Task an den neuen Bot binden
-            bot.run(TOKEN)
+            asyncio.run(run(client))
             break                      # reguläres Ende
 
         except KeyboardInterrupt:      # sauber beenden (systemctl stop / Ctrl-C)
@@ -475,10 +1299,17 @@ if __name__ == "__main__":
                     f"{exc}\n"
                 )
             break          # -> Dienst bleibt gestoppt, bis Token gefixt ist
-        except Exception:                  # andere Crashes → retry            
+        except Exception:                  # andere Crashes → retry
             with open("error.log", "a", encoding="utf-8") as fh:
                 fh.write(
                     f"\n=== {dt.datetime.now():%Y-%m-%d %H:%M:%S} ===\n"
                     f"{traceback.format_exc()}\n"
                 )
             time.sleep(15)             # 15 s Pause, dann neuer Versuch
+            client.clear()             # gleicher Bot, neue Verbindung
+        finally:
+            state.flush()              # Ungeschriebenes nicht verlieren
+
+
+if __name__ == "__main__":
+    main()
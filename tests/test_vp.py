@@ -1,9 +1,12 @@
 import os
 import sys
 import pathlib
+import asyncio
+import time
 import datetime as dt
 
-# ensure required env vars exist before importing module
+# Dummy-Zugangsdaten für die Download- und Bot-Tests (der Import selbst
+# braucht sie nicht mehr, siehe test_import_without_env)
 os.environ.setdefault('VP_USER', 'user')
 os.environ.setdefault('VP_PASS', 'pass')
 os.environ.setdefault('VP_BASE_URL', 'https://example.com')
@@ -47,7 +50,7 @@ def test_parse_xml_basic():
     xml += b"    </Pl>\n"
     xml += b"  </Kl>\n"
     xml += b"</root>\n"
-    rows = vp.parse_xml(xml)
+    rows = [r.to_dict() for r in vp.parse_xml(xml)]
     assert rows == [
         {
             "stunde": 1,
@@ -90,7 +93,7 @@ def test_parse_xml_self_with_room():
     xml += b"    </Pl>\n"
     xml += b"  </Kl>\n"
     xml += b"</root>\n"
-    rows = vp.parse_xml(xml)
+    rows = [r.to_dict() for r in vp.parse_xml(xml)]
     assert rows == [
         {
             "stunde": 1,
@@ -104,6 +107,49 @@ def test_parse_xml_self_with_room():
         }
     ]
 
+def test_parse_xml_stream_matches_full_parse():
+    def kl(name, fach):
+        return (f"<Kl><Kurz>{name}</Kurz><Pl><Std><St>1</St><Fa>{fach}</Fa>"
+                f"<Le>FELD</Le><Ra>114</Ra></Std></Pl></Kl>").encode()
+    xml = (b"<VpMobil><Kopf/><Klassen>" + kl("9A", "DEU")
+           + kl("10E", "MAT") + kl("10F", "ENG") + b"</Klassen></VpMobil>")
+    assert vp.parse_xml(xml, stream=True) == vp.parse_xml(xml)
+    assert vp.parse_xml(xml, stream=True)[0]["fach"] == "MAT"
+    assert vp.parse_xml(xml, "11A", stream=True) == []
+    # der Rest nach dem gesuchten Block wird nicht mehr gelesen
+    assert vp.parse_xml(xml[:-30], stream=True)[0]["fach"] == "MAT"
+
+def test_parse_all_classes_one_pass():
+    xml = (b"<VpMobil><Klassen>"
+           b"<Kl><Kurz>9A</Kurz><Pl><Std><St>1</St><Fa>DEU</Fa></Std></Pl></Kl>"
+           b"<Kl><Kurz>10E</Kurz><Pl><Std><St>2</St><Fa>MAT</Fa></Std></Pl></Kl>"
+           b"<Kl><Kurz>10F</Kurz><Pl/></Kl>"
+           b"</Klassen></VpMobil>")
+    plans = vp.parse_all(xml)
+    assert set(plans) == {"9A", "10E", "10F"}
+    assert plans["10E"].rows == vp.parse_xml(xml, "10E")
+    assert plans["10F"].rows == []
+    some = vp.parse_all(xml, ["10e", "9a", "11B"])
+    assert set(some) == {"9A", "10E"}
+    assert some["9A"].rows[0]["fach"] == "DEU"
+
+def test_row_is_compact_and_dict_compatible():
+    d = {"stunde": 3, "beginn": None, "ende": None, "fach": "MAT",
+         "kurs": None, "lehrer": "FELD", "raum": "114", "info": None}
+    row = vp.Row.from_dict(d)
+    assert not hasattr(row, '__dict__')
+    assert dict(row) == d == row.to_dict()
+    assert row["fach"] == "MAT" and row.get("kurs") is None
+    assert row == vp.Row.from_dict(dict(d)) and len({row, vp.Row.from_dict(d)}) == 1
+    assert bot.fmt(row) == bot.fmt(d)
+    assert vp.keep(row) is True
+
+def test_save_and_load_json_roundtrip(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "PF", lambda d: tmp_path / f"{d:%Y%m%d}.json")
+    rows = [vp.Row(1, "7:15", "08:00", "Mat", None, "Feld", "225", None)]
+    bot.save_json(dt.date(2025, 5, 26), rows)
+    assert bot.load_json(dt.date(2025, 5, 26)) == rows
+
 def test_keep_filtering():
     entry_relevant = {
         "stunde": 1,
@@ -128,12 +174,309 @@ def test_keep_filtering():
     assert vp.keep(entry_relevant) is True
     assert vp.keep(entry_irrelevant) is False
 
+def test_course_filter_matches_keep_rules(monkeypatch):
+    flt = vp.CourseFilter.parse("GEO1:möw, INF1:BOSSE, DEU")
+    R = vp.Row
+    rows = [
+        R(1, None, None, "GEO1", None, "MÖW", None, None),       # Fach+Lehrer
+        R(2, None, None, "GEO1", None, "HANS", None, None),      # falscher Lehrer
+        R(3, None, None, "MUS", "inf1", None, None, None),       # Kurs
+        R(4, None, None, "---", "DEU", None, None, None),        # Ausfall Fach
+        R(5, None, None, "---", "KUN5", None, None, "für geo1"),  # Info
+        R(6, None, None, "---", "KUN5", None, None, "Vertretung BOSSE"),
+    ]
+    assert flt.filter(rows) == [rows[0], rows[2], rows[3], rows[4]]
+    assert [flt(r) for r in rows] == [True, False, True, True, True, False]
+    assert flt.filter(rows) == [r for r in rows if flt(r)]   # aus dem Memo
+
+    # Standardfilter = keep(), jedes andere Callable bleibt austauschbar
+    assert vp.filter_rows(rows, vp.DEFAULT_FILTER) == [r for r in rows if vp.keep(r)]
+    monkeypatch.setattr(vp, "mine", lambda e: e["stunde"] == 6)
+    assert vp.filter_rows(rows) == [rows[5]]
+
+def test_course_router_matches_per_user_filters():
+    subs = {
+        "1": [("GEO1", "MÖW"), ("INF1", "BOSSE")],
+        "2": [("KUN", ""), ("DEU", "PETH")],
+        "3": [("KUN2", "KUGJ")],
+    }
+    router = vp.CourseRouter(subs)
+    R = vp.Row
+    rows = [
+        R(1, None, None, "GEO1", None, "MÖW", None, None),
+        R(2, None, None, "DEU", None, "PETH", None, None),
+        R(3, None, None, "---", "KUN5", None, None, "statt kun2"),   # KUN2 und KUN
+        R(4, None, None, "---", "INF1", None, None, None),
+        R(5, None, None, "MUS", None, "HANS", None, None),
+    ]
+    routed = router.route(rows)
+    for sub, courses in subs.items():
+        flt = vp.CourseFilter(courses)
+        assert routed.get(sub, []) == flt.filter(rows)
+    router.remove("3")
+    assert "3" not in router.route(rows) and len(router) == 2
+
+
+def test_subscriptions_route_changes(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "SUBSCRIPTIONS", tmp_path / "subscriptions.json")
+    monkeypatch.setattr(bot, "state", bot.State())
+    bot.state.subscribe("42", 7, [("MUS", "HANS")])
+    bot.state.subscribe("43", 7, [("GEO1", "MÖW")])
+    bot.state.flush()
+    again = bot.State()
+    again.subs = bot.load_subscriptions()
+    assert again.subs["42"] == {"channel": 7, "klasse": vp.KLASSE, "courses": [["MUS", "HANS"]]}
+
+    R = vp.Row
+    day = dt.date(2025, 5, 28)
+    prev = [R(1, None, None, "MUS", None, "HANS", "101", None),
+            R(2, None, None, "GEO1", None, "MÖW", "102", None)]
+    cur = [R(1, None, None, "MUS", None, "HANS", "105", None),
+           R(2, None, None, "GEO1", None, "MÖW", "102", None)]
+    out = bot.route_changes(day, prev, cur)
+    assert list(out) == ["42"] and "Raumänderung: Stunde 1 MUS 101 → 105" in out["42"][0]
+    assert bot.route_changes(day, prev, cur) == {}          # schon gemeldet
+    assert bot.state.unsubscribe("42") and not bot.state.unsubscribe("42")
+
+def test_split_message_and_pack():
+    text = "\n".join(f"• Zeile {i:04d}" for i in range(400))
+    parts = bot.split_message(text)
+    assert all(len(p) <= bot.MAX_MESSAGE for p in parts) and len(parts) > 1
+    assert "\n".join(parts) == text
+    assert bot.split_message("x" * 4500) == ["x" * 2000, "x" * 2000, "x" * 500]
+    assert bot._pack(["a", "b", "c" * 1999]) == ("a\nb", 2)
+
+
+def test_outbox_batches_backs_off_and_persists(monkeypatch, tmp_path):
+    import discord
+    monkeypatch.setattr(bot, "OUTBOX", tmp_path / "outbox.json")
+    monkeypatch.setattr(bot, "state", bot.State())
+    monkeypatch.setattr(bot, "_retry_at", {})
+    monkeypatch.setattr(bot, "_failures", {})
+    sent, fail = [], [True]
+
+    class Ch:
+        id = 5
+        async def send(self, text):
+            if fail and fail.pop():
+                raise discord.HTTPException(type("R", (), {"status": 500, "reason": "x"})(), "boom")
+            sent.append(text)
+
+    monkeypatch.setattr(bot, "bot", type("B", (), {"get_channel": staticmethod(lambda cid: Ch())})())
+    bot.state.enqueue(5, "erste")
+    bot.state.enqueue(5, "zweite")
+    bot.state.flush()
+
+    # Fehler -> nichts verloren, Backoff gesetzt, auch nach Neustart noch da
+    asyncio.run(bot.deliver_outbox.coro())
+    assert sent == [] and bot._retry_at[5] > 0
+    assert bot.load_outbox() == {5: ["erste", "zweite"]}
+
+    bot._retry_at.clear()
+    asyncio.run(bot.deliver_outbox.coro())
+    assert sent == ["erste\nzweite"] and bot.state.outbox == {}
+    bot.state.flush()
+    assert bot.load_outbox() == {}
+
+def test_outbox_fetches_or_drops_unknown_channels(monkeypatch, tmp_path):
+    import discord
+    monkeypatch.setattr(bot, "OUTBOX", tmp_path / "outbox.json")
+    monkeypatch.setattr(bot, "state", bot.State())
+    monkeypatch.setattr(bot, "_retry_at", {})
+    monkeypatch.setattr(bot, "_failures", {})
+    sent = []
+
+    class Ch:
+        async def send(self, text):
+            sent.append(text)
+
+    async def fetch_channel(cid):
+        if cid == 6:   # z. B. gelöschter Channel
+            raise discord.NotFound(type("R", (), {"status": 404, "reason": "x"})(), "weg")
+        return Ch()    # z. B. DM nach einem Neustart
+
+    monkeypatch.setattr(bot, "bot", type("B", (), {
+        "get_channel": staticmethod(lambda cid: None),
+        "fetch_channel": staticmethod(fetch_channel)})())
+    bot.state.enqueue(5, "dm")
+    bot.state.enqueue(6, "weg")
+    asyncio.run(bot.deliver_outbox.coro())
+    assert sent == ["dm"] and bot.state.outbox == {}
+
+def test_plan_cache_ttl_and_single_flight(monkeypatch):
+    import requests
+    xml = (b"<VpMobil><Klassen><Kl><Kurz>10E</Kurz><Pl><Std><St>1</St><Fa>MAT</Fa>"
+           b"<Le>FELD</Le><Ra>114</Ra></Std></Pl></Kl></Klassen></VpMobil>")
+    day = dt.date(2025, 5, 28)
+    calls = []
+
+    async def load(d):
+        calls.append(d)
+        await asyncio.sleep(0.01)
+        return xml
+
+    cache = vp.PlanCache(ttl=10)
+
+    async def burst():
+        return await asyncio.gather(*(cache.fetch(day, "10E", load=load) for _ in range(10)))
+
+    plans = asyncio.run(burst())
+    assert len(calls) == 1 and all(p is plans[0] for p in plans)
+    assert cache.get(day, "10e") is plans[0]
+    assert cache.get(day, now=time.monotonic() + 11) is None     # abgelaufen
+
+    cache.put(day, plans[0], now=0)
+    cache.touch(day, now=100)
+    assert cache.get(day, now=105) is plans[0]
+    cache.forget(before=dt.date(2025, 5, 29))
+    assert cache.get(day) is None
+
+    async def broken(d):
+        calls.append(d)
+        raise requests.HTTPError("404")
+
+    async def burst_err():
+        return await asyncio.gather(*(cache.fetch(day, load=broken) for _ in range(3)),
+                                    return_exceptions=True)
+
+    calls.clear()
+    errs = asyncio.run(burst_err())
+    assert len(calls) == 1 and all(isinstance(e, requests.HTTPError) for e in errs)
+
+    # Befehle lesen aus dem gemeinsamen Cache
+    monkeypatch.setattr(vp, "PARSED_CACHE", vp.PlanCache(ttl=10))
+    vp.PARSED_CACHE.put(day, plans[0])
+    out = []
+
+    class Ctx:
+        async def send(self, text):
+            out.append(text)
+
+    asyncio.run(bot._send(Ctx(), day, "Plan heute"))
+    assert "MAT" in out[0] and "FELD" in out[0]
+
+def test_poll_scheduler_adapts_intervals():
+    sched = bot.PollScheduler(base=30, cap=1800, hours=(6, 16))
+    monday_9 = dt.datetime(2025, 5, 26, 9, 0)
+    today, tomorrow, later = monday_9.date(), monday_9.date() + dt.timedelta(1), monday_9.date() + dt.timedelta(5)
+
+    assert sched.interval(today, monday_9) == 30
+    assert sched.interval(today, monday_9.replace(hour=22)) == 120      # nachts
+    assert sched.interval(today, dt.datetime(2025, 5, 31, 9)) == 120    # Samstag
+    assert sched.interval(later, monday_9) == 300
+
+    assert sched.due(today, 0)                                           # unbekannt -> sofort
+    for i in range(5):
+        sched.record(today, 0, monday_9)
+    assert sched.interval(today, monday_9) == 120                        # Backoff gedeckelt
+    assert not sched.due(today, 100) and sched.due(today, 120)
+    sched.record(today, 0, monday_9, changed=True)                       # Änderung -> sofort wieder
+    assert sched.due(today, 0) and sched.interval(today, monday_9) == 30
+
+    for i in range(10):
+        sched.record(later, 0, monday_9)
+    assert sched.interval(later, monday_9) == 1800
+    sched.record(tomorrow, 0, monday_9)
+    assert sched.next_due() == 0
+    sched.forget(before=later)
+    assert sched.next_due() == 1800
+
+
+def test_day_discovery_weekends_negative_cache_and_frontier():
+    disc = bot.DayDiscovery(ttl=900, far_ttl=3600, ahead=2, weekends=True)
+    fri, sat, mon = dt.date(2025, 5, 30), dt.date(2025, 5, 31), dt.date(2025, 6, 2)
+    assert disc.skip(sat) and not disc.skip(fri)
+    assert all(bot.is_schoolday(dt.datetime.strptime(d, "%Y%m%d").date())
+               for d in bot.last_schooldays(7))
+
+    disc.miss(mon, 0)                               # noch keine Front -> kurz
+    assert disc.known_missing(mon, 899) and not disc.known_missing(mon, 900)
+    disc.hit(fri)
+    assert disc.frontier == fri and not disc.known_missing(fri, 0)
+    disc.miss(mon, 0)                               # Front + 1 Schultag -> kurz
+    disc.miss(dt.date(2025, 6, 10), 0)              # weit hinter der Front -> lang
+    assert not disc.known_missing(mon, 1000)
+    assert disc.known_missing(dt.date(2025, 6, 10), 3000)
+    assert disc.next_expiry() == 900
+    disc.forget(before=dt.date(2025, 6, 5))
+    assert disc.next_expiry() == 3600
+
+    # lade_tage: Wochenenden werden weder geladen noch als 404 gezählt
+    asked = []
+
+    async def fetch(day):
+        asked.append(day)
+        if day > dt.date(2025, 6, 3):
+            raise bot._not_found(day)
+        return b"x"
+
+    async def run():
+        return [d async for d, _ in vp.lade_tage(fri, max_misses=3, fetch=fetch, skip=disc.skip)]
+
+    assert asyncio.run(run()) == [fri, mon, dt.date(2025, 6, 3)]
+    assert sat not in asked and len(asked) == 6
+
+def test_bench_generator_and_stages():
+    import bench_vp
+    xml = bench_vp.synthetic_plan(classes=5, lessons=4, courses=8)
+    plans = vp.parse_all(xml)
+    assert len(plans) == 5 and "10E" in plans
+    assert all(1 <= r["stunde"] <= 4 for r in plans["10E"].rows)
+    assert bench_vp.synthetic_plan(classes=5, lessons=4, courses=8) == xml      # deterministisch
+    assert vp.diff_plans(plans["10E"].rows,
+                         vp.parse_plan(bench_vp.synthetic_plan(5, 4, 8, change=1.0)).rows)
+
+    res = bench_vp.run_stages(classes=3, lessons=3, courses=6, repeat=1, subscribers=5)
+    assert {"download", "parse_stream", "filtered_xml", "diff_mine", "route"} <= set(res)
+    assert bench_vp.compare(res, res, 0.5) == []
+    ref = {"diff_mine": {"seconds": 60e-6, "peak_kib": 10}, "parse_full": {"seconds": 0.01, "peak_kib": 10}}
+    jitter = {"diff_mine": {"seconds": 150e-6, "peak_kib": 10}, "parse_full": {"seconds": 0.012, "peak_kib": 10}}
+    slow = {"diff_mine": {"seconds": 60e-6, "peak_kib": 10}, "parse_full": {"seconds": 0.03, "peak_kib": 10}}
+    assert bench_vp.compare(jitter, ref, 0.5) == []          # µs-Stufe: absolute Reserve
+    assert bench_vp.compare(jitter, ref, 0.5, slack=0) == ["diff_mine: 0.15 ms > 0.06 ms"]
+    assert bench_vp.compare(slow, ref, 0.5) == ["parse_full: 30.00 ms > 10.00 ms"]
+
+def test_metrics_render_and_endpoint():
+    import requests
+    import vp_metrics
+    m = vp_metrics.Metrics()
+    m.inc("requests", 3)
+    m.inc("bytes", 1024)
+    m.set("queue_depth", 2)
+    with m.timer("parse"):
+        pass
+    m.observe("parse", 0.5)
+    text = m.render()
+    assert "vp_requests_total 3" in text and "vp_queue_depth 2" in text
+    assert "vp_parse_seconds_count 2" in text and "vp_parse_seconds_max 0.500000" in text
+    assert any(line.startswith("parse: Ø") for line in m.summary())
+
+    httpd = vp_metrics.serve(0, metrics=m)
+    try:
+        url = f"http://127.0.0.1:{httpd.server_address[1]}"
+        assert requests.get(url + "/metrics", timeout=5).text == m.render()
+        assert requests.get(url + "/other", timeout=5).status_code == 404
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+    # lade_plan & Co. zählen in das globale Objekt
+    before = dict(vp_metrics.METRICS.counters)
+    vp._count_response(404, 0, 0.01)
+    vp._count_response(200, 100, 0.01)
+    after = vp_metrics.METRICS.counters
+    assert after["requests"] - before.get("requests", 0) == 2
+    assert after["not_found"] - before.get("not_found", 0) == 1
+    assert after["bytes"] - before.get("bytes", 0) == 100
+
 def test_lade_plan_builds_url(monkeypatch):
     called = {}
-    def fake_get(url, auth=None, timeout=10):
+    def fake_get(url, auth=None, timeout=10, headers=None):
         called['url'] = url
         called['auth'] = auth
         class R:
+            status_code = 200
+            headers = {}
             def raise_for_status(self):
                 pass
             @property
@@ -143,13 +486,136 @@ def test_lade_plan_builds_url(monkeypatch):
     monkeypatch.setattr(vp, 'USERNAME', 'user')
     monkeypatch.setattr(vp, 'PASSWORD', 'pass')
     monkeypatch.setattr(vp, 'BASE_URL', 'https://example.com')
-    monkeypatch.setattr(vp.requests, 'get', fake_get)
+    monkeypatch.setattr(vp, '_SESSION', type('S', (), {'get': staticmethod(fake_get)})())
     day = dt.date(2025,5,21)
     result = vp.lade_plan(day)
     assert result == b'data'
     assert called['url'] == 'https://example.com/PlanKl20250521.xml'
     assert called['auth'] == ('user', 'pass')
 
+def test_lade_plan_conditional(monkeypatch):
+    calls = []
+    def fake_get(url, auth=None, timeout=10, headers=None):
+        calls.append(headers)
+        class R:
+            status_code = 304 if headers else 200
+            content = b'' if headers else b'data'
+            def __init__(self):
+                self.headers = {} if headers else {'ETag': '"v1"'}
+            def raise_for_status(self):
+                pass
+        return R()
+    monkeypatch.setattr(vp, '_SESSION', type('S', (), {'get': staticmethod(fake_get)})())
+    monkeypatch.setattr(vp, '_PLAN_CACHE', {})
+    monkeypatch.setattr(vp, '_SEEN', {})
+    day = dt.date(2025,5,21)
+    assert vp.lade_plan(day, True) == b'data'
+    assert vp.lade_plan(day, True) is None
+    assert vp.lade_plan(day) == b'data'
+    assert calls[1] == {'If-None-Match': '"v1"'}
+    vp.forget_plan(before=dt.date(2025,5,22))
+    assert vp.lade_plan(day, True) == b'data'
+
+def test_lade_plan_conditional_ignores_other_fetches(monkeypatch):
+    server = {'version': 'v1'}
+    def fake_get(url, auth=None, timeout=10, headers=None):
+        etag = f'"{server["version"]}"'
+        class R:
+            status_code = 304 if (headers or {}).get('If-None-Match') == etag else 200
+            content = b'' if status_code == 304 else server['version'].encode()
+            def __init__(self):
+                self.headers = {'ETag': etag}
+            def raise_for_status(self):
+                pass
+        return R()
+    monkeypatch.setattr(vp, '_SESSION', type('S', (), {'get': staticmethod(fake_get)})())
+    monkeypatch.setattr(vp, '_PLAN_CACHE', {})
+    monkeypatch.setattr(vp, '_SEEN', {})
+    day = dt.date(2025,5,21)
+    assert vp.lade_plan(day, True) == b'v1'   # Monitor
+    server['version'] = 'v2'
+    assert vp.lade_plan(day) == b'v2'         # Befehl dazwischen
+    assert vp.lade_plan(day) == b'v2'         # 304 aus dem Cache
+    assert vp.lade_plan(day, True) == b'v2'   # Monitor sieht die Änderung
+    assert vp.lade_plan(day, True) is None
+
+def test_session_is_shared_and_pooled(monkeypatch):
+    monkeypatch.setattr(vp, '_SESSION', None)
+    s = vp.session()
+    assert vp.session() is s
+    adapter = s.get_adapter('https://example.com/')
+    assert adapter._pool_maxsize == vp.POOL_SIZE
+    assert adapter.max_retries.total == vp.RETRIES
+
+def test_lade_tage_order_and_misses():
+    import requests
+    published = {0, 1, 4, 9}
+    running = {'now': 0, 'max': 0}
+
+    async def fake_fetch(day):
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+        await asyncio.sleep(0.01 * (10 - day.day % 10))
+        running['now'] -= 1
+        if (day - dt.date(2025, 5, 1)).days not in published:
+            resp = requests.Response()
+            resp.status_code = 404
+            raise requests.HTTPError(response=resp)
+        return day.isoformat().encode()
+
+    async def collect():
+        return [d async for d, _ in vp.lade_tage(
+            dt.date(2025, 5, 1), max_misses=4, concurrency=3, fetch=fake_fetch)]
+
+    days = asyncio.run(collect())
+    assert [(d - dt.date(2025, 5, 1)).days for d in days] == [0, 1, 4]
+    assert running['max'] <= 3
+
+def test_lade_plan_async(monkeypatch):
+    import requests
+    from aiohttp import web
+
+    seen = []
+
+    async def handler(request):
+        seen.append((request.path, request.headers.get('Authorization'),
+                     request.headers.get('If-None-Match')))
+        if request.path != '/PlanKl20250521.xml':
+            raise web.HTTPNotFound()
+        if request.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        return web.Response(body=b'<x/>', headers={'ETag': '"v1"'})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/{name}', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        monkeypatch.setattr(vp, 'BASE_URL', f'http://127.0.0.1:{port}')
+        try:
+            first = await vp.lade_plan_async(dt.date(2025, 5, 21), True)
+            second = await vp.lade_plan_async(dt.date(2025, 5, 21), True)
+            with_cache = await vp.lade_plan_async(dt.date(2025, 5, 21))
+            try:
+                await vp.lade_plan_async(dt.date(2025, 5, 22))
+            except requests.HTTPError as e:
+                status = e.response.status_code
+            return first, second, with_cache, status
+        finally:
+            await vp.close_async_session()
+            await runner.cleanup()
+
+    monkeypatch.setattr(vp, 'USERNAME', 'user')
+    monkeypatch.setattr(vp, 'PASSWORD', 'pass')
+    monkeypatch.setattr(vp, '_PLAN_CACHE', {})
+    monkeypatch.setattr(vp, '_SEEN', {})
+    assert asyncio.run(run()) == (b'<x/>', None, b'<x/>', 404)
+    assert seen[0][1].startswith('Basic ')
+    assert seen[1][2] == '"v1"'
+
 def test_canon_and_room_change():
     assert bot._canon('  Cafe\u0301  test  ') == 'Caf\u00e9 test'
     old = {"stunde": 1, "fach": "MAT", "kurs": None, "lehrer": "FELD", "raum": "115"}
@@ -181,6 +647,18 @@ def test_filtered_xml():
     stds = kl.findall('.//Std')
     assert len(stds) == 2  # MUS sollte entfernt sein
 
+def test_parsed_plan_shared():
+    xml = (b"<root><Kl><Kurz>10E</Kurz><Pl>"
+           b"<Std><St>1</St><Fa>MAT</Fa><Le>FELD</Le></Std>"
+           b"<Std><St>2</St><Fa>MUS</Fa><Le>HANS</Le></Std>"
+           b"</Pl></Kl></root>")
+    plan = vp.parse_plan(xml)
+    assert vp.parse_xml(plan) == vp.parse_xml(xml)
+    assert vp.filtered_xml(plan) == vp.filtered_xml(xml)
+    # der gemeinsame Baum bleibt unverändert
+    assert len(plan.kl.findall('.//Std')) == 2
+    assert plan.snippet().startswith('<Kl><Kurz>10E</Kurz>')
+
 
 def test_ignore_unrelated_kun_raue():
     entry = {
@@ -210,18 +688,480 @@ def test_ignore_info_only_teacher():
     assert vp.keep(entry) is False
 
 def test_save_xml_dedup(monkeypatch, tmp_path):
+    import vp_store
     day = dt.date(2025, 5, 28)
     monkeypatch.setattr(bot, "DIR", tmp_path)
-    monkeypatch.setattr(bot, "XML_PF", lambda d, n=1: tmp_path / f"{d:%Y%m%d}{'' if n == 1 else '_' + str(n)}.xml")
+    monkeypatch.setattr(bot, "_SNAPSHOTS", None)
 
     bot.save_xml(day, "<a/>")
-    assert (tmp_path / "20250528.xml").exists()
+    assert bot.has_xml(day)
 
-    # same content should not create a new file
+    # same content should not create a new version
     bot.save_xml(day, "<a/>")
-    assert not (tmp_path / "20250528_2.xml").exists()
+    assert len(bot.snapshots().versions("20250528")) == 1
 
-    # different content -> new file
+    # different content -> new version; going back re-uses the blob
     bot.save_xml(day, "<b/>")
-    assert (tmp_path / "20250528_2.xml").exists()
+    bot.save_xml(day, "<a/>")
+    bot.snapshots().flush()
+    blobs = sorted((tmp_path / "snapshots" / "blobs").iterdir())
+    assert len(blobs) == 2 and all(b.name.endswith(".xml.gz") for b in blobs)
+
+    fresh = vp_store.SnapshotStore(tmp_path / "snapshots")
+    assert len(fresh.versions("20250528")) == 3
+    assert fresh.read("20250528") == "<a/>" and fresh.read("20250528", 1) == "<b/>"
+
+    fresh.prune(set(), "20250601")
+    assert not fresh.has("20250528")
+    assert not (tmp_path / "snapshots" / "blobs").exists() or not any((tmp_path / "snapshots" / "blobs").iterdir())
+
+
+def test_snapshot_store_imports_legacy_files(monkeypatch, tmp_path):
+    import shutil
+    for f in ("20250528.xml", "20250528_2.xml"):
+        shutil.copy(ROOT / "logs" / f, tmp_path / f)
+    monkeypatch.setattr(bot, "DIR", tmp_path)
+    monkeypatch.setattr(bot, "_SNAPSHOTS", None)
+
+    assert bot.has_xml(dt.date(2025, 5, 28))
+    store = bot.snapshots()
+    assert store.read("20250528", 0) == (tmp_path / "20250528.xml").read_text(encoding="utf-8")
+    assert store.read("20250528") == (tmp_path / "20250528_2.xml").read_text(encoding="utf-8")
+
+
+def test_history_log_append_replay_and_recover(tmp_path):
+    import vp_store
+    R = vp.Row
+    log = vp_store.HistoryLog(tmp_path)
+    v1 = [R(1, None, None, "MAT", None, "FELD", "114", None)]
+    v2 = [R(1, None, None, "MAT", None, "FELD", "115", None)]
+    cs = vp.diff_plans(v1, v2)
+
+    assert log.append("20250528", v1, klasse="10E") == 1
+    assert log.append("20250528", v1) is None          # unverändert
+    assert log.append("20250528", v2, cs.to_dict()) == 2
+    assert log.read("20250528")["rows"] == [dict(v2[0])]   # noch gepuffert
+    log.append("20250529", v2)
+    log.flush()
+    assert len((tmp_path / "plans.idx").read_text().splitlines()) == 3
+
+    fresh = vp_store.HistoryLog(tmp_path)
+    assert fresh.days() == ["20250528", "20250529"]
+    rec = fresh.read("20250528", 1)
+    assert rec["v"] == 1 and rec["klasse"] == "10E" and rec["changes"] is None
+    assert [R.from_dict(e) for e in rec["rows"]] == v1
+    again = vp.Changeset.from_dict(fresh.read("20250528")["changes"])
+    assert again.room == cs.room
+    assert [r["v"] for r in fresh.replay("20250528")] == [1, 2]
+
+    # Index verloren und halber Datensatz am Ende -> aus dem Log nachziehen
+    (tmp_path / "plans.idx").unlink()
+    with open(tmp_path / "plans.log.gz", "ab") as f:
+        f.write(b"\x1f\x8b\x08")
+    recovered = vp_store.HistoryLog(tmp_path)
+    assert recovered.versions("20250528") == 2
+    assert recovered.append("20250529", v1) == 2
+    recovered.flush()
+    assert [r["day"] for r in vp_store.HistoryLog(tmp_path).replay()] == [
+        "20250528", "20250528", "20250529", "20250529"]
+
+
+def test_diff_plans_changeset():
+    R = vp.Row
+    prev = [
+        R(1, "7:15", "08:00", "MAT", None, "FELD", "114", None),
+        R(2, None, None, "DEU", None, "PETH", "200", None),
+        R(3, None, None, "ENG", None, "SKAL", "201", None),
+        R(4, None, None, "INF1", "INF1", "BOSSE", "300", None),
+    ]
+    cur = [
+        R(1, "7:20", "08:05", "MAT", None, "FELD", "115", None),
+        R(2, None, None, "DEU", None, "MÖW", "200", None),
+        R(4, None, None, "---", "INF1", None, None, "selbst."),
+        R(5, None, None, "PHY", None, "VOGEL", "100", None),
+    ]
+    cs = vp.diff_plans(prev, cur)
+    assert cs.room == [(prev[0], cur[0])]
+    assert cs.time == [(prev[0], cur[0])]
+    assert cs.teacher == [(prev[1], cur[1])]
+    assert cs.cancelled == [cur[2]]
+    assert cs.added == [cur[3]]
+    assert cs.removed == [prev[2]]
+    assert not vp.diff_plans(prev, prev).room
+    # Texte kommen weiterhin aus room_change()
+    assert bot.room_change(*cs.room[0]) == 'Raumänderung: Stunde 1 MAT 114 → 115'
+    day = dt.date(2025, 5, 21)
+    assert [line for _, line in vp.alert_lines(day, cs)] == [
+        '• 2025-05-21 ▸ Ausfall in Stunde 4 – selbst. - INF1',
+        '• 2025-05-21 ▸ Raumänderung: Stunde 1 MAT 114 → 115',
+        '• 2025-05-21 ▸ Lehrerwechsel: Stunde 2 DEU PETH → MÖW',
+        '• 2025-05-21 ▸ Zeitänderung: Stunde 1 MAT 7:15-08:00 → 7:20-08:05',
+    ]
+
+def test_state_write_behind(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "PF", lambda d: tmp_path / f"{d:%Y%m%d}.json")
+    monkeypatch.setattr(bot, "ALERTS", tmp_path / "alerts.json")
+    monkeypatch.setattr(bot, "DIGEST", tmp_path / "last_digest.txt")
+    monkeypatch.setattr(bot, "FINGERPRINTS", tmp_path / "fingerprints.json")
+    day = dt.date(2025, 5, 28)
+    (tmp_path / "fingerprints.json").write_text('{"20250528": "abc"}', encoding="utf-8")
+
+    st = bot.State()
+    st.load()
+    assert st.fingerprints == {"20250528": "abc"}
+    assert st.plan(day) is None
+    rows = [vp.Row(1, None, None, "MAT", None, "FELD", "114", None)]
+    st.set_plan(day, rows)
+    today = f"{dt.date.today():%Y%m%d}"
+    st.add_alerts(today, {"msg"})
+    st.set_digest("d1")
+    st.set_fingerprint("20250528", "def")
+    assert not (tmp_path / "20250528.json").exists()   # noch nichts geschrieben
+
+    st.flush()
+    assert bot.load_json(day) == rows
+    assert bot.load_alerts() == {today: {"msg"}}
+    assert bot.read_digest() == "d1"
+    assert bot.load_fingerprints() == {"20250528": "def"}
+    assert not list(tmp_path.glob("*.tmp"))
+
+def test_sqlite_store_migrate_and_dispatch(monkeypatch, tmp_path):
+    import shutil
+    import vp_store
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    for f in ("20250526.json", "20250528.xml", "20250528_2.xml", "alerts.json", "last_digest.txt"):
+        shutil.copy(ROOT / "logs" / f, logs / f)
+    expires = time.time() + 3600
+    (logs / "dedup.json").write_text(f'{{"abo": {expires}}}', encoding="utf-8")
+    (logs / "outbox.json").write_text('{"5": ["offen"]}', encoding="utf-8")
+
+    monkeypatch.setattr(bot, "DIR", logs)
+    monkeypatch.setattr(bot, "STORAGE", "sqlite")
+    monkeypatch.setattr(bot, "_DB", None)
+    store = bot.db()
+    assert (logs / "vp.sqlite3").exists()
+    assert store.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    rows = bot.load_json(dt.date(2025, 5, 26))
+    assert rows[0] == vp.Row(1, "7:15", "08:00", "Mat", None, "Feld", "225", None)
+    assert bot.has_xml(dt.date(2025, 5, 28))
+    assert store.last_snapshot("20250528") == (logs / "20250528_2.xml").read_text(encoding="utf-8")
+    bot.save_xml(dt.date(2025, 5, 28), "<Kl/>")
+    bot.save_xml(dt.date(2025, 5, 28), "<Kl/>")
+    assert [n for (n,) in store.conn.execute("SELECT n FROM snapshots WHERE day='20250528'")] == [1, 2, 3]
+    assert store.read_digest() == (logs / "last_digest.txt").read_text(encoding="utf-8").strip()
+    assert bot.load_dedup() == {"abo": expires}
+    assert bot.load_outbox() == {5: ["offen"]}
+
+    today = f"{dt.date.today():%Y%m%d}"
+    bot.save_alerts({today: {"a", "b"}})
+    assert bot.load_alerts() == {today: {"a", "b"}}
+    bot.save_fingerprints({today: "x"})
+    assert bot.load_fingerprints() == {today: "x"}
+
+    bot.prune_logs(10)
+    assert bot.load_json(dt.date(2025, 5, 26)) is None
+    assert not bot.has_xml(dt.date(2025, 5, 28))
+    store.close()
+
+def test_dedup_index_expiry_and_bound():
+    import vp_store
+    idx = vp_store.DedupIndex(ttl=10, max_entries=3)
+    idx.add("a", now=0)
+    idx.add("b", now=5)
+    assert "a" in idx.to_dict() and len(idx) == 2
+    assert idx.expire(now=10) == 1          # a läuft ab, b nicht
+    assert set(idx.to_dict()) == {"b"}
+    for k in "cde":
+        idx.add(k, now=6)
+    assert set(idx.to_dict()) == {"c", "d", "e"}   # b verdrängt
+    again = vp_store.DedupIndex.from_dict(idx.to_dict(), ttl=10)
+    assert again.to_dict() == idx.to_dict()
+
+def test_alert_key_ignores_info_and_seeds_from_alerts():
+    import vp_store
+    day = dt.date.today()
+    assert bot.alert_key(day, "ausfall", 2, "inf1") == bot.alert_key(day, "ausfall", "2", "INF1 ")
+    idx = vp_store.DedupIndex(ttl=bot.DUP_DAYS * 86400)
+    bot._seed_dedup(idx, {f"{day:%Y%m%d}": {
+        f"{day:%Y-%m-%d} ▸ Ausfall in Stunde 2 – selbst. - INF1",
+        f"{day:%Y-%m-%d} ▸ Ausfall in Stunde 3 – - ",
+        f"{day:%Y-%m-%d} ▸ Raumänderung: Stunde 1 MAT 114 → 115",
+        f"{day:%Y-%m-%d} ▸ Lehrerwechsel: Stunde 2 DEU PETH → MÖW",
+        f"{day:%Y-%m-%d} ▸ Zeitänderung: Stunde 1 MAT 7:15-08:00 → 7:20---",
+        f"{day:%Y-%m-%d} ▸ Zeitänderung: Stunde 2 DEU --08:00 → ---08:45",
+    }})
+    assert bot.alert_key(day, "ausfall", 2, "INF1") in idx
+    assert bot.alert_key(day, "ausfall", 3, None) in idx
+    assert bot.alert_key(day, "raum", 1, "MAT", "115") in idx
+    assert bot.alert_key(day, "lehrer", 2, "DEU", "MÖW") in idx
+    assert bot.alert_key(day, "zeit", 1, "MAT", "7:20", None) in idx
+    assert bot.alert_key(day, "zeit", 2, "DEU", None, "08:45") in idx
+
+def test_import_without_env(tmp_path):
+    import subprocess
+    code = (
+        "import sys, datetime as dt\n"
+        "import vp_10e_plan as vp\n"
+        "assert not {'requests', 'urllib3', 'aiohttp', 'asyncio', 'dotenv'} & set(sys.modules), sorted(sys.modules)\n"
+        "assert vp.filter_rows(vp.parse_plan(b'<VpMobil/>').rows) == []\n"
+        "try:\n"
+        "    vp.lade_plan(dt.date(2025, 5, 21))\n"
+        "except RuntimeError as e:\n"
+        "    assert 'VP_USER' in str(e)\n"
+        "else:\n"
+        "    raise AssertionError('keine Prüfung der Zugangsdaten')\n"
+        "import bot_with_plan_monitor as b\n"
+        "assert b.bot is None and b.create_bot() is b.create_bot()\n"
+        "assert {c.name for c in b.bot.commands} >= {'heute', 'kurse', 'stats'}\n"
+    )
+    env = {k: v for k, v in os.environ.items()
+           if not k.startswith(("VP_", "DISCORD_", "PLAN_"))}
+    env["PYTHONPATH"] = str(ROOT)
+    r = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env,
+                       capture_output=True, text=True, timeout=60)
+    assert r.returncode == 0, r.stderr
+
+    # .env wird von config() gelesen und in alle abgeleiteten Werte übernommen
+    (tmp_path / ".env").write_text("VP_KLASSE=9A\nVP_KURSE=DEU:PETH\n", encoding="utf-8")
+    code = (
+        "import datetime as dt, vp_10e_plan as vp, vp_batch\n"
+        "assert vp.KLASSE == '10E'\n"
+        "vp.configure(vp.Config(klasse='7B', courses=frozenset({('MUS', 'HANS')})))\n"
+        "try:\n"
+        "    vp.lade_plan(dt.date(2025, 5, 21))\n"
+        "except RuntimeError:\n"
+        "    pass\n"
+        "assert vp.KLASSE == '7B' and vp.MY_COURSES == {('MUS', 'HANS')}, vp.KLASSE\n"
+        "vp.config()\n"
+        "assert vp.KLASSE == '9A' and vp.MY_COURSES == {('DEU', 'PETH')}, vp.KLASSE\n"
+        "assert vp.mine is vp.DEFAULT_FILTER and vp.DEFAULT_FILTER.courses == {('DEU', 'PETH')}\n"
+        "assert vp.parse_plan(b'<r><Kl><Kurz>9A</Kurz><Pl/></Kl></r>').kl is not None\n"
+        "assert not vp.keep({'stunde': 1, 'fach': 'MAT', 'kurs': None, 'lehrer': 'FELD', 'info': None})\n"
+    )
+    r = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env,
+                       capture_output=True, text=True, timeout=60)
+    assert r.returncode == 0, r.stderr
+
+    cfg = vp.Config.from_env({"VP_USER": "u", "VP_KURSE": "geo1:möw, INF1"})
+    assert cfg.courses == {("GEO1", "MÖW"), ("INF1", "")} and cfg.klasse == "10E"
+    assert cfg.user == "u" and cfg.base_url is None
+    cfg = vp.Config.from_env({"VP_POOL_SIZE": "8x", "VP_BACKOFF": "", "VP_RETRIES": "5"})
+    assert (cfg.pool_size, cfg.backoff, cfg.retries) == (8, 0.5, 5)
+
+def test_batch_reprocesses_archive(tmp_path):
+    import gzip
+    import json
+    import pytest
+    import vp_batch, vp_store
+
+    def plan(raum, inf_cancelled):
+        inf = ("<Fa>---</Fa><Ku2>INF1</Ku2><Le></Le><Ra></Ra><If>selbst.</If>" if inf_cancelled
+               else "<Fa>INF1</Fa><Ku2>INF1</Ku2><Le>BOSSE</Le><Ra>201</Ra><If></If>")
+        return (f"<root><Kl><Kurz>10E</Kurz><Pl>"
+                f"<Std><St>1</St><Fa>MAT</Fa><Ku2></Ku2><Le>FELD</Le><Ra>{raum}</Ra><If></If></Std>"
+                f"<Std><St>2</St>{inf}</Std></Pl></Kl></root>").encode("utf-8")
+
+    src = tmp_path / "archiv"
+    (src / "b").mkdir(parents=True)
+    versions = [(src / "PlanKl20250521.xml", plan(114, False)),
+                (src / "b" / "PlanKl20250521.xml", plan(114, False)),   # byte-gleich
+                (src / "PlanKl20250521_2.xml.gz", gzip.compress(plan(115, True))),
+                (src / "PlanKl20250521_3.xml", b"<root><Kl"),             # kaputt
+                (src / "PlanKl20250522.xml", plan(114, False))]
+    for i, (f, data) in enumerate(versions):
+        f.write_bytes(data)
+        os.utime(f, (1000 + i, 1000 + i))
+
+    results = {}
+    for jobs in (1, 2):
+        out = tmp_path / f"out{jobs}"
+        res = vp_batch.run(src, out, jobs=jobs)
+        results[jobs] = (json.loads((out / "alerts.json").read_text(encoding="utf-8")),
+                         (out / "20250521.json").read_text(encoding="utf-8"),
+                         list(vp_store.HistoryLog(out / "history").replay()))
+    assert results[1] == results[2]
+    assert [r.errors for r in res] == [1, 0]
+
+    alerts, plan21, hist = results[1]
+    assert alerts == {"20250521": [
+        "2025-05-21 ▸ Ausfall in Stunde 2 – selbst. - INF1",
+        "2025-05-21 ▸ Raumänderung: Stunde 1 MAT 114 → 115",
+    ]}
+    assert [e["raum"] for e in json.loads(plan21)] == ["115", None]
+    assert [(h["day"], h["v"], h["changes"] is None) for h in hist] == [
+        ("20250521", 1, True), ("20250521", 2, False), ("20250522", 1, True)]
+    with pytest.raises(FileExistsError):
+        vp_batch.run(src, tmp_path / "out1")
+
+def _tick_harness(monkeypatch, tmp_path):
+    """check() ohne Discord und Server: Pläne aus ``plans``, Nachrichten in ``sent``."""
+    import requests
+    for name in ("ALERTS", "DIGEST", "FINGERPRINTS", "DEDUP", "OUTBOX", "SUBSCRIPTIONS"):
+        monkeypatch.setattr(bot, name, tmp_path / getattr(bot, name).name)
+    monkeypatch.setattr(bot, "PF", lambda d: tmp_path / f"{d:%Y%m%d}.json")
+    monkeypatch.setattr(bot, "DIR", tmp_path)
+    monkeypatch.setattr(bot, "_SNAPSHOTS", None)
+    monkeypatch.setattr(bot, "_HISTORY", None)
+    monkeypatch.setattr(bot, "_CLASS_HISTORY", {})
+    monkeypatch.setattr(bot, "state", bot.State())
+    monkeypatch.setattr(bot, "scheduler", bot.PollScheduler(base=0, cap=0))
+    monkeypatch.setattr(bot, "discovery", bot.DayDiscovery(weekends=False))
+    monkeypatch.setattr(bot, "_retry_at", {})
+    monkeypatch.setattr(bot, "_failures", {})
+    plans, sent = {}, []
+
+    class Ch:
+        id = 1
+        async def send(self, text):
+            sent.append(text)
+
+    async def fetch(day, conditional=False):
+        data = plans.get(day)
+        if isinstance(data, Exception):
+            raise data
+        if data is None:
+            r = requests.Response()
+            r.status_code = 404
+            raise requests.HTTPError(response=r)
+        return data
+
+    monkeypatch.setattr(bot, "bot", type("B", (), {"get_channel": staticmethod(lambda cid: Ch())})())
+    monkeypatch.setattr(vp, "lade_plan_async", fetch)
+
+    def tick():
+        async def run():
+            await bot.check.coro()
+            await bot.deliver_outbox.coro()
+        asyncio.run(run())
+        bot._retry_at.clear()
+        out = list(sent)
+        sent.clear()
+        return out
+    return plans, tick
+
+def _plan(*klassen):
+    """``("10E", [(st, fa, ku, le, ra, info), …]), …`` → Plan-XML."""
+    kl = "".join(
+        f"<Kl><Kurz>{k}</Kurz><Pl>" + "".join(
+            f"<Std><St>{st}</St><Fa>{fa}</Fa><Ku2>{ku}</Ku2><Le>{le}</Le><Ra>{ra}</Ra><If>{inf}</If></Std>"
+            for st, fa, ku, le, ra, inf in rows) + "</Pl></Kl>"
+        for k, rows in klassen)
+    return f"<VpMobil><Klassen>{kl}</Klassen></VpMobil>".encode("utf-8")
+
+def test_check_survives_connection_errors(monkeypatch, tmp_path):
+    import pytest
+    import requests
+    plans, tick = _tick_harness(monkeypatch, tmp_path)
+    today = dt.date.today()
+    plans[today] = plans[today + dt.timedelta(1)] = _plan(("10E", [(1, "MAT", "", "FELD", "114", "")]))
+    assert "neuer Plan" in tick()[0]
+
+    # heute ändert sich der Raum, morgen bricht die Verbindung ab
+    plans[today] = _plan(("10E", [(1, "MAT", "", "FELD", "115", "")]))
+    plans[today + dt.timedelta(1)] = requests.ConnectionError("timeout")
+    out = tick()
+    assert len(out) == 1 and "Raumänderung: Stunde 1 MAT 114 → 115" in out[0]
+
+    # unerwarteter Fehler: Tick bricht ab, schon erzeugte Meldungen gehen trotzdem raus
+    plans[today] = _plan(("10E", [(1, "MAT", "", "FELD", "116", "")]))
+    plans[today + dt.timedelta(1)] = RuntimeError("kaputt")
+    with pytest.raises(RuntimeError):
+        asyncio.run(bot.check.coro())
+    assert "Raumänderung: Stunde 1 MAT 115 → 116" in "\n".join(bot.state.outbox[1])
+    assert bot.load_outbox() == bot.state.outbox   # auch schon gesichert
+
+def test_lade_plan_async_maps_client_errors(monkeypatch):
+    import aiohttp
+    import pytest
+    import requests
+
+    class S:
+        def get(self, url, headers=None):
+            raise aiohttp.ClientPayloadError("Response payload is not completed")
+
+    async def session():
+        return S()
+
+    monkeypatch.setattr(vp, 'async_session', session)
+    monkeypatch.setattr(vp, 'RETRIES', 1)
+    monkeypatch.setattr(vp, 'BACKOFF', 0)
+    monkeypatch.setattr(vp, 'USERNAME', 'user')
+    monkeypatch.setattr(vp, 'PASSWORD', 'pass')
+    monkeypatch.setattr(vp, 'BASE_URL', 'https://example.com')
+    with pytest.raises(requests.ConnectionError):
+        asyncio.run(vp.lade_plan_async(dt.date(2025, 5, 21)))
+
+def test_new_class_subscription_gets_base_version(monkeypatch, tmp_path):
+    plans, tick = _tick_harness(monkeypatch, tmp_path)
+    today = dt.date.today()
+    plans[today] = _plan(("9A", [(1, "MUS", "", "HANS", "101", "")]),
+                         ("10E", [(1, "MAT", "", "FELD", "114", "")]))
+    tick()
+    tick()   # unveränderter Stand, Fingerprint ist gemerkt
+    bot.state.subscribe("7", 1, [("MUS", "HANS")], "9A")
+    assert bot.state.unseeded == {"9A"}
+    assert tick() == []
+    assert bot.state.unseeded == set()
+    assert bot.history("9A").versions(f"{today:%Y%m%d}") == 1
+
+    plans[today] = _plan(("9A", [(1, "MUS", "", "HANS", "105", "")]),
+                         ("10E", [(1, "MAT", "", "FELD", "114", "")]))
+    assert any(t.startswith("<@7>") and "MUS 101 → 105" in t for t in tick())
+
+def test_substitution_without_course_code(monkeypatch, tmp_path):
+    plans, tick = _tick_harness(monkeypatch, tmp_path)
+    bot.state.loaded = True
+    bot.state.subscribe("8", 1, [("MAT", "FELD")])
+    today = dt.date.today()
+    plans[today] = _plan(("10E", [(1, "MAT", "", "FELD", "114", ""),
+                                  (2, "GEO1", "GEO1", "MÖW", "201", "")]))
+    tick()
+    plans[today] = _plan(("10E", [(1, "MAT", "", "XYZ", "114", ""),
+                                  (2, "GEO1", "GEO1", "ABC", "201", "")]))
+    out = "\n".join(tick())
+    assert "Lehrerwechsel: Stunde 1 MAT FELD → XYZ" in out
+    assert "Lehrerwechsel: Stunde 2 GEO1 MÖW → ABC" in out
+    assert "<@8>" in out and out.count("MAT FELD → XYZ") == 2
+    # die vertretene Stunde bleibt verfolgt
+    plans[today] = _plan(("10E", [(1, "MAT", "", "XYZ", "115", ""),
+                                  (2, "GEO1", "GEO1", "ABC", "201", "")]))
+    assert "Raumänderung: Stunde 1 MAT 114 → 115" in "\n".join(tick())
+
+def test_track_lessons_keeps_parallel_groups_apart():
+    prev = [vp.Row(1, None, None, "MAT", None, "FELD", "114", "")]
+    cur = [vp.Row(1, None, None, "MAT", None, "FELD", "114", ""),
+           vp.Row(1, None, None, "MAT", None, "XYZ", "115", "")]
+    assert vp.track_lessons(cur, cur[:1], prev) == cur[:1]
+    assert vp.track_lessons(cur[1:], [], prev) == cur[1:]
+
+def test_subscribers_of_other_classes_and_flush_copies(monkeypatch, tmp_path):
+    plans, tick = _tick_harness(monkeypatch, tmp_path)
+    assert bot.parse_abo("10a GEO1:MÖW, INF1") == ("10A", "GEO1:MÖW, INF1")
+    assert bot.parse_abo("GEO1:MÖW") == (None, "GEO1:MÖW")
+    bot.state.loaded = True
+    bot.state.subscribe("7", 1, [("MUS", "HANS")], "9A")
+    bot.state.subscribe("8", 1, [("MAT", "FELD")])
+    assert bot.state.klassen() == {"9A", vp.KLASSE}
+
+    today = dt.date.today()
+    plans[today] = _plan(("9A", [(1, "MUS", "", "HANS", "101", "")]),
+                         ("10E", [(1, "MAT", "", "FELD", "114", "")]))
+    tick()
+    plans[today] = _plan(("9A", [(1, "MUS", "", "HANS", "105", "")]),
+                         ("10E", [(1, "MAT", "", "FELD", "114", "")]))
+    out = tick()
+    assert any(t.startswith("<@7>") and "MUS 101 → 105" in t for t in out)
+    assert not any(t.startswith("<@8>") for t in out)
+    assert bot.history("9a").versions(f"{today:%Y%m%d}") == 2
 
+    # Der Thread schreibt eine Kopie – spätere Änderungen auf der Loop
+    # landen im nächsten Flush, nicht halb im laufenden
+    bot.state.subscribe("9", 1, [("DEU", "PETH")], "9A")
+    write = bot.state.flush_job()
+    bot.state.unsubscribe("7")
+    write()
+    assert set(bot.load_subscriptions()) == {"7", "8", "9"}
+    bot.state.flush()
+    assert set(bot.load_subscriptions()) == {"8", "9"}
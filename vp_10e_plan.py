@@ -7,43 +7,60 @@
 from __future__ import annotations
 
 import datetime as dt
+import hashlib
+import io
 import os
 import re
-from typing import List
-import requests
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Iterable, List, Mapping
 import xml.etree.ElementTree as ET
-from dotenv import load_dotenv   #  NEU
+
+from vp_metrics import METRICS
+
+# requests/urllib3, asyncio, aiohttp und python-dotenv werden erst in den
+# Funktionen geladen, die sie brauchen: Parser und Filter sind so ohne
+# Netzwerk-Bibliotheken und ohne Zugangsdaten in wenigen ms importiert.
+if TYPE_CHECKING:
+    import asyncio
+    import requests
 
 __all__ = [
     "lade_plan",
+    "lade_plan_async",
+    "forget_plan",
+    "lade_tage",
+    "session",
+    "Config",
+    "config",
+    "load_env",
+    "Row",
+    "ParsedPlan",
+    "parse_plan",
+    "parse_all",
+    "PlanCache",
+    "PARSED_CACHE",
     "parse_xml",
     "filtered_xml",
-    "mine",  # Alias auf keep()
+    "CourseFilter",
+    "CourseRouter",
+    "filter_rows",
+    "mine",  # austauschbarer Filter, Standard wie keep()
+    "Changeset",
+    "diff_plans",
+    "track_lessons",
+    "canon",
+    "alert_key",
+    "room_change",
+    "teacher_change",
+    "time_change",
+    "alert_lines",
 ]
 
-# .env laden (wird beim Bot-Start schon getan, aber hier zur
-# Stand-Alone-Nutzung noch einmal, falls noch nicht geschehen)
-load_dotenv()
-
-# ------------------------------------------------------------------
-# ▸ Zugangsdaten **ausschließlich** aus der .env-Datei lesen
-#    (keine Fallback-Defaults mehr!)
-# ------------------------------------------------------------------
-USERNAME: str | None   = os.getenv("VP_USER")
-PASSWORD: str | None   = os.getenv("VP_PASS")
-BASE_URL: str | None   = os.getenv("VP_BASE_URL")
-
-# Sofort meckern, falls etwas fehlt
-if not (USERNAME and PASSWORD and BASE_URL):
-    raise RuntimeError(
-        "Bitte VP_USER, VP_PASS und VP_BASE_URL in der .env Datei setzen."
-    )
-
-#BASE_URL = "http://localhost:8765"
-
-
-# Eigene Kurse (FACH, LEHRER)
-MY_COURSES: set[tuple[str, str]] = {
+# Standard-Kurse (FACH, LEHRER), per VP_KURSE ersetzbar
+DEFAULT_COURSES: frozenset[tuple[str, str]] = frozenset({
     ("GEO1", "MÖW"),
     ("ETH3", "MADA"),
     ("INF1", "BOSSE"),
@@ -59,52 +76,618 @@ MY_COURSES: set[tuple[str, str]] = {
     ("SPO", "SCHJ"),
     ("GES", "NEU"),
     ("PHY", "VOGEL"),
-}
+})
+
+
+@dataclass(frozen=True)
+class Config:
+    """Alle Einstellungen aus der Umgebung an einer Stelle.
+
+    Zugangsdaten dürfen fehlen, solange nichts heruntergeladen wird – geprüft
+    wird erst in :meth:`credentials`.
+    """
+
+    user: str | None = None
+    password: str | None = None
+    base_url: str | None = None
+    klasse: str = "10E"
+    pool_size: int = 8        # Verbindungen pro Host
+    retries: int = 3          # Wiederholungen bei 5xx/Netzfehlern
+    backoff: float = 0.5      # Faktor für exponentielles Warten
+    concurrency: int = 8      # parallele Tagesabrufe in lade_tage()
+    cache_ttl: float = 120.0  # Sekunden, geparste Pläne für Befehle
+    courses: frozenset[tuple[str, str]] = DEFAULT_COURSES
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] | None = None) -> "Config":
+        env = os.environ if env is None else env
+        courses = DEFAULT_COURSES
+        # Optional per .env ersetzen: VP_KURSE="GEO1:MÖW, INF1:BOSSE, DEU:PETH"
+        if env.get("VP_KURSE", "").strip():
+            courses = frozenset(
+                (f.strip().upper(), l.strip().upper())
+                for f, _, l in (c.partition(":") for c in env["VP_KURSE"].split(","))
+                if f.strip()
+            )
+        return cls(
+            user=env.get("VP_USER") or None,
+            password=env.get("VP_PASS") or None,
+            base_url=env.get("VP_BASE_URL") or None,
+            klasse=env.get("VP_KLASSE", "10E"),
+            pool_size=_number(env, "VP_POOL_SIZE", int, cls.pool_size),
+            retries=_number(env, "VP_RETRIES", int, cls.retries),
+            backoff=_number(env, "VP_BACKOFF", float, cls.backoff),
+            concurrency=_number(env, "VP_CONCURRENCY", int, cls.concurrency),
+            cache_ttl=_number(env, "VP_CACHE_TTL", float, cls.cache_ttl),
+            courses=courses,
+        )
+
+    def credentials(self) -> tuple[str, str, str]:
+        """``(base_url, user, password)`` – oder ``RuntimeError``, falls etwas fehlt."""
+
+        if not (self.user and self.password and self.base_url):
+            raise RuntimeError(
+                "Bitte VP_USER, VP_PASS und VP_BASE_URL in der .env Datei setzen."
+            )
+        return self.base_url, self.user, self.password
+
+
+def _number(env: Mapping[str, str], name: str, cast, default):
+    """Zahl aus ``env[name]`` – ungültige Werte fallen auf ``default`` zurück
+    (wie ``CHECK_SECONDS`` im Bot), damit der Import nie daran scheitert."""
+
+    try:
+        return cast(env.get(name, default))
+    except ValueError:
+        return default
+
+
+_ENV_LOADED = False    # .env in os.environ gelesen (load_env)
+_ENV_APPLIED = False   # … und per config() übernommen
+
+
+def load_env() -> None:
+    """Liest die ``.env`` einmalig nach ``os.environ`` (bestehende Werte gewinnen).
+
+    Meist über :func:`config`, das die Werte danach auch übernimmt.
+    """
+
+    global _ENV_LOADED
+    if not _ENV_LOADED:
+        _ENV_LOADED = True
+        try:
+            from dotenv import load_dotenv
+        except ImportError:   # python-dotenv ist nur für die .env nötig
+            return
+        load_dotenv()
+
+
+def config(*, reload: bool = False) -> Config:
+    """Die aktuelle :class:`Config` inkl. ``.env``.
+
+    Beim ersten Aufruf (bzw. mit ``reload=True``) wird die ``.env`` gelesen
+    und das Ergebnis mit :func:`configure` übernommen.  Einstiegspunkte
+    (Bot, ``vp_batch``) rufen das gleich zu Beginn auf.
+    """
+
+    global _ENV_APPLIED
+    if reload or not _ENV_APPLIED:
+        _ENV_APPLIED = True
+        load_env()
+        configure(Config.from_env())
+    return _CONFIG
+
+
+def configure(cfg: Config) -> None:
+    """Übernimmt ``cfg`` in die Modul-Konstanten und alles daraus Abgeleitete
+    (Kurslisten, Standardfilter, Cache-Frist, HTTP-Session)."""
 
-MY_KURSE: set[str] = {k for k, _ in MY_COURSES}
-MY_LEHRER: set[str] = {l for _, l in MY_COURSES}
-SUBJECTS:  set[str] = {f for f, _ in MY_COURSES}
+    global _CONFIG, _SESSION, USERNAME, PASSWORD, BASE_URL, KLASSE
+    global POOL_SIZE, RETRIES, BACKOFF, CONCURRENCY, CACHE_TTL
+    global MY_COURSES, MY_KURSE, MY_LEHRER, SUBJECTS, INFO_RE, DEFAULT_FILTER, mine
 
-# Nur Kurskürzel für die Info-Suche verwenden. Dadurch werden Einträge wie
-# "KUN5 RAUE" nicht versehentlich berücksichtigt, nur weil der Lehrername
-# vorkommt.
-INFO_RE = re.compile("|".join(re.escape(x) for x in MY_KURSE), re.IGNORECASE)
+    if (cfg.pool_size, cfg.retries, cfg.backoff) != (POOL_SIZE, RETRIES, BACKOFF):
+        _SESSION = None   # wird mit den neuen Werten neu gebaut
+    _CONFIG = cfg
+    USERNAME, PASSWORD, BASE_URL = cfg.user, cfg.password, cfg.base_url
+    KLASSE = cfg.klasse
+    POOL_SIZE, RETRIES, BACKOFF = cfg.pool_size, cfg.retries, cfg.backoff
+    CONCURRENCY, CACHE_TTL = cfg.concurrency, cfg.cache_ttl
+    PARSED_CACHE.ttl = cfg.cache_ttl
+    MY_COURSES = set(cfg.courses)
+    MY_KURSE, MY_LEHRER, SUBJECTS, INFO_RE = _derived(MY_COURSES)
+    old, DEFAULT_FILTER = DEFAULT_FILTER, CourseFilter(MY_COURSES)
+    if mine is old:
+        mine = DEFAULT_FILTER
+
+
+def _derived(courses: set[tuple[str, str]]):
+    kurse = {k for k, _ in courses}
+    # Nur Kurskürzel für die Info-Suche verwenden. Dadurch werden Einträge wie
+    # "KUN5 RAUE" nicht versehentlich berücksichtigt, nur weil der Lehrername
+    # vorkommt.
+    info_re = re.compile("|".join(re.escape(x) for x in kurse), re.IGNORECASE)
+    return kurse, {l for _, l in courses}, {f for f, _ in courses}, info_re
+
+
+# Beim Import nur die Umgebung lesen – keine .env, keine Prüfung; config()
+# ergänzt die .env.  Die Modul-Konstanten werden immer aus einer Config
+# gesetzt und bleiben zum Überschreiben (Tests, Benchmarks) erhalten.
+_CONFIG = Config.from_env()
+
+USERNAME: str | None = _CONFIG.user
+PASSWORD: str | None = _CONFIG.password
+BASE_URL: str | None = _CONFIG.base_url
+
+#BASE_URL = "http://localhost:8765"
+
+# Klasse, deren Plan standardmäßig ausgewertet wird
+KLASSE: str = _CONFIG.klasse
+
+# HTTP-Verbindungspool (optional per .env anpassbar)
+POOL_SIZE: int = _CONFIG.pool_size
+RETRIES: int = _CONFIG.retries
+BACKOFF: float = _CONFIG.backoff
+CONCURRENCY: int = _CONFIG.concurrency
+CACHE_TTL: float = _CONFIG.cache_ttl
+
+
+# Eigene Kurse (FACH, LEHRER)
+MY_COURSES: set[tuple[str, str]] = set(_CONFIG.courses)
+
+MY_KURSE: set[str]
+MY_LEHRER: set[str]
+SUBJECTS: set[str]
+MY_KURSE, MY_LEHRER, SUBJECTS, INFO_RE = _derived(MY_COURSES)
 
 
 # ---------------------------------------------------------------------------
 # I/O-Funktionen
 # ---------------------------------------------------------------------------
 
-def lade_plan(day: dt.date) -> bytes:
-    """Lädt den XML-Plan für das angegebene Datum und gibt die rohen Bytes zurück."""
+_SESSION: requests.Session | None = None
+_SESSION_LOCK = threading.Lock()
+
+
+def session() -> requests.Session:
+    """Gemeinsame Keep-Alive-Session für alle Plan-Downloads.
+
+    Der Pool ist pro Host auf ``POOL_SIZE`` Verbindungen begrenzt (blockierend,
+    damit parallele Abrufe nicht am Limit vorbei neue Verbindungen öffnen).
+    Vorübergehende Fehler (Verbindungsabbruch, 5xx) werden mit Backoff
+    wiederholt.  Die Session wird einmalig und thread-sicher erzeugt.
+    """
 
-    url = f"{BASE_URL}/PlanKl{day:%Y%m%d}.xml"
-    r = requests.get(url, auth=(USERNAME, PASSWORD), timeout=10)
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(
+                    total=RETRIES,
+                    backoff_factor=BACKOFF,
+                    status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset({"GET"}),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_SIZE,
+                    pool_maxsize=POOL_SIZE,
+                    pool_block=True,
+                    max_retries=retry,
+                )
+                s = requests.Session()
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _SESSION = s
+    return _SESSION
+
+
+# Zwischenspeicher pro Tag: (Body, ETag, Last-Modified).  Damit können wir
+# bedingte Requests schicken und bei "304 Not Modified" den alten Body nutzen.
+_PLAN_CACHE: dict[dt.date, tuple[bytes, str | None, str | None]] = {}
+
+# (ETag, Last-Modified) der Fassung, die ein Abruf mit ``conditional=True``
+# (der Monitor) zuletzt bekommen hat.  Getrennt von _PLAN_CACHE: holt ein
+# Befehl zwischendurch eine neue Fassung, darf der nächste Tick dafür kein
+# 304 bekommen – sonst würde die Änderung nie verglichen.
+_SEEN: dict[dt.date, tuple[str | None, str | None]] = {}
+
+
+def lade_plan(day: dt.date, conditional: bool = False) -> bytes | None:
+    """Lädt den XML-Plan für das angegebene Datum und gibt die rohen Bytes zurück.
+
+    Liegt der Tag bereits im Cache, wird bedingt angefragt (``If-None-Match`` /
+    ``If-Modified-Since``) und bei 304 der gecachte Body geliefert.  Mit
+    ``conditional=True`` zählt stattdessen die Fassung, die der letzte
+    bedingte Abruf bekommen hat: 304 heißt dann "seitdem unverändert" und
+    gibt ``None`` zurück – egal, was andere Abrufe dazwischen geladen haben.
+    """
+
+    base_url, user, password = _credentials()
+    url = f"{base_url}/PlanKl{day:%Y%m%d}.xml"
+    cached = _PLAN_CACHE.get(day)
+    t = time.perf_counter()
+    r = session().get(
+        url, auth=(user, password), timeout=10,
+        headers=_cache_headers(day, cached, conditional),
+    )
+    _count_response(r.status_code, len(r.content), time.perf_counter() - t)
+
+    if r.status_code == 304:
+        if conditional:
+            return None
+        if cached:
+            return cached[0]
     r.raise_for_status()
+
+    _remember(day, r.content, r.headers, conditional)
     return r.content
 
 
-def parse_xml(xml_bytes: bytes, klasse: str = "10E") -> List[dict]:
-    """Parst die XML-Bytes und liefert eine Liste von Dicts pro Stunde."""
+def _credentials() -> tuple[str, str, str]:
+    """Zugangsdaten für Downloads, erst hier geprüft.
+
+    Fehlt etwas, wird die ``.env`` nachgeladen und nur die fehlenden
+    Zugangsdaten daraus ergänzt – alles andere, was per :func:`configure`
+    gesetzt wurde (Klasse, Kurse, Cache …), bleibt unangetastet.
+    """
+
+    user, password, base_url = USERNAME, PASSWORD, BASE_URL
+    if user and password and base_url:
+        return base_url, user, password
+    load_env()
+    return Config(
+        user=user or os.environ.get("VP_USER") or None,
+        password=password or os.environ.get("VP_PASS") or None,
+        base_url=base_url or os.environ.get("VP_BASE_URL") or None,
+    ).credentials()
+
+
+def _count_response(status: int, size: int, seconds: float) -> None:
+    """Eine Server-Antwort in :data:`vp_metrics.METRICS` verbuchen."""
+
+    METRICS.inc("requests")
+    METRICS.observe("download", seconds)
+    if status == 304:
+        METRICS.inc("not_modified")
+    elif status == 404:
+        METRICS.inc("not_found")
+    elif status >= 400:
+        METRICS.inc("http_errors")
+    if size:
+        METRICS.inc("bytes", size)
+
+
+def _cache_headers(
+    day: dt.date,
+    cached: tuple[bytes, str | None, str | None] | None,
+    conditional: bool,
+) -> dict[str, str]:
+    headers: dict[str, str] = {}
+    validators = _SEEN.get(day) if conditional else cached and cached[1:]
+    if validators:
+        etag, modified = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if modified:
+            headers["If-Modified-Since"] = modified
+    return headers
+
+
+def _remember(day: dt.date, body: bytes, headers, conditional: bool = False) -> None:
+    etag = headers.get("ETag")
+    modified = headers.get("Last-Modified")
+    if etag or modified:
+        _PLAN_CACHE[day] = (body, etag, modified)
+    else:
+        _PLAN_CACHE.pop(day, None)
+    if conditional:
+        if etag or modified:
+            _SEEN[day] = (etag, modified)
+        else:
+            _SEEN.pop(day, None)
+
+
+# aiohttp-Session für lade_plan_async().  Sie gehört zu genau einer Event-Loop;
+# startet der Bot neu (neue Loop), wird eine neue angelegt.
+_ASESSION = None
+_ASESSION_LOOP: asyncio.AbstractEventLoop | None = None
+
+
+async def async_session():
+    """Gemeinsame ``aiohttp.ClientSession`` der laufenden Event-Loop."""
+
+    import asyncio
+    import aiohttp   # kommt mit discord.py, wird aber nur hier gebraucht
+
+    global _ASESSION, _ASESSION_LOOP
+    loop = asyncio.get_running_loop()
+    if _ASESSION is None or _ASESSION.closed or _ASESSION_LOOP is not loop:
+        _ASESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
+        _ASESSION_LOOP = loop
+    return _ASESSION
+
+
+async def close_async_session() -> None:
+    """Schließt die aiohttp-Session (z. B. beim Herunterfahren)."""
+
+    global _ASESSION, _ASESSION_LOOP
+    if _ASESSION is not None and not _ASESSION.closed:
+        await _ASESSION.close()
+    _ASESSION = _ASESSION_LOOP = None
+
+
+def _http_error(url: str, status: int, reason: str | None) -> requests.HTTPError:
+    """Baut ein ``requests.HTTPError`` wie ``raise_for_status()``."""
+
+    import requests
+
+    resp = requests.Response()
+    resp.status_code = status
+    resp.reason = reason
+    resp.url = url
+    kind = "Client" if status < 500 else "Server"
+    return requests.HTTPError(f"{status} {kind} Error: {reason} for url: {url}", response=resp)
+
+
+async def lade_plan_async(day: dt.date, conditional: bool = False) -> bytes | None:
+    """Asynchrone Variante von :func:`lade_plan` für die Bot-Loop.
+
+    Gleiche URL, Zugangsdaten, Timeout und Cache.  HTTP-Fehler (z. B. 404)
+    kommen wie bisher als ``requests.HTTPError``, alle anderen aiohttp-Fehler
+    (Verbindung, Timeout, abgebrochener Body) nach ``RETRIES`` Versuchen als
+    ``requests.ConnectionError``.
+    """
+
+    import asyncio
+    import base64
+    import aiohttp
+    import requests
+
+    base_url, user, password = _credentials()
+    url = f"{base_url}/PlanKl{day:%Y%m%d}.xml"
+    token = base64.b64encode(f"{user}:{password}".encode("utf-8")).decode("ascii")
+    s = await async_session()
+    attempt = 0
+    while True:
+        cached = _PLAN_CACHE.get(day)
+        t = time.perf_counter()
+        try:
+            headers = {
+                "Authorization": f"Basic {token}",
+                **_cache_headers(day, cached, conditional),
+            }
+            async with s.get(url, headers=headers) as r:
+                if r.status in (500, 502, 503, 504) and attempt < RETRIES:
+                    body = None
+                elif r.status == 304 and (conditional or cached):
+                    _count_response(304, 0, time.perf_counter() - t)
+                    return None if conditional else cached[0]
+                elif r.status >= 400:
+                    _count_response(r.status, 0, time.perf_counter() - t)
+                    raise _http_error(url, r.status, r.reason)
+                else:
+                    body = await r.read()
+                _count_response(r.status, len(body or b""), time.perf_counter() - t)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # auch abgebrochene Bodies (ClientPayloadError) usw. – nach außen
+            # gibt es nur die requests-Ausnahmen
+            METRICS.inc("connection_errors")
+            if attempt >= RETRIES:
+                raise requests.ConnectionError(f"{url}: {e!r}") from e
+            body = None
+
+        if body is not None:
+            _remember(day, body, r.headers, conditional)
+            return body
+        await asyncio.sleep(BACKOFF * 2 ** attempt)
+        attempt += 1
+
+
+def forget_plan(day: dt.date | None = None, *, before: dt.date | None = None) -> None:
+    """Entfernt ``day`` bzw. alle Tage vor ``before`` aus dem Plan-Cache.
+
+    Ohne Argumente wird der ganze Cache geleert.
+    """
+
+    for cache in (_PLAN_CACHE, _SEEN):
+        if day is not None:
+            cache.pop(day, None)
+        elif before is not None:
+            for d in [d for d in cache if d < before]:
+                del cache[d]
+        else:
+            cache.clear()
+
+
+async def lade_tage(
+    start: dt.date,
+    *,
+    max_misses: int = 16,
+    concurrency: int | None = None,
+    conditional: bool = False,
+    fetch: Callable[[dt.date], Awaitable[bytes | None]] | None = None,
+    skip: Callable[[dt.date], bool] | None = None,
+) -> AsyncIterator[tuple[dt.date, bytes | None]]:
+    """Lädt ab ``start`` mehrere Tage parallel und liefert ``(tag, bytes)``.
+
+    Es laufen höchstens ``concurrency`` Abrufe gleichzeitig.  Die Ergebnisse
+    kommen trotzdem in Datumsreihenfolge; 404-Tage werden übersprungen und
+    nach ``max_misses`` aufeinanderfolgenden 404ern ist Schluss.  Andere
+    Fehler werden an ihrer Stelle in der Reihenfolge weitergereicht.
+    ``bytes`` ist ``None``, wenn der Plan unverändert ist (siehe
+    ``lade_plan(conditional=True)``).  Tage, für die ``skip(tag)`` wahr
+    ist (z. B. Wochenenden), werden weder geladen noch als 404 gezählt.
+    """
+
+    import asyncio
+    import requests
+
+    if fetch is None:
+        async def fetch(day: dt.date) -> bytes | None:
+            return await lade_plan_async(day, conditional)
+
+    days: list[dt.date] = []
+    cur = start
+
+    def nth(i: int) -> dt.date:
+        nonlocal cur
+        while len(days) <= i:
+            for _ in range(366):
+                if skip is None or not skip(cur):
+                    break
+                cur += dt.timedelta(1)
+            else:
+                raise ValueError("skip() lässt keinen Tag übrig")
+            days.append(cur)
+            cur += dt.timedelta(1)
+        return days[i]
+
+    limit = max(1, concurrency or CONCURRENCY)
+    pending: dict[int, asyncio.Task] = {}
+    started = 0   # nächster noch nicht gestarteter Offset
+    offset = 0
+    misses = 0
+    try:
+        while misses < max_misses:
+            # Fenster auffüllen, aber nie weiter, als bis zum Abbruch noch
+            # geprüft werden müsste.
+            horizon = offset + min(limit, max_misses - misses)
+            while started < horizon:
+                pending[started] = asyncio.ensure_future(fetch(nth(started)))
+                started += 1
+
+            day = nth(offset)
+            task = pending.pop(offset)
+            offset += 1
+            try:
+                data = await task
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    misses += 1
+                    continue
+                raise
+            misses = 0
+            yield day, data
+    finally:
+        for t in pending.values():
+            if not t.done():
+                t.cancel()
+            elif not t.cancelled():
+                t.exception()   # nicht abgeholte Fehler nicht laut loggen lassen
+
+
+ROW_FIELDS = ("stunde", "beginn", "ende", "fach", "kurs", "lehrer", "raum", "info")
+
+
+@dataclass(frozen=True, slots=True)
+class Row:
+    """Eine Stunde des Plans – unveränderlich, hashbar und ohne ``__dict__``.
+
+    Lesend verhält sie sich wie das frühere Dict (``row["fach"]``,
+    ``row.get("kurs")``, ``dict(row)``), damit Filter, Anzeige und die
+    JSON-Logs unverändert funktionieren.
+    """
+
+    stunde: int
+    beginn: str | None
+    ende:   str | None
+    fach:   str | None
+    kurs:   str | None
+    lehrer: str | None
+    raum:   str | None
+    info:   str | None
+
+    def __getitem__(self, key: str):
+        if key not in ROW_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in ROW_FIELDS else default
+
+    def keys(self) -> tuple[str, ...]:
+        return ROW_FIELDS
+
+    def to_dict(self) -> dict:
+        """Dict im Format der JSON-Logs."""
+
+        return {k: getattr(self, k) for k in ROW_FIELDS}
+
+    @classmethod
+    def from_dict(cls, d) -> "Row":
+        """Gegenstück zu :meth:`to_dict` (fehlende Felder werden ``None``)."""
+
+        return cls(int(d.get("stunde") or 0), *(d.get(k) for k in ROW_FIELDS[1:]))
+
+
+def _kurz(kl: ET.Element) -> str:
+    return (kl.findtext("Kurz") or "").strip().upper()
+
+
+def _find_kl(xml_bytes: bytes, klasse: str) -> ET.Element | None:
+    """Sucht den ``<Kl>``-Block der Klasse im komplett geparsten Baum."""
 
     root = ET.fromstring(xml_bytes)
-    kl = next(
-        (
-            k
-            for k in root.findall(".//Kl")
-            if (k.findtext("Kurz") or "").strip().upper() == klasse.upper()
-        ),
-        None,
-    )
-    if kl is None:
-        return []
+    return next((k for k in root.findall(".//Kl") if _kurz(k) == klasse.upper()), None)
+
+
+def _collect_kl(xml_bytes: bytes, wanted: set[str] | None) -> dict[str, ET.Element]:
+    """Sammelt per ``iterparse`` die ``<Kl>``-Blöcke in einem Durchgang.
+
+    ``wanted`` sind die gesuchten Kürzel (groß geschrieben), ``None`` heißt
+    alle.  Fremde Blöcke werden direkt nach dem Einlesen verworfen, und
+    sobald alle gesuchten Klassen vollständig sind, hört das Parsen auf.
+    Der Rest des Dokuments wird dann nicht mehr gelesen – ein danach
+    abgeschnittenes XML fällt also nicht mehr als ``ParseError`` auf.
+    """
+
+    found: dict[str, ET.Element] = {}
+    stack: list[ET.Element] = []
+    for event, el in ET.iterparse(io.BytesIO(xml_bytes), events=("start", "end")):
+        if event == "start":
+            stack.append(el)
+            continue
+        stack.pop()
+        if el.tag != "Kl":
+            continue
+        kurz = _kurz(el)
+        if wanted is None or kurz in wanted:
+            found.setdefault(kurz, el)
+            if wanted is not None and len(found) == len(wanted):
+                break
+            continue
+        el.clear()
+        if stack:
+            stack[-1].remove(el)
+    return found
+
+
+def _stream_kl(xml_bytes: bytes, klasse: str) -> ET.Element | None:
+    """Wie :func:`_find_kl`, aber per ``iterparse`` (siehe :func:`_collect_kl`)."""
 
-    pl = kl.find("Pl") or ET.Element("tmp")
+    wanted = klasse.upper()
+    return _collect_kl(xml_bytes, {wanted}).get(wanted)
+
+
+def _rows(kl: ET.Element) -> List[Row]:
+    """Baut die Zeilen aus einem ``<Kl>``-Block."""
+
+    pl = kl.find("Pl")
+    if pl is None:
+        return []
 
     def g(e: ET.Element, tag: str):
         return (e.findtext(tag) or "").strip() or None
 
-    rows: list[dict] = []
+    rows: list[Row] = []
     for s in pl.findall("Std"):
         st     = int(g(s, "St") or 0)
         beginn = g(s, "Beginn")
@@ -123,31 +706,162 @@ def parse_xml(xml_bytes: bytes, klasse: str = "10E") -> List[dict]:
             fach = "---"
             if not kurs:
                 kurs = fach_orig
-        rows.append({
-            "stunde": st,
-            "beginn": beginn,
-            "ende":   ende,
-            "fach":   fach,
-            "kurs":   kurs,
-            "lehrer": lehrer,
-            "raum":   raum,
-            "info":   info,
-        })
+        rows.append(Row(st, beginn, ende, fach, kurs, lehrer, raum, info))
     return rows
 
 
-def filtered_xml(xml_bytes: bytes, klasse: str = "10E") -> str | None:
-    """Gibt den XML-Block der Klasse gefiltert auf relevante Stunden zurück."""
+@dataclass
+class ParsedPlan:
+    """Einmal geparster Plan einer Klasse: ``<Kl>``-Knoten plus Zeilen.
 
-    try:
-        root = ET.fromstring(xml_bytes)
-    except ET.ParseError:
-        return None
+    Wird pro Download einmal erzeugt und kann an :func:`parse_xml` und
+    :func:`filtered_xml` statt der rohen Bytes übergeben werden.
+    """
 
-    kl = next(
-        (k for k in root.findall(".//Kl") if (k.findtext("Kurz") or "").strip().upper() == klasse.upper()),
-        None,
-    )
+    klasse: str
+    kl: ET.Element | None
+    rows: List[Row]
+
+    def snippet(self) -> str | None:
+        """Der ``<Kl>``-Block als XML-Text (z. B. fürs Log)."""
+
+        if self.kl is None:
+            return None
+        return ET.tostring(self.kl, encoding="unicode")
+
+
+def parse_plan(xml_bytes: bytes, klasse: str | None = None, *, stream: bool = True) -> ParsedPlan:
+    """Parst die XML-Bytes genau einmal zu einem :class:`ParsedPlan`."""
+
+    klasse = klasse or KLASSE
+    kl = _stream_kl(xml_bytes, klasse) if stream else _find_kl(xml_bytes, klasse)
+    return ParsedPlan(klasse, kl, _rows(kl) if kl is not None else [])
+
+
+def parse_all(
+    xml_bytes: bytes, klassen: Iterable[str] | None = None
+) -> dict[str, ParsedPlan]:
+    """Parst die Pläne mehrerer (oder aller) Klassen in einem Durchgang.
+
+    Liefert ein Dict ``Kurz → ParsedPlan``; die Schlüssel sind groß
+    geschrieben (``plans["10E"]``).  Nicht gefundene Klassen fehlen im Dict.
+    """
+
+    wanted = None if klassen is None else {k.strip().upper() for k in klassen}
+    return {
+        kurz: ParsedPlan(kurz, kl, _rows(kl))
+        for kurz, kl in _collect_kl(xml_bytes, wanted).items()
+    }
+
+
+class PlanCache:
+    """TTL-Cache geparster Pläne, gefüllt vom Monitor, gelesen von Befehlen.
+
+    Gleichzeitige :meth:`fetch`-Aufrufe für denselben Tag teilen sich einen
+    einzigen Download (Single-Flight); Fehler gehen an alle Wartenden und
+    werden nicht gecacht.
+    """
+
+    def __init__(self, ttl: float | None = None) -> None:
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self._entries: dict[tuple[dt.date, str], tuple[float, ParsedPlan]] = {}
+        self._inflight: dict[tuple[dt.date, str], asyncio.Future] = {}
+
+    def put(self, day: dt.date, plan: ParsedPlan, *, now: float | None = None) -> None:
+        now = time.monotonic() if now is None else now
+        self._entries[(day, plan.klasse.upper())] = (now + self.ttl, plan)
+
+    def touch(self, day: dt.date, klasse: str | None = None, *, now: float | None = None) -> None:
+        """Frist verlängern – z. B. wenn der Server 304 meldet."""
+
+        hit = self._entries.get((day, (klasse or KLASSE).upper()))
+        if hit is not None:
+            self.put(day, hit[1], now=now)
+
+    def get(self, day: dt.date, klasse: str | None = None, *, now: float | None = None) -> ParsedPlan | None:
+        key = (day, (klasse or KLASSE).upper())
+        hit = self._entries.get(key)
+        if hit is None:
+            return None
+        if hit[0] <= (time.monotonic() if now is None else now):
+            del self._entries[key]
+            return None
+        return hit[1]
+
+    def forget(self, day: dt.date | None = None, *, before: dt.date | None = None) -> None:
+        """Wie :func:`forget_plan`."""
+
+        for key in [k for k in self._entries
+                    if (day is None and before is None) or k[0] == day
+                    or (before is not None and k[0] < before)]:
+            del self._entries[key]
+
+    async def fetch(
+        self,
+        day: dt.date,
+        klasse: str | None = None,
+        *,
+        load: Callable[[dt.date], Awaitable[bytes]] | None = None,
+    ) -> ParsedPlan:
+        """Plan aus dem Cache oder – einmal für alle Wartenden – laden."""
+
+        import asyncio
+
+        klasse = klasse or KLASSE
+        plan = self.get(day, klasse)
+        if plan is not None:
+            return plan
+        key = (day, klasse.upper())
+        fut = self._inflight.get(key)
+        if fut is None or fut.get_loop() is not asyncio.get_running_loop():
+            fut = asyncio.ensure_future(self._load(day, klasse, load or lade_plan_async))
+            self._inflight[key] = fut
+            fut.add_done_callback(
+                lambda f, key=key: self._inflight.pop(key, None) if self._inflight.get(key) is f else None
+            )
+        # shield: ein abgebrochener Wartender bricht nicht den Download der anderen ab
+        return await asyncio.shield(fut)
+
+    async def _load(self, day: dt.date, klasse: str, load) -> ParsedPlan:
+        plan = parse_plan(await load(day), klasse)
+        self.put(day, plan)
+        return plan
+
+
+# gemeinsamer Cache für Bot-Befehle; check() hält ihn warm
+PARSED_CACHE = PlanCache()
+
+
+def parse_xml(
+    xml_bytes: bytes | ParsedPlan, klasse: str | None = None, *, stream: bool = False
+) -> List[Row]:
+    """Parst die XML-Bytes und liefert eine :class:`Row` pro Stunde.
+
+    Mit ``stream=True`` wird nur der Block der Klasse aufgebaut (siehe
+    :func:`_stream_kl`) – spart bei Gesamtplänen Speicher und Zeit.  Ein
+    schon geparster :class:`ParsedPlan` wird direkt verwendet.
+    """
+
+    if isinstance(xml_bytes, ParsedPlan):
+        return list(xml_bytes.rows)
+    return parse_plan(xml_bytes, klasse, stream=stream).rows
+
+
+def filtered_xml(xml_bytes: bytes | ParsedPlan, klasse: str | None = None) -> str | None:
+    """Gibt den XML-Block der Klasse gefiltert auf relevante Stunden zurück.
+
+    Der Baum eines übergebenen :class:`ParsedPlan` wird dabei nicht verändert.
+    """
+
+    if isinstance(xml_bytes, ParsedPlan):
+        plan = xml_bytes
+    else:
+        try:
+            plan = parse_plan(xml_bytes, klasse, stream=False)
+        except ET.ParseError:
+            return None
+
+    kl = plan.kl
     if kl is None:
         return None
 
@@ -155,41 +869,376 @@ def filtered_xml(xml_bytes: bytes, klasse: str = "10E") -> str | None:
     if pl is None:
         return None
 
-    rows = parse_xml(xml_bytes, klasse)
-    std_nodes = pl.findall("Std")
-    for row, node in list(zip(rows, std_nodes)):
-        if not mine(row):
-            pl.remove(node)
+    drop = {id(node) for row, node in zip(plan.rows, pl.findall("Std")) if not mine(row)}
+
+    # flache Kopie: nur <Pl> bekommt eine neue Kinderliste
+    out = ET.Element(kl.tag, kl.attrib)
+    out.text = kl.text
+    for child in kl:
+        if child is not pl:
+            out.append(child)
+            continue
+        new_pl = ET.SubElement(out, pl.tag, pl.attrib)
+        new_pl.text, new_pl.tail = pl.text, pl.tail
+        new_pl.extend(node for node in pl if id(node) not in drop)
 
-    return ET.tostring(kl, encoding="unicode")
+    return ET.tostring(out, encoding="unicode")
 
 
 # ---------------------------------------------------------------------------
 # Filterfunktion (wird vom Bot überschrieben, falls gewünscht)
 # ---------------------------------------------------------------------------
 
-def keep(e: dict) -> bool:
+class CourseFilter:
+    """Vorkompilierter Kursfilter (Regeln wie :func:`keep`).
+
+    Alle Nachschlagetabellen und der Info-Regex werden einmal beim Anlegen
+    gebaut.  Ergebnisse werden pro ``(fach, kurs, lehrer, info)`` gemerkt –
+    dieselben Zeilen tauchen Tick für Tick wieder auf.
+    """
+
+    MEMO_SIZE = 4096
+
+    def __init__(self, courses: Iterable[tuple[str, str]]) -> None:
+        self.courses = frozenset((f.upper(), (l or "").upper()) for f, l in courses)
+        self.kurse = frozenset(f for f, _ in self.courses)
+        self.subjects = self.kurse      # Fach und Kurs sind hier dasselbe Kürzel
+        self._cancel = self.kurse | self.subjects
+        # längste Kürzel zuerst, damit "KUN2" nicht an "KUN" hängen bleibt
+        alts = sorted(map(re.escape, self.kurse), key=len, reverse=True)
+        self._info = re.compile("|".join(alts), re.IGNORECASE).search if alts else None
+        self._memo: dict[tuple, bool] = {}
+
+    @classmethod
+    def parse(cls, spec: str) -> "CourseFilter":
+        """``"GEO1:MÖW, INF1:BOSSE"`` → Filter (Lehrer darf fehlen)."""
+
+        pairs = (c.partition(":") for c in spec.split(","))
+        return cls((f.strip(), l.strip()) for f, _, l in pairs if f.strip())
+
+    def _match(self, fach: str, kurs: str, leh: str, info: str) -> bool:
+        # reguläre Stunde: Fach+Lehrer-Kombi **oder** Kurs in unserer Kursliste
+        if (fach, leh) in self.courses or kurs in self.kurse:
+            return True
+        # Ausfall-Zeile: fach == '---'
+        if fach == "---":
+            return kurs in self._cancel or bool(info and self._info and self._info(info))
+        return False
+
+    def __call__(self, e: Row | dict) -> bool:
+        """True, wenn die Stunde für den Schüler relevant ist."""
+
+        key = (e["fach"], e["kurs"], e["lehrer"], e["info"])
+        hit = self._memo.get(key)
+        if hit is None:
+            hit = self._match((key[0] or "").upper(), (key[1] or "").upper(),
+                              (key[2] or "").upper(), key[3] or "")
+            if len(self._memo) >= self.MEMO_SIZE:
+                self._memo.clear()
+            self._memo[key] = hit
+        return hit
+
+    def filter(self, rows: Iterable[Row | dict]) -> list[Row | dict]:
+        """Alle relevanten Zeilen aus ``rows`` in einem Durchlauf."""
+
+        memo, match = self._memo, self._match
+        out = []
+        for e in rows:
+            key = (e["fach"], e["kurs"], e["lehrer"], e["info"])
+            hit = memo.get(key)
+            if hit is None:
+                hit = memo[key] = match((key[0] or "").upper(), (key[1] or "").upper(),
+                                        (key[2] or "").upper(), key[3] or "")
+            if hit:
+                out.append(e)
+        if len(memo) > self.MEMO_SIZE:
+            memo.clear()
+        return out
+
+
+DEFAULT_FILTER = CourseFilter(MY_COURSES)
+
+
+class CourseRouter:
+    """Verteilt Planzeilen in einem Durchlauf auf viele Abonnenten.
+
+    Statt für jeden Abonnenten einen eigenen :class:`CourseFilter` über alle
+    Zeilen laufen zu lassen, gibt es einen gemeinsamen Index
+    ``(fach, lehrer)`` / ``kurs`` → Abonnenten und einen Regex über *alle*
+    Kurskürzel für die Info-Spalte.  Jeder Abonnent bekommt dieselben Zeilen,
+    die sein eigener ``CourseFilter`` liefern würde.
+    """
+
+    def __init__(self, subs: dict[str, Iterable[tuple[str, str]]] | None = None) -> None:
+        self._subs: dict[str, CourseFilter] = {}
+        self._index: tuple | None = None
+        for sub, courses in (subs or {}).items():
+            self.add(sub, courses)
+
+    def add(self, sub: str, courses: Iterable[tuple[str, str]] | CourseFilter) -> None:
+        self._subs[sub] = courses if isinstance(courses, CourseFilter) else CourseFilter(courses)
+        self._index = None
+
+    def remove(self, sub: str) -> None:
+        if self._subs.pop(sub, None) is not None:
+            self._index = None
+
+    def __contains__(self, sub: str) -> bool:
+        return sub in self._subs
+
+    def __len__(self) -> int:
+        return len(self._subs)
+
+    def _build(self) -> tuple:
+        pairs: dict[tuple[str, str], set[str]] = {}
+        kurse: dict[str, set[str]] = {}
+        for sub, flt in self._subs.items():
+            for c in flt.courses:
+                pairs.setdefault(c, set()).add(sub)
+            for k in flt.kurse:
+                kurse.setdefault(k, set()).add(sub)
+        # Regex-Treffer sind nicht überlappend und nehmen das längste
+        # Kürzel; kürzere Kürzel, die darin stecken, gelten mit.
+        inner = {k: {j for j in kurse if j in k} for k in kurse}
+        alts = sorted(map(re.escape, kurse), key=len, reverse=True)
+        info = re.compile("(?=(" + "|".join(alts) + "))", re.IGNORECASE).finditer if alts else None
+        self._index = (pairs, kurse, inner, info)
+        return self._index
+
+    def match(self, e: Row | dict) -> set[str]:
+        """Alle Abonnenten, für die ``e`` relevant ist."""
+
+        pairs, kurse, inner, info = self._index or self._build()
+        fach = (e["fach"] or "").upper()
+        kurs = (e["kurs"] or "").upper()
+        leh = (e["lehrer"] or "").upper()
+        hit = pairs.get((fach, leh), set()) | kurse.get(kurs, set())
+        if fach == "---" and info and e["info"]:
+            for m in info(e["info"]):
+                for k in inner.get(m.group(1).upper(), ()):
+                    hit |= kurse[k]
+        return hit
+
+    def route(self, rows: Iterable[Row | dict]) -> dict[str, list[Row | dict]]:
+        """Abonnent → seine Zeilen (nur Abonnenten mit mindestens einer)."""
+
+        out: dict[str, list[Row | dict]] = {}
+        for e in rows:
+            for sub in self.match(e):
+                out.setdefault(sub, []).append(e)
+        return out
+
+
+def keep(e: Row | dict) -> bool:
     """True, wenn die Stunde für den Schüler relevant ist."""
 
-    fach = (e["fach"] or "").upper()
-    kurs = (e["kurs"] or "").upper()
-    leh = (e["lehrer"] or "").upper()
-    info = e["info"] or ""
-
-    # reguläre Stunde: Fach+Lehrer müssen passen **oder** Kurs steht in MY_KURSE
-    # reguläre Stunde: Fach+Lehrer-Kombi **oder** Kurs in unserer Kursliste
-    if (fach, leh) in MY_COURSES or kurs in MY_KURSE:
-        return True
-
-    # Ausfall-Zeile: fach == '---'
-    if fach == "---":
-        return bool(
-            kurs in MY_KURSE
-            or kurs in SUBJECTS      # z. B. "DEU"
-            or INFO_RE.search(info)
-        )
+    return DEFAULT_FILTER(e)
 
-    return False
+
+def filter_rows(rows: Iterable[Row | dict], flt: Callable | None = None) -> list:
+    """Wendet ``flt`` (Standard: :data:`mine`) auf ``rows`` an.
+
+    :class:`CourseFilter` filtern in einem Durchlauf, andere Callables
+    werden wie bisher Zeile für Zeile gefragt.
+    """
+
+    flt = mine if flt is None else flt
+    if isinstance(flt, CourseFilter):
+        return flt.filter(rows)
+    return [e for e in rows if flt(e)]
 
 # Alias, damit der Bot das Filterobjekt nach Belieben austauschen kann
-mine = keep
+# (jedes Callable ``row -> bool``; ein CourseFilter filtert am schnellsten)
+mine = DEFAULT_FILTER
+
+
+# ---------------------------------------------------------------------------
+# Plan-Vergleich
+# ---------------------------------------------------------------------------
+
+def lesson_key(e: Row | dict) -> tuple[int, str | None]:
+    """Schlüssel, unter dem zwei Stände derselben Stunde zusammengehören."""
+
+    return e["stunde"], (e["kurs"] or e["fach"])
+
+
+def track_lessons(
+    rows: Iterable[Row | dict], hits: Iterable[Row | dict], prev: Iterable[Row | dict]
+) -> list:
+    """``hits`` (gefilterte ``rows``) plus die Zeilen, die eine Stunde aus ``prev``
+    fortschreiben.
+
+    Der Filter prüft (Fach, Lehrer) – bei einer Vertretung in einem Fach ohne
+    Kurskürzel (MAT FELD → XYZ) fiele die Stunde sonst heraus und der
+    Lehrerwechsel käme nur als stilles ``removed`` an.  Übernommen werden nur
+    Stunden aus ``prev``, für die ``hits`` keine eigene Zeile hat.
+    """
+
+    hits = list(hits)
+    open_keys = {lesson_key(o) for o in prev} - {lesson_key(e) for e in hits}
+    if not open_keys:
+        return hits
+    chosen = {id(e) for e in hits}
+    return [e for e in rows if id(e) in chosen or lesson_key(e) in open_keys]
+
+
+def _norm(v: str | None) -> str:
+    return (v or "").strip().upper()
+
+
+@dataclass
+class Changeset:
+    """Strukturierte Unterschiede zwischen zwei Ständen eines Tagesplans.
+
+    ``cancelled`` enthält *alle* aktuell ausfallenden Stunden (nicht nur
+    neue) – das Entdoppeln übernimmt der Aufrufer.  Die Paar-Listen sind
+    ``(alt, neu)``.
+    """
+
+    added:     list[Row] = field(default_factory=list)
+    removed:   list[Row] = field(default_factory=list)
+    cancelled: list[Row] = field(default_factory=list)
+    room:      list[tuple[Row, Row]] = field(default_factory=list)
+    teacher:   list[tuple[Row, Row]] = field(default_factory=list)
+    time:      list[tuple[Row, Row]] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return any((self.added, self.removed, self.cancelled,
+                    self.room, self.teacher, self.time))
+
+    def to_dict(self) -> dict:
+        """JSON-taugliche Form (Zeilen als Dicts, Paare als ``[alt, neu]``)."""
+
+        d: dict = {}
+        for name in ("added", "removed", "cancelled"):
+            d[name] = [dict(e) for e in getattr(self, name)]
+        for name in ("room", "teacher", "time"):
+            d[name] = [[dict(o), dict(e)] for o, e in getattr(self, name)]
+        return d
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Changeset":
+        return cls(
+            **{n: [Row.from_dict(e) for e in d.get(n, ())]
+               for n in ("added", "removed", "cancelled")},
+            **{n: [(Row.from_dict(o), Row.from_dict(e)) for o, e in d.get(n, ())]
+               for n in ("room", "teacher", "time")},
+        )
+
+
+def diff_plans(prev: Iterable[Row | dict], cur: Iterable[Row | dict]) -> Changeset:
+    """Vergleicht zwei Stände in linearer Zeit über einen Index auf ``prev``.
+
+    Stunden werden über :func:`lesson_key` (Stunde + Kurs bzw. Fach)
+    zugeordnet; bei doppelten Schlüsseln gilt der erste Eintrag.
+    """
+
+    prev = list(prev)
+    index: dict[tuple[int, str | None], Row | dict] = {}
+    for o in prev:
+        index.setdefault(lesson_key(o), o)
+
+    cs = Changeset()
+    cur_keys: set[tuple[int, str | None]] = set()
+    for e in cur:
+        k = lesson_key(e)
+        cur_keys.add(k)
+        if e["fach"] == "---":
+            cs.cancelled.append(e)
+        o = index.get(k)
+        if o is None:
+            cs.added.append(e)
+            continue
+        # Raum: nur melden, wenn der neue Stand überhaupt einen Raum nennt
+        if _norm(e["raum"]) and _norm(o["raum"]) != _norm(e["raum"]):
+            cs.room.append((o, e))
+        if _norm(e["lehrer"]) and _norm(o["lehrer"]) and _norm(o["lehrer"]) != _norm(e["lehrer"]):
+            cs.teacher.append((o, e))
+        if (e["beginn"] or e["ende"]) and (o["beginn"], o["ende"]) != (e["beginn"], e["ende"]):
+            cs.time.append((o, e))
+
+    cs.removed = [o for o in prev if lesson_key(o) not in cur_keys]
+    return cs
+
+
+# ---------------------------------------------------------------------------
+# Meldungstexte (Bot und vp_batch)
+# ---------------------------------------------------------------------------
+
+def canon(s: str) -> str:
+    """Unicode-normalisieren, überflüssige Leerzeichen killen."""
+    return unicodedata.normalize("NFC", " ".join(s.split()))
+
+
+def alert_key(day: dt.date, kind: str, *parts) -> str:
+    """Fingerprint einer Meldung aus ihren Eckdaten (ohne Freitext)."""
+    norm = "|".join(canon(str(p or "")).upper() for p in (f"{day:%Y%m%d}", kind, *parts))
+    return hashlib.sha1(norm.encode("utf-8")).hexdigest()
+
+
+def room_change(old: dict, new: dict) -> str | None:
+    ko, kn = (old.get("kurs") or old.get("fach") or "").upper(), (new.get("kurs") or new.get("fach") or "").upper()
+    ro, rn = (old.get("raum") or "").strip().upper(), (new.get("raum") or "").strip().upper()
+
+    # ignore if the new entry doesn't specify a room
+    if not rn:
+        return None
+
+    if old["stunde"] == new["stunde"] and ko == kn and ro != rn:
+        return f"Raumänderung: Stunde {new['stunde']} {kn} {old.get('raum') or '---'} → {new.get('raum') or '---'}"
+    return None
+
+
+def teacher_change(old: dict, new: dict) -> str | None:
+    kurs = (new.get("kurs") or new.get("fach") or "").upper()
+    if not (old.get("lehrer") and new.get("lehrer")):
+        return None
+    return f"Lehrerwechsel: Stunde {new['stunde']} {kurs} {old['lehrer']} → {new['lehrer']}"
+
+
+def time_change(old: dict, new: dict) -> str | None:
+    kurs = (new.get("kurs") or new.get("fach") or "").upper()
+    if not (new.get("beginn") or new.get("ende")):
+        return None
+    span = lambda e: f"{e.get('beginn') or '--'}-{e.get('ende') or '--'}"
+    return f"Zeitänderung: Stunde {new['stunde']} {kurs} {span(old)} → {span(new)}"
+
+
+def alert_lines(day: dt.date, changes: Changeset, scope: tuple = ()) -> list[tuple[str, str]]:
+    """Ausfälle, Raum-, Lehrer- und Zeitänderungen als ``(fingerprint, "• …")``.
+
+    Ob eine Zeile schon gemeldet wurde, entscheidet der Aufrufer anhand des
+    Fingerprints; ``scope`` trennt die Fingerprints verschiedener Abos.
+    ``added``/``removed`` werden bewusst nicht gemeldet: ein Ausfall steht
+    als eigene ``---``-Zeile im Plan (``cancelled``), der Rest sind
+    Umstellungen, die der Plan ohnehin zeigt.  Sie landen nur im Verlauf.
+    """
+
+    out: list[tuple[str, str]] = []
+    # 1) Ausfälle
+    for e in changes.cancelled:
+        raw = (f"{day:%Y-%m-%d} ▸ Ausfall in Stunde {e['stunde']} – "
+               f"{e['info'] or ''} - {e.get('kurs') or ''}")
+        out.append((alert_key(day, "ausfall", e["stunde"], e["kurs"], *scope), f"• {canon(raw)}"))
+
+    # 2) Raumänderungen
+    for o, e in changes.room:
+        txt = room_change(o, e)
+        if txt:
+            key = alert_key(day, "raum", e["stunde"], e["kurs"] or e["fach"], e["raum"], *scope)
+            out.append((key, f"• {canon(f'{day:%Y-%m-%d} ▸ {txt}')}"))
+
+    # 3) Lehrerwechsel
+    for o, e in changes.teacher:
+        txt = teacher_change(o, e)
+        if txt:
+            key = alert_key(day, "lehrer", e["stunde"], e["kurs"] or e["fach"], e["lehrer"], *scope)
+            out.append((key, f"• {canon(f'{day:%Y-%m-%d} ▸ {txt}')}"))
+
+    # 4) Zeitänderungen
+    for o, e in changes.time:
+        txt = time_change(o, e)
+        if txt:
+            key = alert_key(day, "zeit", e["stunde"], e["kurs"] or e["fach"], e["beginn"], e["ende"], *scope)
+            out.append((key, f"• {canon(f'{day:%Y-%m-%d} ▸ {txt}')}"))
+    return out
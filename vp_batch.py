@@ -0,0 +1,204 @@
+# ------------------------------------------------------------
+# vp_batch.py
+# ------------------------------------------------------------
+#!/usr/bin/env python3
+"""Archivierte Pläne offline neu auswerten (parsen, filtern, vergleichen).
+
+Liest alle ``PlanKl<YYYYMMDD>*.xml`` (auch ``.xml.gz``) unter ``SRC`` samt
+Unterordnern, verarbeitet die Tage parallel in einem Prozess-Pool und
+schreibt nach ``OUT`` dieselben Dateien wie der Bot nach ``logs/``:
+
+* ``<YYYYMMDD>.json`` – zuletzt gemeldeter (gefilterter) Stand des Tages,
+* ``alerts.json``     – Meldungstexte, hier nach Plantag statt Abrufdatum,
+* ``history/``        – jede Fassung samt Changeset (:class:`vp_store.HistoryLog`).
+
+Die Fassungen eines Tages werden nach Änderungszeit (dann Pfad) sortiert
+und wie in ``check()`` behandelt: die erste ist "neuer Plan" ohne
+Meldungen, danach wird gegen den zuletzt gemeldeten Stand verglichen und
+pro Tag über den Fingerprint entdoppelt.  Tage sind voneinander unabhängig
+und laufen deshalb in getrennten Prozessen.
+
+    python vp_batch.py archiv/ out/
+    python vp_batch.py archiv/ out/ --kurse "GEO1:MÖW, INF1:BOSSE" --jobs 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable
+
+import vp_10e_plan as vp
+import vp_store
+
+__all__ = ["DayResult", "find_plans", "process_day", "run", "main"]
+
+_NAME_RE = re.compile(r"^PlanKl(\d{8})")
+
+
+@dataclass
+class DayResult:
+    """Ergebnis eines Tages (aus dem Worker-Prozess zurück an den Aufrufer)."""
+
+    day: str
+    klasse: str
+    versions: list[tuple[float, list[dict], dict | None]] = field(default_factory=list)
+    alerts: list[str] = field(default_factory=list)
+    plan: list[dict] | None = None
+    errors: int = 0
+
+
+def find_plans(src: str | pathlib.Path) -> dict[str, list[tuple[float, str]]]:
+    """Tag → ``[(mtime, pfad), …]`` in Verarbeitungsreihenfolge."""
+
+    found: dict[str, list[tuple[float, str]]] = {}
+    for f in pathlib.Path(src).rglob("PlanKl*"):
+        m = _NAME_RE.match(f.name)
+        if not m or not f.name.endswith((".xml", ".xml.gz")) or not f.is_file():
+            continue
+        try:
+            dt.datetime.strptime(m.group(1), "%Y%m%d")
+        except ValueError:
+            continue
+        found.setdefault(m.group(1), []).append((f.stat().st_mtime, str(f)))
+    for files in found.values():
+        files.sort()
+    return found
+
+
+def _read(path: str) -> bytes:
+    data = pathlib.Path(path).read_bytes()
+    return gzip.decompress(data) if path.endswith(".gz") else data
+
+
+def process_day(job: tuple[str, list[tuple[float, str]], str, list[tuple[str, str]]]) -> DayResult:
+    """Alle Fassungen eines Tages auswerten (läuft im Worker-Prozess)."""
+
+    day_str, files, klasse, courses = job
+    day = dt.datetime.strptime(day_str, "%Y%m%d").date()
+    flt = vp.CourseFilter(courses)
+    res = DayResult(day_str, klasse)
+    prev: list[vp.Row] | None = None   # wie state.plan(day) im Bot
+    seen: set[str] = set()
+    last_fp = None
+    for ts, path in files:
+        data = _read(path)
+        fp = hashlib.sha256(data).hexdigest()
+        if fp == last_fp:
+            continue   # Byte-gleich mit der vorigen Fassung
+        try:
+            plan = vp.parse_plan(data, klasse)
+        except ET.ParseError:
+            res.errors += 1
+            continue
+        last_fp = fp
+        mine = vp.track_lessons(plan.rows, flt.filter(plan.rows), prev or ())
+        rows = [dict(e) for e in plan.rows]
+        if prev is None:
+            prev = mine
+            res.versions.append((ts, rows, None))
+            continue
+
+        changes = vp.diff_plans(prev, mine)
+        res.versions.append((ts, rows, changes.to_dict()))
+        lines = []
+        for key, line in vp.alert_lines(day, changes):
+            if key not in seen:
+                seen.add(key)
+                lines.append(line[2:])   # ohne "• ", wie in alerts.json
+        if lines:
+            res.alerts += lines
+            prev = mine
+    res.plan = None if prev is None else [dict(e) for e in prev]
+    return res
+
+
+def run(
+    src: str | pathlib.Path,
+    out: str | pathlib.Path,
+    *,
+    jobs: int | None = None,
+    klasse: str | None = None,
+    courses: Iterable[tuple[str, str]] | None = None,
+) -> list[DayResult]:
+    """Wertet ``src`` aus und schreibt die Ergebnisse nach ``out``.
+
+    ``jobs=1`` rechnet im eigenen Prozess (ohne Pool), sonst höchstens
+    ``jobs`` Worker (Standard: alle Kerne).
+    """
+
+    out = pathlib.Path(out)
+    if (out / "history").exists():
+        raise FileExistsError(f"{out / 'history'} existiert schon – leeren Zielordner angeben")
+    klasse = klasse or vp.KLASSE
+    courses = sorted(vp.MY_COURSES if courses is None else courses)
+    work = [(day, files, klasse, courses) for day, files in sorted(find_plans(src).items())]
+
+    workers = min(jobs or os.cpu_count() or 1, len(work))
+    if workers <= 1:
+        results = [process_day(w) for w in work]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            chunk = max(1, len(work) // (workers * 4))
+            results = list(ex.map(process_day, work, chunksize=chunk))
+
+    out.mkdir(parents=True, exist_ok=True)
+    history = vp_store.HistoryLog(out / "history")
+    alerts: dict[str, list[str]] = {}
+    for res in results:
+        for ts, rows, changes in res.versions:
+            history.append(res.day, rows, changes, klasse=res.klasse, ts=ts)
+        if res.plan is not None:
+            (out / f"{res.day}.json").write_text(
+                json.dumps(res.plan, ensure_ascii=False, indent=2), encoding="utf-8"
+            )
+        if res.alerts:
+            alerts[res.day] = sorted(set(res.alerts))
+    history.flush()
+    (out / "alerts.json").write_text(json.dumps(alerts, ensure_ascii=False, indent=2), encoding="utf-8")
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    vp.config()   # .env übernehmen (VP_KLASSE, VP_KURSE), bevor Standardwerte gelesen werden
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("src", type=pathlib.Path, help="Ordner mit PlanKl*.xml")
+    ap.add_argument("out", type=pathlib.Path, help="Zielordner (Format wie logs/)")
+    ap.add_argument("--jobs", "-j", type=int, default=None, help="Worker-Prozesse (Standard: alle Kerne)")
+    ap.add_argument("--klasse", default=None, help=f"Klasse (Standard: {vp.KLASSE})")
+    ap.add_argument("--kurse", default=None, help='eigene Kurse, z. B. "GEO1:MÖW, INF1:BOSSE"')
+    ap.add_argument("--verbose", "-v", action="store_true", help="Meldungen ausgeben")
+    args = ap.parse_args(argv)
+
+    courses = vp.CourseFilter.parse(args.kurse).courses if args.kurse else None
+    t = time.perf_counter()
+    try:
+        results = run(args.src, args.out, jobs=args.jobs, klasse=args.klasse, courses=courses)
+    except FileExistsError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.verbose:
+        for res in results:
+            for line in res.alerts:
+                print(f"• {line}")
+    print(
+        f"{len(results)} Tage, {sum(len(r.versions) for r in results)} Fassungen, "
+        f"{sum(len(r.alerts) for r in results)} Meldungen, "
+        f"{sum(r.errors for r in results)} fehlerhaft – {time.perf_counter() - t:.1f} s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# ------------------------------------------------------------
+# vp_metrics.py
+# ------------------------------------------------------------
+#!/usr/bin/env python3
+"""Zähler und Zeitmessungen für Download, Tick und Zustellung.
+
+Ein globales :data:`METRICS`-Objekt sammelt, :func:`serve` stellt es lokal
+im Prometheus-Textformat bereit (``GET /metrics``), der Bot zeigt eine
+Kurzfassung mit ``!stats``.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    import http.server
+
+__all__ = ["Metrics", "METRICS", "serve"]
+
+
+@dataclass
+class _Timing:
+    count: int = 0
+    total: float = 0.0
+    last: float = 0.0
+    max: float = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+
+
+class Metrics:
+    """Thread-sichere Sammlung von Zählern, Momentwerten und Laufzeiten."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+        self.timings: dict[str, _Timing] = {}
+        self.started = time.time()
+
+    def inc(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.timings.setdefault(name, _Timing()).add(seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timings.clear()
+            self.started = time.time()
+
+    # ----- Ausgabe ----------------------------------------------------------
+    def render(self) -> str:
+        """Prometheus-Textformat (Version 0.0.4)."""
+
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            timings = {k: _Timing(**vars(v)) for k, v in self.timings.items()}
+        out: list[str] = []
+        for name, v in sorted(counters.items()):
+            out += [f"# TYPE vp_{name}_total counter", f"vp_{name}_total {v:g}"]
+        for name, v in sorted(gauges.items()):
+            out += [f"# TYPE vp_{name} gauge", f"vp_{name} {v:g}"]
+        for name, t in sorted(timings.items()):
+            out += [
+                f"# TYPE vp_{name}_seconds summary",
+                f"vp_{name}_seconds_sum {t.total:.6f}",
+                f"vp_{name}_seconds_count {t.count}",
+                f"# TYPE vp_{name}_seconds_last gauge",
+                f"vp_{name}_seconds_last {t.last:.6f}",
+                f"# TYPE vp_{name}_seconds_max gauge",
+                f"vp_{name}_seconds_max {t.max:.6f}",
+            ]
+        return "\n".join(out) + "\n"
+
+    def summary(self) -> list[str]:
+        """Kurze Textzeilen für ``!stats``."""
+
+        with self._lock:
+            up = time.time() - self.started
+            lines = [f"Laufzeit: {up / 3600:.1f} h"]
+            lines += [f"{k}: {v:g}" for k, v in sorted(self.counters.items())]
+            lines += [f"{k}: {v:g}" for k, v in sorted(self.gauges.items())]
+            lines += [
+                f"{k}: Ø {t.total / t.count * 1e3:.1f} ms, zuletzt {t.last * 1e3:.1f} ms, "
+                f"max {t.max * 1e3:.1f} ms (n={t.count})"
+                for k, t in sorted(self.timings.items()) if t.count
+            ]
+        return lines
+
+
+METRICS = Metrics()
+
+
+def serve(port: int, host: str = "127.0.0.1", metrics: Metrics = METRICS) -> http.server.ThreadingHTTPServer:
+    """Startet den ``/metrics``-Endpunkt in einem Daemon-Thread."""
+
+    import http.server   # erst hier: der Import kostet spürbar Startzeit
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True, name="metrics").start()
+    return httpd
@@ -0,0 +1,677 @@
+# ------------------------------------------------------------
+# vp_store.py
+# ------------------------------------------------------------
+#!/usr/bin/env python3
+"""Ablagen des Bots: SQLite-Backend, Snapshot-Ablage, Verlauf und Dedup-Index.
+
+Die SQLite-Ablage ist ein optionaler Ersatz für die Dateien in ``logs/``
+(aktiv mit ``VP_STORAGE=sqlite``).  Der Bot spricht weiterhin nur seine
+``load_*``/``save_*``-Funktionen an; die leiten bei Bedarf hierher um.
+Ohne SQLite landen die gefilterten XML-Snapshots im :class:`SnapshotStore`
+unter ``logs/snapshots/``.  Der :class:`HistoryLog` unter ``logs/history/``
+ist unabhängig davon und wird nie beschnitten.
+
+Einmalige Übernahme eines bestehenden ``logs/``-Ordners::
+
+    python vp_store.py migrate logs logs/vp.sqlite3
+
+Verlauf eines Tages ausgeben (eine JSON-Zeile pro Version)::
+
+    python vp_store.py history logs/history 20250528
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Iterable, Iterator
+
+__all__ = ["SqliteStore", "migrate_dir", "SnapshotStore", "HistoryLog", "DedupIndex"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    day     TEXT PRIMARY KEY,          -- YYYYMMDD
+    payload TEXT NOT NULL              -- JSON wie logs/<day>.json
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    day TEXT    NOT NULL,
+    n   INTEGER NOT NULL,              -- 1, 2, ... wie <day>_<n>.xml
+    xml TEXT    NOT NULL,
+    PRIMARY KEY (day, n)
+);
+CREATE TABLE IF NOT EXISTS alerts (
+    day TEXT NOT NULL,
+    msg TEXT NOT NULL,
+    PRIMARY KEY (day, msg)
+);
+CREATE TABLE IF NOT EXISTS digests (
+    name  TEXT PRIMARY KEY,            -- "last" bzw. "fp:<day>"
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dedup (
+    key     TEXT PRIMARY KEY,          -- Fingerprint einer Meldung
+    expires REAL NOT NULL              -- Unix-Zeit
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    channel INTEGER NOT NULL,
+    n       INTEGER NOT NULL,          -- Reihenfolge innerhalb des Channels
+    text    TEXT    NOT NULL,
+    PRIMARY KEY (channel, n)
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    sub     TEXT PRIMARY KEY,          -- Discord-User-ID
+    payload TEXT NOT NULL              -- JSON wie in subscriptions.json
+);
+"""
+
+
+class SqliteStore:
+    """Dünne Hülle um eine SQLite-Datenbank im WAL-Modus.
+
+    Eine Verbindung für alle Threads (der Bot schreibt aus einem
+    Worker-Thread), abgesichert durch ein Lock.
+    """
+
+    def __init__(self, path: str | pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def _query(self, sql: str, args: Iterable = ()) -> list[tuple]:
+        with self._lock:
+            return self.conn.execute(sql, tuple(args)).fetchall()
+
+    # -- Tagespläne -----------------------------------------------------------
+    def load_plan(self, day: str) -> list[dict] | None:
+        rows = self._query("SELECT payload FROM plans WHERE day = ?", (day,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_plan(self, day: str, payload: list[dict]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO plans (day, payload) VALUES (?, ?)",
+                (day, json.dumps(payload, ensure_ascii=False)),
+            )
+
+    # -- Snapshots ------------------------------------------------------------
+    def last_snapshot(self, day: str) -> str | None:
+        rows = self._query(
+            "SELECT xml FROM snapshots WHERE day = ? ORDER BY n DESC LIMIT 1", (day,)
+        )
+        return rows[0][0] if rows else None
+
+    def add_snapshot(self, day: str, xml: str) -> int:
+        """Hängt eine neue Version an und liefert ihre Nummer."""
+
+        with self._lock, self.conn:
+            (n,) = self.conn.execute(
+                "SELECT COALESCE(MAX(n), 0) + 1 FROM snapshots WHERE day = ?", (day,)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT INTO snapshots (day, n, xml) VALUES (?, ?, ?)", (day, n, xml)
+            )
+        return n
+
+    # -- Alerts ---------------------------------------------------------------
+    def load_alerts(self, since: str) -> dict[str, set[str]]:
+        alerts: dict[str, set[str]] = {}
+        for day, msg in self._query("SELECT day, msg FROM alerts WHERE day >= ?", (since,)):
+            alerts.setdefault(day, set()).add(msg)
+        return alerts
+
+    def save_alerts(self, alerts: dict[str, set[str]]) -> None:
+        """Gleicht die Tabelle mit ``alerts`` ab (fehlende Tage werden gelöscht)."""
+
+        with self._lock, self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_days (day TEXT)")
+            self.conn.execute("DELETE FROM keep_days")
+            self.conn.executemany("INSERT INTO keep_days VALUES (?)", ((d,) for d in alerts))
+            self.conn.execute("DELETE FROM alerts WHERE day NOT IN (SELECT day FROM keep_days)")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO alerts (day, msg) VALUES (?, ?)",
+                ((d, m) for d, msgs in alerts.items() for m in msgs),
+            )
+
+    # -- Digests / Fingerprints -----------------------------------------------
+    def read_digest(self, name: str = "last") -> str | None:
+        rows = self._query("SELECT value FROM digests WHERE name = ?", (name,))
+        return rows[0][0] if rows else None
+
+    def write_digest(self, value: str, name: str = "last") -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO digests (name, value) VALUES (?, ?)", (name, value)
+            )
+
+    def load_fingerprints(self) -> dict[str, str]:
+        rows = self._query("SELECT name, value FROM digests WHERE name LIKE 'fp:%'")
+        return {name[3:]: value for name, value in rows}
+
+    def save_fingerprints(self, fps: dict[str, str]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM digests WHERE name LIKE 'fp:%'")
+            self.conn.executemany(
+                "INSERT INTO digests (name, value) VALUES (?, ?)",
+                ((f"fp:{d}", v) for d, v in fps.items()),
+            )
+
+    def load_dedup(self) -> dict[str, float]:
+        return dict(self._query("SELECT key, expires FROM dedup ORDER BY expires"))
+
+    def save_dedup(self, entries: dict[str, float]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM dedup")
+            self.conn.executemany(
+                "INSERT INTO dedup (key, expires) VALUES (?, ?)", entries.items()
+            )
+
+    # -- Abos -----------------------------------------------------------------
+    def load_subscriptions(self) -> dict[str, dict]:
+        return {s: json.loads(p) for s, p in self._query("SELECT sub, payload FROM subscriptions")}
+
+    def save_subscriptions(self, subs: dict[str, dict]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM subscriptions")
+            self.conn.executemany(
+                "INSERT INTO subscriptions (sub, payload) VALUES (?, ?)",
+                ((s, json.dumps(p, ensure_ascii=False)) for s, p in subs.items()),
+            )
+
+    # -- Warteschlange --------------------------------------------------------
+    def load_outbox(self) -> dict[int, list[str]]:
+        out: dict[int, list[str]] = {}
+        for ch, text in self._query("SELECT channel, text FROM outbox ORDER BY channel, n"):
+            out.setdefault(ch, []).append(text)
+        return out
+
+    def save_outbox(self, outbox: dict[int, list[str]]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM outbox")
+            self.conn.executemany(
+                "INSERT INTO outbox (channel, n, text) VALUES (?, ?, ?)",
+                ((ch, n, t) for ch, texts in outbox.items() for n, t in enumerate(texts)),
+            )
+
+    # -- Aufräumen ------------------------------------------------------------
+    def prune(self, keep: set[str], today: str) -> None:
+        """Wie ``prune_logs``: vergangene Tage außerhalb von ``keep`` löschen.
+
+        Zusätzliche Snapshot-Versionen (n > 1) vergangener Tage fallen
+        immer weg – wie die ``<day>_<n>.xml``-Dateien.
+        """
+
+        with self._lock, self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_days (day TEXT)")
+            self.conn.execute("DELETE FROM keep_days")
+            self.conn.executemany("INSERT INTO keep_days VALUES (?)", ((d,) for d in keep))
+            self.conn.execute(
+                "DELETE FROM plans WHERE day < ? AND day NOT IN (SELECT day FROM keep_days)",
+                (today,),
+            )
+            self.conn.execute(
+                "DELETE FROM snapshots WHERE day < ? "
+                "AND (n > 1 OR day NOT IN (SELECT day FROM keep_days))",
+                (today,),
+            )
+
+
+def _write_atomic(path: pathlib.Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class SnapshotStore:
+    """Inhaltsadressierte Ablage der gefilterten XML-Snapshots.
+
+    Jede unterschiedliche Version liegt genau einmal gzip-komprimiert als
+    ``blobs/<sha256>.xml.gz``; ``manifest.json`` hält pro Tag die Hashes
+    in Eingangsreihenfolge.  Das Manifest lebt im Speicher, neue Versionen
+    werden erst mit :meth:`flush` geschrieben.
+    """
+
+    def __init__(self, root: str | pathlib.Path) -> None:
+        self.root = pathlib.Path(root)
+        self.blobs = self.root / "blobs"
+        self.manifest_path = self.root / "manifest.json"
+        self._manifest: dict[str, list[str]] | None = None
+        self._known: set[str] = set()             # Hashes mit Blob auf der Platte
+        self._pending: dict[str, str] = {}        # Hash → XML, noch zu schreiben
+        self._dirty = False
+
+    @property
+    def manifest(self) -> dict[str, list[str]]:
+        if self._manifest is None:
+            try:
+                self._manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._manifest = {}
+            self._known = {h for hs in self._manifest.values() for h in hs}
+        return self._manifest
+
+    def exists(self) -> bool:
+        return self.manifest_path.exists()
+
+    def versions(self, day: str) -> list[str]:
+        return list(self.manifest.get(day, ()))
+
+    def has(self, day: str) -> bool:
+        return bool(self.manifest.get(day))
+
+    def add(self, day: str, xml: str) -> bool:
+        """Merkt ``xml`` als neue Version von ``day`` vor.
+
+        ``False``, wenn es dieselbe Fassung wie die letzte des Tages ist.
+        """
+
+        h = hashlib.sha256(xml.encode("utf-8")).hexdigest()
+        hs = self.manifest.setdefault(day, [])
+        if hs and hs[-1] == h:
+            return False
+        if h not in self._known:
+            self._pending[h] = xml
+        hs.append(h)
+        self._dirty = True
+        return True
+
+    def read(self, day: str, n: int = -1) -> str | None:
+        """Version ``n`` (Standard: die letzte) von ``day``."""
+
+        hs = self.manifest.get(day)
+        if not hs:
+            return None
+        h = hs[n]
+        if h in self._pending:
+            return self._pending[h]
+        return gzip.decompress((self.blobs / f"{h}.xml.gz").read_bytes()).decode("utf-8")
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        for h, xml in list(self._pending.items()):
+            _write_atomic(self.blobs / f"{h}.xml.gz", gzip.compress(xml.encode("utf-8")))
+            self._known.add(h)
+            del self._pending[h]
+        _write_atomic(
+            self.manifest_path,
+            json.dumps(self.manifest, indent=1, sort_keys=True).encode("utf-8"),
+        )
+        self._dirty = False
+
+    def prune(self, keep: set[str], today: str) -> None:
+        """Wie ``prune_logs``: vergangene Tage außerhalb von ``keep`` fallen
+        weg, von den übrigen vergangenen Tagen bleibt nur die erste Version.
+        Nicht mehr referenzierte Blobs werden gelöscht.
+        """
+
+        for day in [d for d in self.manifest if d < today]:
+            if day in keep:
+                if len(self.manifest[day]) > 1:
+                    self.manifest[day] = self.manifest[day][:1]
+                    self._dirty = True
+            else:
+                del self.manifest[day]
+                self._dirty = True
+        if not self._dirty:
+            return
+        used = {h for hs in self.manifest.values() for h in hs}
+        for h in [h for h in self._known | set(self._pending) if h not in used]:
+            self._pending.pop(h, None)
+            self._known.discard(h)
+            try:
+                (self.blobs / f"{h}.xml.gz").unlink()
+            except OSError:
+                pass
+        self.flush()
+
+    def import_legacy(self, src: str | pathlib.Path) -> int:
+        """Übernimmt alte ``<day>[_<n>].xml``-Dateien aus ``src``."""
+
+        files: list[tuple[str, int, pathlib.Path]] = []
+        for f in pathlib.Path(src).glob("*.xml"):
+            day, _, n = f.stem.partition("_")
+            try:
+                dt.datetime.strptime(day, "%Y%m%d")
+                files.append((day, int(n or 1), f))
+            except ValueError:
+                continue
+        for day, _, f in sorted(files):
+            self.add(day, _read_text(f))
+        self.flush()
+        return len(files)
+
+
+class HistoryLog:
+    """Append-only-Verlauf aller beobachteten Planfassungen.
+
+    ``plans.log.gz`` ist eine Folge unabhängiger gzip-Member mit je einem
+    JSON-Datensatz::
+
+        {"day": "20250528", "v": 2, "ts": 1716879000.0, "klasse": "10E",
+         "sha": "…", "rows": [<Row-Dicts wie parse_xml>], "changes": {…} | null}
+
+    ``plans.idx`` hält pro Datensatz ``day v offset length sha`` – damit
+    lässt sich jede Fassung lesen, ohne die ganze Datei zu entpacken.  Fehlt
+    der Index oder ist er kürzer als das Log (Absturz zwischen beiden
+    Schreibvorgängen), wird er aus dem Log nachgezogen.  Neue Datensätze
+    werden gepuffert und mit :meth:`flush` angehängt.
+    """
+
+    def __init__(self, root: str | pathlib.Path) -> None:
+        self.root = pathlib.Path(root)
+        self.log_path = self.root / "plans.log.gz"
+        self.idx_path = self.root / "plans.idx"
+        self._index: dict[str, list[tuple[int, int, str]]] | None = None
+        self._pending: list[dict] = []
+        self._lock = threading.Lock()
+
+    # ----- Index ------------------------------------------------------------
+    @property
+    def index(self) -> dict[str, list[tuple[int, int, str]]]:
+        if self._index is None:
+            self._index = {}
+            end = 0
+            try:
+                lines = self.idx_path.read_text(encoding="utf-8").splitlines()
+            except FileNotFoundError:
+                lines = []
+            for line in lines:
+                try:
+                    day, _, off, length, sha = line.split()
+                    entry = (int(off), int(length), sha)
+                except ValueError:
+                    continue                 # halb geschriebene Zeile
+                self._index.setdefault(day, []).append(entry)
+                end = max(end, entry[0] + entry[1])
+            self._recover(end)
+        return self._index
+
+    def _recover(self, start: int) -> None:
+        """Datensätze hinter ``start`` aus dem Log in den Index übernehmen."""
+
+        try:
+            size = self.log_path.stat().st_size
+        except FileNotFoundError:
+            return
+        if size <= start:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        pos, lines = 0, []
+        while pos < len(data):
+            d = zlib.decompressobj(wbits=31)
+            try:
+                rec = json.loads(d.decompress(data[pos:]))
+            except (zlib.error, ValueError):
+                break
+            if not d.eof:
+                break
+            length = len(data) - pos - len(d.unused_data)
+            self._index.setdefault(rec["day"], []).append((start + pos, length, rec["sha"]))
+            lines.append(f"{rec['day']} {rec['v']} {start + pos} {length} {rec['sha']}\n")
+            pos += length
+        if start + pos < size:               # abgeschnittener Rest eines Absturzes
+            with open(self.log_path, "r+b") as f:
+                f.truncate(start + pos)
+        if lines:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.idx_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+
+    # ----- Schreiben --------------------------------------------------------
+    def append(self, day: str, rows: Iterable, changes: dict | None = None,
+               *, klasse: str | None = None, ts: float | None = None) -> int | None:
+        """Merkt eine Fassung von ``day`` vor und liefert ihre Versionsnummer.
+
+        ``None``, wenn ``rows`` mit der letzten Fassung des Tages übereinstimmt.
+        """
+
+        rows = [dict(r) for r in rows]
+        sha = hashlib.sha256(
+            json.dumps(rows, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        with self._lock:
+            known = self.index.get(day, [])
+            pending = [r for r in self._pending if r["day"] == day]
+            last = pending[-1]["sha"] if pending else (known[-1][2] if known else None)
+            if last == sha:
+                return None
+            v = len(known) + len(pending) + 1
+            self._pending.append({
+                "day": day, "v": v, "ts": time.time() if ts is None else ts,
+                "klasse": klasse, "sha": sha, "rows": rows, "changes": changes,
+            })
+            return v
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            index = self.index
+            self.root.mkdir(parents=True, exist_ok=True)
+            lines = []
+            with open(self.log_path, "ab") as log:
+                off = log.tell()
+                for rec in self._pending:
+                    blob = gzip.compress(json.dumps(rec, ensure_ascii=False).encode("utf-8"))
+                    log.write(blob)
+                    index.setdefault(rec["day"], []).append((off, len(blob), rec["sha"]))
+                    lines.append(f"{rec['day']} {rec['v']} {off} {len(blob)} {rec['sha']}\n")
+                    off += len(blob)
+                log.flush()
+                os.fsync(log.fileno())
+            with open(self.idx_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+            self._pending.clear()
+
+    # ----- Lesen ------------------------------------------------------------
+    def days(self) -> list[str]:
+        with self._lock:
+            return sorted(set(self.index) | {r["day"] for r in self._pending})
+
+    def versions(self, day: str) -> int:
+        with self._lock:
+            return len(self.index.get(day, ())) + sum(r["day"] == day for r in self._pending)
+
+    def read(self, day: str, version: int = -1) -> dict | None:
+        """Datensatz ``version`` (1-basiert, ``-1`` = letzte) von ``day``."""
+
+        with self._lock:
+            entries = list(self.index.get(day, ()))
+            pending = [r for r in self._pending if r["day"] == day]
+        total = len(entries) + len(pending)
+        n = total + version + 1 if version < 0 else version
+        if not 1 <= n <= total:
+            return None
+        if n > len(entries):
+            return pending[n - len(entries) - 1]
+        off, length, _ = entries[n - 1]
+        with open(self.log_path, "rb") as f:
+            f.seek(off)
+            return json.loads(gzip.decompress(f.read(length)))
+
+    def replay(self, day: str | None = None) -> Iterator[dict]:
+        """Alle Datensätze (eines Tages) in Versionsreihenfolge."""
+
+        for d in ([day] if day is not None else self.days()):
+            for v in range(1, self.versions(d) + 1):
+                rec = self.read(d, v)
+                if rec is not None:
+                    yield rec
+
+
+class DedupIndex:
+    """Schon gemeldete Meldungs-Fingerprints mit Ablaufzeit.
+
+    Mitgliedschaft ist O(1).  Da alle Einträge dieselbe Lebensdauer haben,
+    entspricht die Einfügereihenfolge der Ablaufreihenfolge – :meth:`expire`
+    muss also nur vorne abräumen.  Mehr als ``max_entries`` Einträge werden
+    ebenfalls von vorne verdrängt.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 50_000) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        expires = self._entries.get(key)
+        return expires is not None and expires > time.time()
+
+    def add(self, key: str, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        self._entries[key] = now + self.ttl
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def expire(self, now: float | None = None) -> int:
+        """Abgelaufene Einträge entfernen; liefert deren Anzahl."""
+
+        now = time.time() if now is None else now
+        n = 0
+        while self._entries:
+            key, expires = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+            n += 1
+        return n
+
+    def to_dict(self) -> dict[str, float]:
+        return dict(self._entries)
+
+    @classmethod
+    def from_dict(cls, entries: dict[str, float], ttl: float, max_entries: int = 50_000) -> "DedupIndex":
+        idx = cls(ttl, max_entries)
+        for key, expires in sorted(entries.items(), key=lambda kv: kv[1]):
+            idx._entries[key] = expires
+        return idx
+
+
+def _read_text(path: pathlib.Path) -> str:
+    try:
+        return path.read_text(encoding="utf-8")
+    except UnicodeDecodeError:
+        return path.read_text(encoding="latin-1")
+
+
+def migrate_dir(src: str | pathlib.Path, store: SqliteStore) -> int:
+    """Übernimmt einen bestehenden ``logs/``-Ordner in ``store``.
+
+    Liefert die Zahl der übernommenen Dateien.  Vorhandene Einträge werden
+    überschrieben, Snapshots nur übernommen, wenn der Tag noch keine hat.
+    """
+
+    src = pathlib.Path(src)
+    count = 0
+    for f in sorted(src.glob("*.json")):
+        try:
+            dt.datetime.strptime(f.stem, "%Y%m%d")
+        except ValueError:
+            continue
+        store.save_plan(f.stem, json.loads(_read_text(f)))
+        count += 1
+
+    snaps: dict[str, list[tuple[int, pathlib.Path]]] = {}
+    for f in src.glob("*.xml"):
+        day, _, n = f.stem.partition("_")
+        try:
+            dt.datetime.strptime(day, "%Y%m%d")
+        except ValueError:
+            continue
+        snaps.setdefault(day, []).append((int(n or 1), f))
+    for day, files in sorted(snaps.items()):
+        if store.last_snapshot(day) is not None:
+            continue
+        for _, f in sorted(files):
+            store.add_snapshot(day, _read_text(f))
+            count += 1
+
+    alerts = src / "alerts.json"
+    if alerts.exists() and _read_text(alerts).strip():
+        data = json.loads(_read_text(alerts))
+        store.save_alerts({d: set(m) for d, m in data.items()})
+        count += 1
+    digest = src / "last_digest.txt"
+    if digest.exists():
+        store.write_digest(_read_text(digest).strip())
+        count += 1
+    fps = src / "fingerprints.json"
+    if fps.exists():
+        store.save_fingerprints(json.loads(_read_text(fps)))
+        count += 1
+    subs = src / "subscriptions.json"
+    if subs.exists():
+        store.save_subscriptions(json.loads(_read_text(subs)))
+        count += 1
+    # Abo-Fingerprints stehen nicht in alerts.json – ohne dedup.json würde
+    # alles noch einmal gemeldet
+    dedup = src / "dedup.json"
+    if dedup.exists():
+        store.save_dedup(json.loads(_read_text(dedup)))
+        count += 1
+    # noch nicht zugestellte Nachrichten
+    outbox = src / "outbox.json"
+    if outbox.exists():
+        data = json.loads(_read_text(outbox))
+        store.save_outbox({int(ch): texts for ch, texts in data.items()})
+        count += 1
+    return count
+
+
+def main(argv: list[str] | None = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("migrate", help="logs/-Ordner in eine SQLite-Datei übernehmen")
+    m.add_argument("src", help="Quellordner (z. B. logs)")
+    m.add_argument("db", help="Ziel-Datenbank (z. B. logs/vp.sqlite3)")
+    h = sub.add_parser("history", help="Verlauf eines Tages als JSON-Zeilen ausgeben")
+    h.add_argument("root", help="Verlaufsordner (z. B. logs/history)")
+    h.add_argument("day", nargs="?", help="Tag als YYYYMMDD (Standard: alle)")
+    h.add_argument("-v", "--version", type=int, help="nur diese Version (-1 = letzte)")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "history":
+        log = HistoryLog(args.root)
+        if args.version is not None and args.day:
+            recs = [r for r in [log.read(args.day, args.version)] if r is not None]
+        else:
+            recs = log.replay(args.day)
+        for rec in recs:
+            print(json.dumps(rec, ensure_ascii=False))
+        return
+
+    store = SqliteStore(args.db)
+    try:
+        n = migrate_dir(args.src, store)
+    finally:
+        store.close()
+    print(f"{n} Dateien übernommen → {args.db}")
+
+
+if __name__ == "__main__":
+    main()